@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.fake_openai_server import FakeOpenAIState, start_server
+from benchmarks.synthetic import synthetic_reviews
+from embedding_analysis.embedding_client import EmbeddingClient
+
+
+def run_client(url: str, texts: list, concurrency: int, max_inputs_per_request: int) -> dict:
+    client = EmbeddingClient('fake-key', url=url, concurrency=concurrency, max_inputs_per_request=max_inputs_per_request,
+                             requests_per_minute=100_000, tokens_per_minute=100_000_000)
+    start = time.perf_counter()
+    embedded = sum(len(row_ids) for row_ids, _ in client.embed(list(range(len(texts))), texts))
+    elapsed = time.perf_counter() - start
+    client.close()
+
+    return {
+        'concurrency': concurrency,
+        'batch_size': max_inputs_per_request,
+        'embedded': embedded,
+        'failed': len(client.failed_row_ids),
+        'seconds': round(elapsed, 3),
+        'reviews_per_sec': round(embedded / elapsed, 1),
+        'requests': client.request_count,
+        'retries': client.retry_count,
+        'throttled': client.limiter.throttled,
+    }
+
+
+def main(count: int, latency: float, rpm: int, failure_rate: float) -> None:
+    """
+    Compare the old one-review-per-request pattern with batched, concurrent clients against a local fake server.
+    """
+
+    state = FakeOpenAIState(latency=latency, requests_per_minute=rpm, failure_rate=failure_rate)
+    server = start_server(state)
+    url = f'http://{server.server_address[0]}:{server.server_address[1]}/v1/embeddings'
+    texts = synthetic_reviews(count)
+
+    configurations = [(1, 1), (1, 64), (4, 64), (8, 128)]
+    for concurrency, batch_size in configurations:
+        sample = texts[:min(count, 200)] if batch_size == 1 else texts
+        print(run_client(url, sample, concurrency, batch_size))
+
+    print(f'server counters: {state.counts}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark embedding client throughput and retry behaviour offline.')
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.05, help='Base server latency per request in seconds')
+    parser.add_argument('--rpm', type=int, default=None, help='Server-side requests-per-minute limit that triggers 429s')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with a 500')
+    args = parser.parse_args()
+
+    main(args.count, args.latency, args.rpm, args.failure_rate)
@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import nltk
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.fake_openai_server import FakeOpenAIState, start_server
+from benchmarks.synthetic import write_fake_embeddings, write_raw_clinics
+from common.reviews import review_ids
+from common.table_io import read_table, write_table
+from data_cleaning import anonymize_reviews
+from data_cleaning.clean_reviews import clean_reviews
+from database.anon_embedding_csv_to_postgres import load_reviews
+from embedding_analysis import generate_embeddings
+from embedding_analysis.embedding_store import EmbeddingStore
+from embedding_analysis.umap_visualization import dimension_reduction
+from sentiment_analysis.score_sentiment import score_texts
+from word_count_analysis import cluster_reviews
+from word_count_analysis.analyze_clusters import calculate_word_counts
+from word_count_analysis.preprocess_reviews import OUTPUT_COLUMN, preprocess_table
+
+PREPROCESS_DATA = ('corpora/stopwords', 'corpora/wordnet')
+VADER_DATA = ('sentiment/vader_lexicon.zip',)
+
+
+def missing_nltk_data(resources: tuple) -> list:
+    missing = []
+    for name in resources:
+        try:
+            nltk.data.find(name)
+        except LookupError:
+            missing.append(name)
+    return missing
+
+
+def code_version() -> dict:
+    """
+    Git commit of the scripts being measured, and whether the working tree had uncommitted changes.
+    """
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=directory, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--', '..'], cwd=directory, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': 'unknown', 'dirty': None}
+    return {'commit': commit, 'dirty': dirty}
+
+
+class Stages:
+    """
+    Collects one result per stage and size: wall-clock seconds and rows per second, or the reason
+    the stage was skipped in this environment.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.results = []
+
+    def run(self, stage: str, rows: int, function, *arguments, **options):
+        print(f'[{self.size}] {stage}: {rows} rows')
+        start = time.perf_counter()
+        value = function(*arguments, **options)
+        seconds = time.perf_counter() - start
+        self.results.append({'size': self.size, 'stage': stage, 'rows': int(rows), 'status': 'ok', 'seconds': round(seconds, 3),
+                             'rows_per_sec': round(rows / max(seconds, 1e-9), 1)})
+        return value
+
+    def skip(self, stage: str, reason: str) -> None:
+        print(f'[{self.size}] {stage}: skipped ({reason})')
+        self.results.append({'size': self.size, 'stage': stage, 'rows': 0, 'status': 'skipped', 'reason': reason})
+
+
+def run_suite(directory: str, size: int, num_clusters: int = 9, dim: int = 1536, api_count: int = 500, scorer: str = 'VADER',
+              dsn: str = None, workers: int = None, seed: int = 0) -> list:
+    """
+    Run every pipeline stage once on a synthetic corpus of about size raw reviews, each stage reading the
+    previous stage's output. Stages whose dependency is missing here (NLTK data, umap-learn, a Postgres
+    server) are recorded as skipped. The two API stages run on the first api_count reviews against a
+    local fake OpenAI server, with every review sent to the chat API (no rule pass) and embeddings of
+    generate_embeddings' own dimension; dim only sets the synthetic store of the UMAP and load stages.
+    The rule pass is timed separately, on the same reviews.
+    """
+
+    stages = Stages(size)
+    raw_dir = os.path.join(directory, 'raw')
+    cleaned_dir = os.path.join(directory, 'cleaned')
+    preprocessed_path = os.path.join(directory, 'preprocessed.parquet')
+    clustered_path = os.path.join(directory, 'clustered.parquet')
+    store_dir = os.path.join(directory, 'store')
+
+    start = time.perf_counter()
+    write_raw_clinics(raw_dir, size, seed=seed)
+    print(f'[{size}] generated the raw clinic files in {time.perf_counter() - start:.1f}s')
+
+    rows = stages.run('clean_reviews', size, clean_reviews, raw_dir, cleaned_dir, workers, overwrite=True)
+
+    missing = missing_nltk_data(PREPROCESS_DATA)
+    if missing:
+        # Later stages still need a preprocessed column; lowercased text stands in for it.
+        stages.skip('preprocess_text', f'NLTK data not installed: {", ".join(missing)}')
+        df = read_table(cleaned_dir)
+        write_table(df.assign(**{OUTPUT_COLUMN: df['Review_Text'].str.lower()}), preprocessed_path)
+    else:
+        stages.run('preprocess_text', rows, preprocess_table, cleaned_dir, preprocessed_path, workers=workers)
+
+    stages.run('tfidf_kmeans', rows, cluster_reviews.main, preprocessed_path, num_clusters, clustered_path, overwrite=True)
+    stages.run('tfidf_kmeans_streaming', rows, cluster_reviews.main, preprocessed_path, num_clusters,
+               os.path.join(directory, 'clustered_streaming.parquet'), overwrite=True, streaming=True)
+
+    df = read_table(clustered_path)
+    stages.run('calculate_word_counts', rows, calculate_word_counts, df)
+
+    missing = missing_nltk_data(VADER_DATA) if scorer.upper() == 'VADER' else []
+    if missing:
+        stages.skip('sentiment', f'NLTK data not installed: {", ".join(missing)}')
+    else:
+        stages.run('sentiment', rows, score_texts, df['Review_Text'].to_list(), scorer, workers)
+
+    write_fake_embeddings(store_dir, review_ids(df), dim, seed=seed)
+    if importlib.util.find_spec('umap') is None:
+        stages.skip('umap', 'umap-learn is not installed')
+    else:
+        row_ids, matrix = EmbeddingStore(store_dir).load()
+        stages.run('umap', rows, dimension_reduction, matrix, 'umap', 2, row_ids)
+
+    if dsn is None:
+        stages.skip('postgres_load', 'no DSN given')
+    else:
+        try:
+            connection = create_engine(dsn).raw_connection()
+        except (ImportError, OperationalError) as err:
+            stages.skip('postgres_load', str(err).strip().splitlines()[0])
+        else:
+            try:
+                stages.run('postgres_load', rows, load_reviews, connection, clustered_path, store_dir, 'bench_pipeline_reviews', overwrite=True)
+            finally:
+                connection.close()
+
+    api_input = os.path.join(directory, 'api_input.parquet')
+    anonymized_path = os.path.join(directory, 'anonymized.parquet')
+    sample = df.head(api_count)
+    write_table(sample, api_input)
+
+    state = FakeOpenAIState(dim=generate_embeddings.EMBEDDING_DIM, latency=0.02)
+    server = start_server(state)
+    base_url = f'http://{server.server_address[0]}:{server.server_address[1]}/v1'
+    try:
+        stages.run('anonymize_reviews', sample.shape[0], asyncio.run,
+                   anonymize_reviews.main(api_input, anonymized_path, 'fake-key', url=f'{base_url}/chat/completions', rule_pass=False))
+        stages.run('anonymize_rule_pass', sample.shape[0], asyncio.run,
+                   anonymize_reviews.main(api_input, os.path.join(directory, 'rule_anonymized.parquet'), 'fake-key',
+                                          url=f'{base_url}/chat/completions', rule_pass=True))
+        stages.run('generate_embeddings', sample.shape[0], generate_embeddings.main, anonymized_path, os.path.join(directory, 'api_store'),
+                   'fake-key', overwrite=True, url=f'{base_url}/embeddings')
+    finally:
+        server.shutdown()
+    print(f'[{size}] fake server counters: {state.counts}')
+
+    return stages.results
+
+
+def compare_runs(baseline: dict, current: dict, tolerance: float = 0.2) -> pd.DataFrame:
+    """
+    Seconds per stage and size of two result files, side by side. A stage is flagged as a regression when
+    it got slower than the baseline by more than the tolerance.
+    """
+
+    columns = ['size', 'stage', 'seconds']
+    before = pd.DataFrame(baseline['results']).query("status == 'ok'").reindex(columns=columns)
+    after = pd.DataFrame(current['results']).query("status == 'ok'").reindex(columns=columns)
+    report = before.merge(after, on=['size', 'stage'], suffixes=('_baseline', '_current'))
+    report['ratio'] = (report['seconds_current'] / report['seconds_baseline']).round(3)
+    report['regression'] = report['ratio'] > 1 + tolerance
+    return report
+
+
+def main(counts, results_dir: str, num_clusters: int, dim: int, api_count: int, scorer: str, dsn: str, workers: int, seed: int,
+         baseline_json: str = None) -> str:
+    """
+    Run the suite at each corpus size and write the results, with the code version and machine they were
+    measured on, to a timestamped JSON file in results_dir. With a baseline result file, print the
+    per-stage comparison against it. Returns the path of the written file.
+    """
+
+    if baseline_json is not None and not os.path.exists(baseline_json):
+        raise FileNotFoundError(f"The baseline file '{baseline_json}' does not exist.")
+
+    version = code_version()
+    created = datetime.now(timezone.utc)
+    results = []
+    for count in counts:
+        with tempfile.TemporaryDirectory() as directory:
+            results += run_suite(directory, count, num_clusters, dim, api_count, scorer, dsn, workers, seed)
+
+    run = {
+        'suite': 'pipeline',
+        'version': version,
+        'created': created.isoformat(timespec='seconds'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'settings': {'counts': list(counts), 'num_clusters': num_clusters, 'dim': dim, 'api_count': api_count, 'scorer': scorer,
+                     'workers': workers, 'seed': seed, 'postgres': dsn is not None},
+        'results': results,
+    }
+
+    os.makedirs(results_dir, exist_ok=True)
+    output_json = os.path.join(results_dir, f"pipeline-{created.strftime('%Y%m%dT%H%M%SZ')}-{version['commit']}.json")
+    with open(output_json, 'w') as f:
+        json.dump(run, f, indent=2)
+
+    print(pd.DataFrame(results).to_string(index=False))
+    print(f'Wrote {output_json}')
+
+    if baseline_json is not None:
+        with open(baseline_json) as f:
+            report = compare_runs(json.load(f), run)
+        print(report.to_string(index=False))
+        if report['regression'].any():
+            print(f"{int(report['regression'].sum())} stage(s) slower than the baseline")
+
+    return output_json
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time every pipeline stage on a synthetic review corpus and store the results as JSON.')
+    parser.add_argument('--counts', type=int, nargs='+', default=[10_000], help='Corpus sizes in raw reviews, e.g. 10000 100000 1000000')
+    parser.add_argument('--results-dir', default='./output/benchmarks')
+    parser.add_argument('--num-clusters', type=int, default=9)
+    parser.add_argument('--dim', type=int, default=1536, help='Dimension of the synthetic embeddings for the UMAP and load stages')
+    parser.add_argument('--api-count', type=int, default=500, help='Reviews sent to the fake OpenAI server by the two API stages')
+    parser.add_argument('--scorer', default='VADER')
+    parser.add_argument('--dsn', default=os.getenv('BENCH_POSTGRES_DSN'), help='Local Postgres for the load stage; skipped when not set')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=None, help='Earlier result file to compare against')
+    args = parser.parse_args()
+
+    main(args.counts, args.results_dir, args.num_clusters, args.dim, args.api_count, args.scorer, args.dsn, args.workers, args.seed,
+         args.baseline)
@@ -0,0 +1,71 @@
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.synthetic import synthetic_reviews
+from word_count_analysis.preprocess_reviews import preprocess_table, preprocess_text
+
+
+def reference_preprocess_text(text: str) -> str:
+    """
+    The original per-review implementation, kept to check output equality and measure the speedup.
+    """
+
+    text = text.lower()
+    text = re.sub(r'[^\w\s]', '', text)
+    words = text.split()
+    words = [word for word in words if word not in stopwords.words('english')]
+    lemmatizer = WordNetLemmatizer()
+    words = [lemmatizer.lemmatize(word) for word in words]
+    return ' '.join(words)
+
+
+def rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 1)
+
+
+def main(count: int, reference_count: int, workers: int) -> None:
+    """
+    Report reviews/sec for the original function, the cached engine in one process,
+    and the streaming engine over a process pool, and check that their outputs match.
+    """
+
+    reviews = synthetic_reviews(count)
+    sample = reviews[:reference_count]
+
+    start = time.perf_counter()
+    expected = [reference_preprocess_text(text) for text in sample]
+    print(f'reference: {rate(len(sample), time.perf_counter() - start)} reviews/sec on {len(sample)} reviews')
+
+    start = time.perf_counter()
+    actual = [preprocess_text(text) for text in reviews]
+    print(f'engine, single process: {rate(len(reviews), time.perf_counter() - start)} reviews/sec')
+    assert actual[:len(sample)] == expected, 'engine output differs from the reference implementation'
+
+    with tempfile.TemporaryDirectory() as directory:
+        input_csv = os.path.join(directory, 'reviews.csv')
+        output_csv = os.path.join(directory, 'preprocessed.csv')
+        pd.DataFrame({'Review_Text': reviews}).to_csv(input_csv, index=False)
+
+        start = time.perf_counter()
+        preprocess_table(input_csv, output_csv, chunksize=max(1, count // 4), workers=workers)
+        print(f'engine, streaming with {workers} workers: {rate(len(reviews), time.perf_counter() - start)} reviews/sec (including CSV I/O)')
+        assert pd.read_csv(output_csv)['Preprocessed_Review_Text'].fillna('').to_list() == actual
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark review preprocessing throughput.')
+    parser.add_argument('--count', type=int, default=100_000)
+    parser.add_argument('--reference-count', type=int, default=2_000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    main(args.count, args.reference_count, args.workers)
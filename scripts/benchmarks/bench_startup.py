@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.bench_pipeline import code_version
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Stage modules and the CLI subcommand that runs each of them.
+STAGES = {
+    'data_cleaning.clean_reviews': 'clean',
+    'data_cleaning.anonymize_reviews': 'anonymize',
+    'word_count_analysis.preprocess_reviews': 'preprocess',
+    'word_count_analysis.cluster_reviews': 'cluster',
+    'word_count_analysis.generate_elbow': 'elbow',
+    'word_count_analysis.analyze_clusters': 'analyze',
+    'sentiment_analysis.score_sentiment': 'sentiment',
+    'embedding_analysis.generate_embeddings': 'embed',
+    'embedding_analysis.umap_visualization': 'umap',
+    'database.anon_embedding_csv_to_postgres': 'load',
+    'similarity_search.search_reviews': 'search',
+    'embedding_analysis.embedding_compression': 'compress',
+}
+
+
+def time_command(command: list, cwd: str, repeat: int) -> float:
+    """
+    Best wall-clock seconds of repeat runs of a command in a fresh interpreter, or None if it fails
+    (e.g. a module whose dependency is not installed here).
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=cwd, capture_output=True)
+        seconds = time.perf_counter() - start
+        if result.returncode != 0:
+            return None
+        best = seconds if best is None else min(best, seconds)
+    return round(best, 3)
+
+
+def time_imports(scripts_dir: str, repeat: int) -> dict:
+    return {module: time_command([sys.executable, '-c', f'import {module}'], scripts_dir, repeat) for module in STAGES}
+
+
+def time_cli(scripts_dir: str, repeat: int) -> dict:
+    """
+    Seconds to start each subcommand of the CLI up to its argument parsing, and to import its stage
+    module as the subcommand does when it runs.
+    """
+
+    cli = os.path.join(scripts_dir, 'review_analysis.py')
+    if not os.path.exists(cli):
+        return {}
+    return {command: time_command([sys.executable, cli, command, '--help'], scripts_dir, repeat) for command in STAGES.values()}
+
+
+def extract_scripts(ref: str, directory: str) -> str:
+    """
+    Extract the scripts directory of a git commit into directory and return its path there.
+    """
+
+    archive = os.path.join(directory, 'scripts.tar')
+    with open(archive, 'wb') as f:
+        subprocess.run(['git', 'archive', ref, '.'], cwd=SCRIPTS_DIR, stdout=f, check=True)
+    scripts_dir = os.path.join(directory, 'scripts')
+    with tarfile.open(archive) as tar:
+        tar.extractall(scripts_dir, filter='data')
+    return scripts_dir
+
+
+def main(output_json: str = None, baseline_ref: str = None, repeat: int = 5) -> pd.DataFrame:
+    """
+    Time how long each stage takes to start: importing its module in a fresh interpreter, and starting
+    its CLI subcommand. With a baseline git ref, the imports of that commit's scripts are timed too.
+    """
+
+    print('Environment variables such as NUMBA_CACHE_DIR affect the import times; the best of each repeat is kept.')
+    report = pd.DataFrame({'module': list(STAGES), 'command': list(STAGES.values())})
+    report['import_seconds'] = report['module'].map(time_imports(SCRIPTS_DIR, repeat))
+    report['cli_help_seconds'] = report['command'].map(time_cli(SCRIPTS_DIR, repeat))
+
+    if baseline_ref is not None:
+        with tempfile.TemporaryDirectory() as directory:
+            baseline_dir = extract_scripts(baseline_ref, directory)
+            report['baseline_import_seconds'] = report['module'].map(time_imports(baseline_dir, repeat))
+        report['speedup'] = (report['baseline_import_seconds'] / report['import_seconds']).round(2)
+
+    print(report.to_string(index=False))
+
+    if output_json is not None:
+        if os.path.dirname(output_json):
+            os.makedirs(os.path.dirname(output_json), exist_ok=True)
+        with open(output_json, 'w') as f:
+            json.dump({'suite': 'startup', 'version': code_version(), 'baseline_ref': baseline_ref, 'repeat': repeat,
+                       'python': sys.version.split()[0], 'results': report.to_dict(orient='records')}, f, indent=2)
+        print(f'Wrote {output_json}')
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the startup of every pipeline stage in fresh interpreters.')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--baseline-ref', default=None, help='Git commit whose scripts are timed for comparison, e.g. HEAD~1')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.output, args.baseline_ref, args.repeat)
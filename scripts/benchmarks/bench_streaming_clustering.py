@@ -0,0 +1,86 @@
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics import adjusted_rand_score
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.synthetic import synthetic_topic_reviews
+from common.table_io import read_table, write_table
+from word_count_analysis.cluster_reviews import fit_kmeans
+from word_count_analysis.streaming_clustering import cluster_streaming
+
+
+def _timed(args: tuple) -> tuple:
+    function, arguments = args
+    start = time.perf_counter()
+    result = function(*arguments)
+    seconds = time.perf_counter() - start
+    return result, seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(function, *arguments) -> tuple:
+    """
+    (result, seconds, peak resident memory in MB) of a call, run in a fresh process so peaks do not carry over.
+    """
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_timed, (function, arguments)).result()
+
+
+def in_memory(input_path: str, num_clusters: int) -> np.ndarray:
+    df = read_table(input_path, ['Preprocessed_Review_Text'])
+    matrix = TfidfVectorizer().fit_transform(df['Preprocessed_Review_Text'].values.astype('U'))
+    return fit_kmeans(matrix, num_clusters).labels_
+
+
+def streaming(input_path: str, output_path: str, num_clusters: int, batch_size: int) -> np.ndarray:
+    cluster_streaming(input_path, num_clusters, output_path, batch_size=batch_size)
+    return read_table(output_path, ['Cluster'])['Cluster'].to_numpy()
+
+
+def main(counts: list, num_clusters: int, batch_size: int) -> None:
+    """
+    Compare the in-memory TF-IDF + K-means path with the streaming path on topic-structured synthetic
+    reviews: wall time, peak resident memory, and agreement (ARI) with the true topics and with each other.
+    """
+
+    rows = []
+    for count in counts:
+        texts, topics = synthetic_topic_reviews(count, n_topics=num_clusters)
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, 'reviews')
+            write_table(pd.DataFrame({'Preprocessed_Review_Text': texts}), input_path)
+
+            memory_labels, memory_seconds, memory_peak = measure(in_memory, input_path, num_clusters)
+            stream_labels, stream_seconds, stream_peak = measure(streaming, input_path, os.path.join(directory, 'clusters'),
+                                                                 num_clusters, batch_size)
+
+        rows.append({
+            'reviews': count,
+            'in_memory_seconds': round(memory_seconds, 2),
+            'streaming_seconds': round(stream_seconds, 2),
+            'in_memory_peak_mb': round(memory_peak, 1),
+            'streaming_peak_mb': round(stream_peak, 1),
+            'in_memory_ari': round(adjusted_rand_score(topics, memory_labels), 3),
+            'streaming_ari': round(adjusted_rand_score(topics, stream_labels), 3),
+            'agreement_ari': round(adjusted_rand_score(memory_labels, stream_labels), 3),
+        })
+        print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark streaming TF-IDF clustering against the in-memory path.')
+    parser.add_argument('--counts', type=int, nargs='+', default=[20_000, 100_000, 400_000])
+    parser.add_argument('--clusters', type=int, default=9)
+    parser.add_argument('--batch-size', type=int, default=20_000)
+    args = parser.parse_args()
+
+    main(args.counts, args.clusters, args.batch_size)
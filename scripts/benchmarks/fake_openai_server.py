@@ -0,0 +1,189 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PATHS = ('/v1/embeddings', '/v1/chat/completions')
+MID_SENTENCE_NAME = re.compile(r'(?<=[a-z,] )[A-Z][a-z]+')
+
+
+class FakeOpenAIState:
+    """
+    Configuration and counters shared by the handler threads of a fake server.
+
+    The server enforces its own requests-per-minute limit with a sliding one-minute window,
+    answering excess requests with 429 and a Retry-After header, and can inject random 500s.
+    The limit and the counters are shared by the embeddings and chat completions endpoints.
+    """
+
+    def __init__(self, dim: int = 1536, latency: float = 0.05, latency_per_input: float = 0.0005,
+                 requests_per_minute: int = None, failure_rate: float = 0.0, max_inputs: int = 2048, seed: int = 0):
+        self.dim = dim
+        self.latency = latency
+        self.latency_per_input = latency_per_input
+        self.requests_per_minute = requests_per_minute
+        self.failure_rate = failure_rate
+        self.max_inputs = max_inputs
+        self.random = random.Random(seed)
+
+        self.request_times = []
+        self.counts = {'requests': 0, 'inputs': 0, 'completions': 0, 'throttled': 0, 'failed': 0}
+        self.lock = threading.Lock()
+
+    def admit(self) -> tuple:
+        """
+        Return (status, retry_after) for a new request.
+        """
+
+        with self.lock:
+            self.counts['requests'] += 1
+            now = time.monotonic()
+            if self.requests_per_minute:
+                self.request_times = [t for t in self.request_times if now - t < 60]
+                if len(self.request_times) >= self.requests_per_minute:
+                    self.counts['throttled'] += 1
+                    return 429, 60 - (now - self.request_times[0])
+                self.request_times.append(now)
+            if self.random.random() < self.failure_rate:
+                self.counts['failed'] += 1
+                return 500, None
+            return 200, None
+
+    def remaining(self) -> int:
+        if not self.requests_per_minute:
+            return 1_000_000
+        with self.lock:
+            return max(0, self.requests_per_minute - len(self.request_times))
+
+
+def fake_embedding(text: str, dim: int) -> list:
+    """
+    Deterministic unit-length pseudo embedding for a text.
+    """
+
+    seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = sum(value * value for value in vector) ** 0.5
+    return [round(value / norm, 6) for value in vector]
+
+
+def fake_anonymization(prompt: str) -> str:
+    """
+    Stand-in for the anonymization completion: the review after the instructions of the prompt,
+    with every capitalized word mid-sentence replaced by X.
+    """
+
+    review = prompt.split('\n\n', 1)[-1]
+    review = review[:-1] if review.endswith('.') else review
+    return MID_SENTENCE_NAME.sub('X', review)
+
+
+def make_handler(state: FakeOpenAIState):
+
+    class FakeOpenAIHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status: int, payload: dict, headers: dict = None) -> None:
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, str(value))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+
+            if self.path not in PATHS:
+                self.send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+                return
+
+            status, retry_after = state.admit()
+            if status == 429:
+                self.send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}},
+                               {'Retry-After': f'{retry_after:.3f}', 'x-ratelimit-remaining-requests': 0,
+                                'x-ratelimit-reset-requests': f'{retry_after:.3f}s'})
+                return
+            if status == 500:
+                self.send_json(500, {'error': {'message': 'Injected server error'}})
+                return
+
+            if self.path == '/v1/chat/completions':
+                self.complete(request)
+            else:
+                self.embed(request)
+
+        def embed(self, request: dict) -> None:
+            inputs = request.get('input')
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            if not inputs or len(inputs) > state.max_inputs or not all(isinstance(text, str) and text for text in inputs):
+                self.send_json(400, {'error': {'message': 'Invalid input'}})
+                return
+
+            time.sleep(state.latency + state.latency_per_input * len(inputs))
+            with state.lock:
+                state.counts['inputs'] += len(inputs)
+
+            data = [{'object': 'embedding', 'index': index, 'embedding': fake_embedding(text, state.dim)}
+                    for index, text in enumerate(inputs)]
+            self.send_json(200, {'object': 'list', 'data': data, 'model': request.get('model')},
+                           {'x-ratelimit-remaining-requests': state.remaining(), 'x-ratelimit-reset-requests': '1s'})
+
+        def complete(self, request: dict) -> None:
+            messages = request.get('messages')
+            prompts = [message.get('content') for message in messages or [] if isinstance(message, dict) and message.get('role') == 'user']
+            if not prompts or not isinstance(prompts[-1], str):
+                self.send_json(400, {'error': {'message': 'Invalid messages'}})
+                return
+
+            time.sleep(state.latency)
+            with state.lock:
+                state.counts['completions'] += 1
+
+            message = {'role': 'assistant', 'content': fake_anonymization(prompts[-1])}
+            self.send_json(200, {'object': 'chat.completion', 'model': request.get('model'),
+                                 'choices': [{'index': 0, 'message': message, 'finish_reason': 'stop'}]},
+                           {'x-ratelimit-remaining-requests': state.remaining(), 'x-ratelimit-reset-requests': '1s'})
+
+    return FakeOpenAIHandler
+
+
+def start_server(state: FakeOpenAIState, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """
+    Start a fake server on a background thread. Use server.server_address for the bound port
+    and server.shutdown() to stop it.
+    """
+
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the OpenAI embeddings and chat completions endpoints.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--rpm', type=int, default=None)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    state = FakeOpenAIState(dim=args.dim, latency=args.latency, requests_per_minute=args.rpm, failure_rate=args.failure_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(state))
+    print(f'Fake OpenAI server listening on http://127.0.0.1:{args.port} ({", ".join(PATHS)})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
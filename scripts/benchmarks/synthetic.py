@@ -0,0 +1,144 @@
+import os
+import random
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_analysis.embedding_store import EmbeddingStore
+
+WORDS = ['great', 'staff', 'friendly', 'appointment', 'pain', 'back', 'treatment', 'clinic', 'recommend',
+         'wait', 'time', 'helpful', 'professional', 'booked', 'visit', 'knee', 'shoulder', 'session',
+         'the', 'was', 'and', 'very', 'my', 'they', 'would', 'not', 'after', 'feeling', 'better', 'rude',
+         'exercises', 'injuries', 'running', 'massages', 'physiotherapist', 'chiropractor', 'hours', 'weeks']
+
+PROVINCES = ['Alberta', 'British_Columbia', 'Manitoba', 'Nova_Scotia', 'Ontario', 'Quebec', 'Saskatchewan']
+CITIES = ['Calgary', 'Edmonton', 'Vancouver', 'Victoria', 'Winnipeg', 'Halifax', 'Toronto', 'Ottawa', 'Montreal', 'Regina']
+FIRST_NAMES = ['Sarah', 'Michael', 'Jennifer', 'David', 'Emily', 'Daniel', 'Jessica', 'Ryan', 'Laura', 'Kevin', 'Amanda', 'Jason']
+LAST_NAMES = ['Smith', 'Brown', 'Tremblay', 'Martin', 'Roy', 'Wilson', 'MacDonald', 'Gagnon', 'Johnson', 'Lee', 'Taylor', 'Campbell']
+PRACTITIONER_NAMES = ['Olivia', 'Nathan', 'Priya', 'Marc', 'Chloe', 'Arjun', 'Sophie', 'Mateo', 'Hannah', 'Liam', 'Noor', 'Ethan']
+CLINIC_WORDS = ['Physio', 'Wellness', 'Sport', 'Health', 'Motion', 'Spine', 'Active', 'Rehab', 'Performance', 'Family']
+REVIEW_DATES = ['a week ago', '2 weeks ago', 'a month ago', '3 months ago', '8 months ago', 'a year ago', '2 years ago']
+
+# Raw scraper column names of a clinic CSV, as mapped by clean_reviews.COLUMN_MAPPING, plus one column it ignores.
+RAW_COLUMNS = ['d4r55', 'RfnDt', 'rsqaWe', 'wiI7pd', 'DZSIDd', 'wiI7pd 2', 'kvMYJc']
+
+
+def synthetic_reviews(count: int, seed: int = 0) -> list:
+    """
+    Seeded review-like texts of 10 to 80 words with light punctuation and capitalisation.
+    """
+
+    rng = random.Random(seed)
+    reviews = []
+    for i in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(10, 80))]
+        words[0] = words[0].capitalize()
+        reviews.append(' '.join(words) + rng.choice(['.', '!', '...', '?']) + f' #{i}')
+    return reviews
+
+
+def synthetic_topic_reviews(count: int, n_topics: int = 8, topic_words: int = 12, seed: int = 0) -> tuple:
+    """
+    Seeded reviews that mix shared filler words with the words of one of n_topics topics, for checking
+    clustering quality. Returns (texts, topic of each text).
+    """
+
+    rng = random.Random(seed)
+    topics = [[f'topic{topic}word{word}' for word in range(topic_words)] for topic in range(n_topics)]
+    texts, labels = [], []
+    for _ in range(count):
+        topic = rng.randrange(n_topics)
+        length = rng.randint(10, 60)
+        words = [rng.choice(topics[topic]) if rng.random() < 0.4 else rng.choice(WORDS) for _ in range(length)]
+        texts.append(' '.join(words))
+        labels.append(topic)
+    return texts, labels
+
+
+def synthetic_clinic_reviews(count: int, clinic_name: str, city: str, rng: random.Random) -> pd.DataFrame:
+    """
+    One clinic's reviews in the raw scraper schema. Texts sometimes mention the clinic, the city or a
+    practitioner by name (practitioner names are not author names, so only the chat API can catch them), some clinics answer reviews, and a small share of rows is dropped by cleaning:
+    no author, no text, text truncated by the scraper, or the same review scraped twice.
+    """
+
+    practitioners = [f'{rng.choice(PRACTITIONER_NAMES)} {rng.choice(LAST_NAMES)}' for _ in range(3)]
+    rows = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(10, 80))
+        words[0] = words[0].capitalize()
+        mention = rng.random()
+        if mention < 0.15:
+            words.insert(rng.randrange(1, len(words)), f'Dr. {rng.choice(practitioners).split()[1]}')
+        elif mention < 0.25:
+            words.insert(rng.randrange(0, len(words)), rng.choice(practitioners).split()[0])  # Sometimes starts the review
+        elif mention < 0.35:
+            words.insert(rng.randrange(1, len(words)), f'{clinic_name.replace("_", " ")} in {city}')
+        text = ' '.join(words) + rng.choice(['.', '!', '...', '?'])
+
+        author = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)[0]}.'
+        defect = rng.random()
+        if defect < 0.01:
+            author = None
+        elif defect < 0.02:
+            text = None
+        elif defect < 0.04:
+            text = text[:rng.randint(20, 60)] + '…'
+        responded = rng.random() < 0.3
+        rows.append([author, f'{rng.randint(1, 200)} reviews', rng.choice(REVIEW_DATES), text,
+                     rng.choice(REVIEW_DATES) if responded else None,
+                     f'Thank you for the kind words, {author}!' if responded else None, f'{rng.randint(1, 5)} stars'])
+        if rng.random() < 0.01:
+            rows.append(rows[-1])
+
+    return pd.DataFrame(rows, columns=RAW_COLUMNS)
+
+
+def write_raw_clinics(directory: str, count: int, reviews_per_clinic: int = 500, seed: int = 0) -> list:
+    """
+    Write about count seeded raw reviews as clinic CSVs laid out like the scraper output,
+    directory/<State_Province>/<Clinic_Name>.csv, with reviews_per_clinic reviews on average per clinic.
+    Returns the written paths.
+    """
+
+    rng = random.Random(seed)
+    paths = []
+    remaining = count
+    while remaining > 0:
+        province = rng.choice(PROVINCES)
+        clinic_name = f'{rng.choice(CITIES)}_{rng.choice(CLINIC_WORDS)}_{rng.choice(CLINIC_WORDS)}_{len(paths)}'
+        clinic_count = min(remaining, rng.randint(reviews_per_clinic // 2, reviews_per_clinic * 3 // 2))
+        df = synthetic_clinic_reviews(clinic_count, clinic_name, clinic_name.split('_')[0], rng)
+
+        path = os.path.join(directory, province, f'{clinic_name}.csv')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_csv(path, index=False)
+        paths.append(path)
+        remaining -= clinic_count
+
+    return paths
+
+
+def write_fake_embeddings(store_dir: str, row_ids, dim: int = 1536, n_topics: int = 20, noise: float = 1.0,
+                          chunksize: int = 50_000, seed: int = 0) -> EmbeddingStore:
+    """
+    Fill a new embedding store with seeded unit vectors for the given review ids: a random topic
+    direction per review plus Gaussian noise, so the embeddings have cluster structure like real ones.
+    """
+
+    rng = np.random.default_rng(seed)
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    topics /= np.linalg.norm(topics, axis=1, keepdims=True)
+
+    store = EmbeddingStore.create(store_dir, row_ids, dim, model='synthetic', overwrite=True)
+    for start in range(0, row_ids.shape[0], chunksize):
+        ids = row_ids[start:start + chunksize]
+        matrix = topics[rng.integers(n_topics, size=ids.shape[0])]
+        matrix += rng.standard_normal((ids.shape[0], dim), dtype=np.float32) * (noise / np.sqrt(dim))
+        store.write(ids, matrix / np.linalg.norm(matrix, axis=1, keepdims=True))
+    store.flush()
+
+    return store
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def cache_key(model: str, template: str, text: str) -> str:
+    """
+    Content address of an API call: a SHA-256 of the model, the prompt template and the input text.
+    """
+
+    digest = hashlib.sha256()
+    for part in (model, template, text):
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ApiCache:
+    """
+    Persistent, size-bounded SQLite cache of API results keyed by content address.
+
+    Values are raw bytes (embeddings as float32 buffers, completions as UTF-8). Once the stored
+    values exceed max_bytes, the least recently used entries are evicted down to 90% of the bound.
+    Hit and miss counts are kept for this process and accumulated in the database.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._conn.commit()
+
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def get(self, key: str) -> bytes:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Look up many keys at once. Returns {key: value} for the keys that were found.
+        """
+
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                found.update(self._conn.execute(f'SELECT key, value FROM entries WHERE key IN ({placeholders})', chunk).fetchall())
+
+            now = time.time()
+            self._conn.executemany('UPDATE entries SET last_used = ? WHERE key = ?', [(now, key) for key in found])
+            self._count(hits=len(found), misses=len(set(keys)) - len(found))
+            self._conn.commit()
+
+        return found
+
+    def put(self, key: str, value: bytes) -> None:
+        self.put_many({key: value})
+
+    def put_many(self, items: dict) -> None:
+        with self._lock:
+            now = time.time()
+            for key, value in items.items():
+                previous = self._conn.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+                self._total_bytes += len(value) - (previous[0] if previous else 0)
+                self._conn.execute('INSERT OR REPLACE INTO entries (key, value, size, last_used) VALUES (?, ?, ?, ?)',
+                                   (key, sqlite3.Binary(value), len(value), now))
+            if self._total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self._conn.commit()
+
+    def _evict(self, target_bytes: int) -> None:
+        cursor = self._conn.execute('SELECT key, size FROM entries ORDER BY last_used')
+        evicted = []
+        for key, size in cursor:
+            if self._total_bytes <= target_bytes:
+                break
+            evicted.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany('DELETE FROM entries WHERE key = ?', evicted)
+
+    def _count(self, hits: int, misses: int) -> None:
+        self.hits += hits
+        self.misses += misses
+        self._conn.executemany('INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                               [('hits', hits), ('misses', misses)])
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._conn.execute('SELECT name, value FROM counters').fetchall())
+            entries = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'total_hits': counters.get('hits', 0),
+            'total_misses': counters.get('misses', 0),
+            'entries': entries,
+            'bytes': self._total_bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,394 @@
+import json
+import os
+import re
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+REPORT_DIR_ENV = 'REVIEW_ANALYSIS_REPORT_DIR'
+PROFILE_ENV = 'REVIEW_ANALYSIS_PROFILE'
+DEFAULT_REPORT_DIR = './output/reports'
+METRIC_PREFIX = 'review_analysis'
+
+# Upper bounds in seconds of the API latency histogram buckets, as in a Prometheus histogram.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+
+def cpu_seconds() -> float:
+    """
+    User and system CPU time of this process and of its reaped child processes (process pool workers).
+    """
+
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def peak_rss_mb() -> tuple:
+    """
+    (peak resident set size of this process, largest peak of its reaped child processes) in MB.
+    """
+
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is in bytes on macOS, KB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+class StageRecord:
+    """
+    Measurements of one stage or sub-step: wall and CPU time, rows processed, bytes read and written,
+    and the peak RSS when it finished.
+    """
+
+    def __init__(self, name: str, rows: int = None):
+        self.name = name
+        self.rows = rows
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.status = 'running'
+        self._wall_start = time.perf_counter()
+        self._cpu_start = cpu_seconds()
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_mb = None
+        self.children_peak_rss_mb = None
+
+    def add_rows(self, rows: int) -> None:
+        self.rows = (self.rows or 0) + int(rows)
+
+    def finish(self, status: str) -> None:
+        self.wall_seconds = time.perf_counter() - self._wall_start
+        self.cpu_seconds = cpu_seconds() - self._cpu_start
+        self.peak_rss_mb, self.children_peak_rss_mb = peak_rss_mb()
+        self.status = status
+
+    def as_dict(self) -> dict:
+        return {
+            'stage': self.name,
+            'status': self.status,
+            'wall_seconds': round(self.wall_seconds, 4),
+            'cpu_seconds': round(self.cpu_seconds, 4),
+            'rows': self.rows,
+            'rows_per_sec': round(self.rows / max(self.wall_seconds, 1e-9), 1) if self.rows is not None else None,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_rss_mb': round(self.peak_rss_mb, 1),
+            'children_peak_rss_mb': round(self.children_peak_rss_mb, 1),
+        }
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram of observed values, with their sum and count.
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th quantile.
+        """
+
+        rank = q * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                return bound
+        return float('inf')
+
+    def as_dict(self) -> dict:
+        return {
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): count for bound, count in zip(self.buckets, self.counts)},
+            'sum': round(self.sum, 4),
+            'count': self.count,
+            'mean': round(self.sum / self.count, 4) if self.count else None,
+            'p50': self.quantile(0.5) if self.count else None,
+            'p95': self.quantile(0.95) if self.count else None,
+        }
+
+
+class SamplingProfiler:
+    """
+    Samples the main thread's call stack every interval seconds from a background thread.
+
+    Stacks are kept in collapsed form ('module:function;module:function' with a sample count), which
+    flamegraph.pl and speedscope read directly. Work done in process pool workers is not sampled.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self._target = threading.main_thread().ident
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def start(self) -> 'SamplingProfiler':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def top_functions(self, count: int = 20) -> list:
+        """
+        Functions with the most samples at the top of the stack (self time), as (function, share of samples).
+        """
+
+        total = sum(self.stacks.values())
+        own = Counter()
+        for stack, samples in self.stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += samples
+        return [{'function': function, 'samples': samples, 'share': round(samples / total, 4)} for function, samples in own.most_common(count)]
+
+    def write_collapsed(self, path: str) -> None:
+        with open(path, 'w') as f:
+            for stack, samples in self.stacks.most_common():
+                f.write(f'{stack} {samples}\n')
+
+
+class Run:
+    """
+    Measurements of one script run: a record per stage and nested sub-step, named 'stage/sub-step',
+    plus counters (retries, 429s) and latency histograms labelled by endpoint. Bytes read and written
+    are credited to every open stage, so a stage includes the I/O of its sub-steps; rows added with
+    add_rows go to the innermost open stage. Safe to update from worker threads.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = datetime.now(timezone.utc)
+        self.stages = []
+        self.counters = Counter()
+        self.histograms = {}
+        self.profiler = None
+        self._open = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, rows: int = None):
+        with self._lock:
+            path = '/'.join([record.name for record in self._open[-1:]] + [name])
+            record = StageRecord(path, rows)
+            self.stages.append(record)
+            self._open.append(record)
+        status = 'failed'
+        try:
+            yield record
+            status = 'ok'
+        finally:
+            with self._lock:
+                record.finish(status)
+                self._open.remove(record)
+
+    def add_rows(self, rows: int) -> None:
+        with self._lock:
+            if self._open:
+                self._open[-1].add_rows(rows)
+
+    def add_bytes(self, read: int = 0, written: int = 0) -> None:
+        with self._lock:
+            self.counters['bytes_read'] += read
+            self.counters['bytes_written'] += written
+            for record in self._open:
+                record.bytes_read += read
+                record.bytes_written += written
+
+    def count(self, name: str, value: int = 1, **labels) -> None:
+        with self._lock:
+            self.counters[metric_key(name, labels)] += value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = metric_key(name, labels)
+        with self._lock:
+            self.histograms.setdefault(key, Histogram()).observe(value)
+
+    def report(self, status: str = 'ok') -> dict:
+        rss, children_rss = peak_rss_mb()
+        with self._lock:
+            report = {
+                'run': self.name,
+                'status': status,
+                'started': self.started.isoformat(timespec='seconds'),
+                'wall_seconds': round((datetime.now(timezone.utc) - self.started).total_seconds(), 3),
+                'cpu_seconds': round(cpu_seconds(), 3),
+                'peak_rss_mb': round(rss, 1),
+                'children_peak_rss_mb': round(children_rss, 1),
+                'stages': [record.as_dict() for record in self.stages if record.wall_seconds is not None],
+                'counters': dict(self.counters),
+                'histograms': {key: histogram.as_dict() for key, histogram in self.histograms.items()},
+            }
+        if self.profiler is not None:
+            report['profile'] = self.profiler.top_functions()
+        return report
+
+
+def metric_key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+
+def split_key(key: str) -> tuple:
+    name, _, labels = key.partition('{')
+    return name, labels.rstrip('}')
+
+
+def prometheus_name(name: str) -> str:
+    return f"{METRIC_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+
+def prometheus_text(report: dict) -> str:
+    """
+    The report in the Prometheus text exposition format, for the node_exporter textfile collector.
+    """
+
+    run = f'run="{report["run"]}"'
+    lines = [f'{METRIC_PREFIX}_run_wall_seconds{{{run}}} {report["wall_seconds"]}',
+             f'{METRIC_PREFIX}_run_cpu_seconds{{{run}}} {report["cpu_seconds"]}',
+             f'{METRIC_PREFIX}_run_peak_rss_megabytes{{{run}}} {report["peak_rss_mb"]}',
+             f'{METRIC_PREFIX}_run_success{{{run}}} {int(report["status"] == "ok")}']
+
+    for stage in report['stages']:
+        labels = f'{run},stage="{stage["stage"]}"'
+        lines.append(f'{METRIC_PREFIX}_stage_wall_seconds{{{labels}}} {stage["wall_seconds"]}')
+        lines.append(f'{METRIC_PREFIX}_stage_cpu_seconds{{{labels}}} {stage["cpu_seconds"]}')
+        lines.append(f'{METRIC_PREFIX}_stage_bytes_read{{{labels}}} {stage["bytes_read"]}')
+        lines.append(f'{METRIC_PREFIX}_stage_bytes_written{{{labels}}} {stage["bytes_written"]}')
+        if stage['rows'] is not None:
+            lines.append(f'{METRIC_PREFIX}_stage_rows{{{labels}}} {stage["rows"]}')
+
+    for key, value in sorted(report['counters'].items()):
+        name, labels = split_key(key)
+        lines.append(f'{prometheus_name(name)}_total{{{",".join(filter(None, [run, labels]))}}} {value}')
+
+    for key, histogram in sorted(report['histograms'].items()):
+        name, labels = split_key(key)
+        labels = ','.join(filter(None, [run, labels]))
+        metric = prometheus_name(name)
+        lines.append(f'# TYPE {metric} histogram')
+        for bound, count in histogram['buckets'].items():
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{metric}_sum{{{labels}}} {histogram["sum"]}')
+        lines.append(f'{metric}_count{{{labels}}} {histogram["count"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+_run = Run('default')
+
+
+def current_run() -> Run:
+    return _run
+
+
+def measure(name: str, rows: int = None):
+    """
+    Time a stage or sub-step of the current run:
+
+        with measure('vectorize', rows=len(texts)) as record:
+            ...
+    """
+
+    return _run.stage(name, rows)
+
+
+def add_rows(rows: int) -> None:
+    _run.add_rows(rows)
+
+
+def add_bytes(read: int = 0, written: int = 0) -> None:
+    _run.add_bytes(read, written)
+
+
+def count(name: str, value: int = 1, **labels) -> None:
+    _run.count(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    _run.observe(name, value, **labels)
+
+
+def file_size(path: str) -> int:
+    """
+    Size in bytes of a file, or of all files under a directory.
+    """
+
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def write_report(report: dict, report_dir: str, profiler: SamplingProfiler = None) -> str:
+    """
+    Write the report as timestamped JSON and as <run>.prom, overwritten by every run so a textfile
+    collector always sees the latest values. Returns the JSON path.
+    """
+
+    os.makedirs(report_dir, exist_ok=True)
+    base = os.path.join(report_dir, f"{report['run']}-{report['started'].replace(':', '').replace('-', '')}")
+    with open(base + '.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    with open(os.path.join(report_dir, f"{report['run']}.prom.tmp"), 'w') as f:
+        f.write(prometheus_text(report))
+    os.replace(os.path.join(report_dir, f"{report['run']}.prom.tmp"), os.path.join(report_dir, f"{report['run']}.prom"))
+    if profiler is not None:
+        profiler.write_collapsed(base + '.profile.txt')
+    return base + '.json'
+
+
+@contextmanager
+def instrumented_run(name: str, report_dir: str = None, profile: float = None):
+    """
+    Make a fresh Run current for the duration of a script, time it as its top-level stage, and write
+    its report to report_dir (default: $REVIEW_ANALYSIS_REPORT_DIR, else ./output/reports) when it ends,
+    also when it fails.
+
+    Profiling is opt-in: pass a sampling interval in seconds, or set REVIEW_ANALYSIS_PROFILE=1 (10 ms)
+    or to an interval such as 0.005. The sampled stacks are written next to the report.
+    """
+
+    global _run
+    report_dir = report_dir or os.getenv(REPORT_DIR_ENV, DEFAULT_REPORT_DIR)
+    if profile is None and os.getenv(PROFILE_ENV):
+        value = float(os.getenv(PROFILE_ENV))
+        profile = 0.01 if value >= 1 else value
+
+    previous, _run = _run, Run(name)
+    if profile:
+        _run.profiler = SamplingProfiler(profile).start()
+    status = 'failed'
+    try:
+        with _run.stage(name):
+            yield _run
+        status = 'ok'
+    finally:
+        run, _run = _run, previous
+        if run.profiler is not None:
+            run.profiler.stop()
+        path = write_report(run.report(status), report_dir, run.profiler)
+        print(f'Run report: {path}')
@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from common.reviews import review_ids
+
+
+def stage_name(stage: str, output_path: str) -> str:
+    """
+    Manifest key of a stage writing to a given output, so runs of one stage on different files stay apart.
+    """
+
+    return f'{stage}:{os.path.basename(os.path.normpath(output_path))}'
+
+
+class Manifest:
+    """
+    SQLite record of the content fingerprint each pipeline stage last processed for every review.
+
+    A stage compares the fingerprints of its input with its own entries to find the delta:
+    new reviews, reviews whose content changed, and reviews that are gone from the input.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS processed (stage TEXT NOT NULL, review_id INTEGER NOT NULL, '
+                           'fingerprint INTEGER NOT NULL, processed_at REAL NOT NULL, PRIMARY KEY (stage, review_id))')
+        self._conn.commit()
+
+    def processed(self, stage: str) -> pd.Series:
+        """
+        Fingerprints the stage has processed, indexed by review id.
+        """
+
+        rows = self._conn.execute('SELECT review_id, fingerprint FROM processed WHERE stage = ?', (stage,)).fetchall()
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        return pd.Series(np.array([row[1] for row in rows], dtype=np.int64), index=ids)
+
+    def delta(self, stage: str, ids, fingerprints, processed: pd.Series = None) -> tuple:
+        """
+        Compare input reviews with what the stage has processed (pass `processed` to reuse one
+        lookup across chunks). Returns (new, changed) boolean masks over the input, and the
+        processed review ids missing from the input.
+        """
+
+        ids = np.asarray(ids, dtype=np.int64)
+        fingerprints = np.asarray(fingerprints, dtype=np.int64)
+        processed = self.processed(stage) if processed is None else processed
+
+        known = np.isin(ids, processed.index.to_numpy())
+        changed = np.zeros(ids.shape[0], dtype=bool)
+        changed[known] = processed.loc[ids[known]].to_numpy() != fingerprints[known]
+        removed = np.setdiff1d(processed.index.to_numpy(), ids)
+
+        return ~known, changed, removed
+
+    def mark(self, stage: str, ids, fingerprints) -> None:
+        now = time.time()
+        self._conn.executemany('INSERT OR REPLACE INTO processed (stage, review_id, fingerprint, processed_at) VALUES (?, ?, ?, ?)',
+                               [(stage, int(review_id), int(fingerprint), now) for review_id, fingerprint in zip(ids, fingerprints)])
+        self._conn.commit()
+
+    def forget(self, stage: str, ids=None) -> None:
+        """
+        Drop the stage's entries for the given review ids, or all of them.
+        """
+
+        if ids is None:
+            self._conn.execute('DELETE FROM processed WHERE stage = ?', (stage,))
+        else:
+            self._conn.executemany('DELETE FROM processed WHERE stage = ? AND review_id = ?', [(stage, int(review_id)) for review_id in ids])
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def merge_delta(existing: pd.DataFrame, updates: pd.DataFrame, current_ids) -> pd.DataFrame:
+    """
+    Merge reprocessed rows into a stage's existing output by review id: rows of existing for reviews that are
+    still in the input and were not reprocessed, plus the updates, in the order of current_ids.
+    """
+
+    current_ids = np.asarray(current_ids, dtype=np.int64)
+    existing_ids = review_ids(existing)
+    keep = np.isin(existing_ids, current_ids) & ~np.isin(existing_ids, review_ids(updates))
+    merged = pd.concat([existing[keep], updates], ignore_index=True)
+
+    positions = pd.Series(np.arange(current_ids.shape[0]), index=current_ids)
+    order = np.argsort(positions.reindex(review_ids(merged)).to_numpy(), kind='stable')
+    return merged.iloc[order].reset_index(drop=True)
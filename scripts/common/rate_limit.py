@@ -0,0 +1,179 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate for rate budgeting (roughly four characters per token for English text).
+    """
+
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Exponential backoff with full jitter for the given retry attempt (starting at 0).
+    """
+
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parse a rate-limit duration header into seconds.
+
+    Accepts plain seconds ('20', '1.5'), OpenAI-style reset durations ('6m0s', '1.2s', '20ms')
+    and HTTP dates as used by Retry-After. Returns None if the value cannot be parsed.
+    """
+
+    if value is None:
+        return None
+
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if parts and ''.join(number + unit for number, unit in parts) == value:
+        scale = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+        return sum(float(number) * scale[unit] for number, unit in parts)
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Continuously refilling bucket holding at most one minute of budget.
+
+    Reservations may drive the level negative; the caller then waits until the debt is repaid,
+    which keeps callers in arrival order without a separate queue.
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def take(self, amount: float, now: float) -> float:
+        """
+        Reserve the amount and return the number of seconds until it is covered.
+        """
+
+        self.refill(now)
+        self.level -= amount
+        if self.level >= 0:
+            return 0.0
+        return -self.level * 60 / self.per_minute
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limiter shared by concurrent workers.
+
+    The configured limits are ceilings. A 429 pauses every worker for the server's Retry-After
+    and cuts the rate; each success recovers a small fraction of the ceiling. Rate-limit headers
+    that report an exhausted budget pause workers until the reported reset time.
+    Both thread and asyncio callers are supported.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float = None,
+                 decrease_factor: float = 0.5, increase_fraction: float = 0.02, min_fraction: float = 0.05):
+        self.max_requests_per_minute = float(requests_per_minute)
+        self.max_tokens_per_minute = float(tokens_per_minute) if tokens_per_minute else None
+        self.decrease_factor = decrease_factor
+        self.increase_fraction = increase_fraction
+        self.min_fraction = min_fraction
+
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self.throttled = 0
+
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int = 0) -> float:
+        """
+        Reserve budget for one request and return how long the caller must wait before sending it.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            wait = self.requests.take(1, now)
+            if self.tokens is not None and tokens:
+                wait = max(wait, self.tokens.take(tokens, now))
+            return max(wait, self.paused_until - now)
+
+    def acquire(self, tokens: int = 0) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def on_throttled(self, retry_after: float = None) -> None:
+        """
+        Record a 429: pause all workers and back the request rate off multiplicatively.
+        """
+
+        with self._lock:
+            self.throttled += 1
+            self._scale(self.decrease_factor)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def on_success(self, headers=None) -> None:
+        """
+        Record a successful response, recover some rate and honour any rate-limit headers.
+        """
+
+        with self._lock:
+            self._scale(1 + self.increase_fraction)
+
+        if headers:
+            self.update_from_headers(headers)
+
+    def update_from_headers(self, headers) -> None:
+        """
+        Pause until the reported reset when the server says the request or token budget is exhausted.
+        """
+
+        for kind in ('requests', 'tokens'):
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            reset = parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+            if remaining is None or reset is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            if remaining <= 0:
+                self.pause(reset)
+
+    def _scale(self, factor: float) -> None:
+        self.requests.per_minute = min(self.max_requests_per_minute,
+                                       max(self.max_requests_per_minute * self.min_fraction, self.requests.per_minute * factor))
+        if self.tokens is not None:
+            self.tokens.per_minute = min(self.max_tokens_per_minute,
+                                         max(self.max_tokens_per_minute * self.min_fraction, self.tokens.per_minute * factor))
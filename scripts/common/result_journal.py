@@ -0,0 +1,81 @@
+import json
+import os
+
+
+class ResultJournal:
+    """
+    Append-only JSON-lines journal of per-row results.
+
+    Each line is {"row_id": ..., "value": ...}. Lines are buffered and written with one fsync
+    every sync_every results; a torn last line left by a crash is cut off when the journal is opened,
+    so the next record starts on a line of its own. Stages merge
+    the journal into their output table once at the end instead of rewriting it as they go.
+    """
+
+    def __init__(self, path: str, sync_every: int = 20):
+        self.path = path
+        self.sync_every = sync_every
+        self._buffer = []
+        self._truncate_torn_tail()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _truncate_torn_tail(self, block_size: int = 4096) -> None:
+        """
+        Cut the file back to its last newline, dropping a line a crash left half-written.
+        """
+
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r+b') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(0, position - block_size)
+                f.seek(start)
+                newline = f.read(position - start).rfind(b'\n')
+                if newline >= 0:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position != end:
+                f.truncate(position)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def append(self, row_id, value) -> None:
+        self._buffer.append(json.dumps({'row_id': row_id, 'value': value}) + '\n')
+        if len(self._buffer) >= self.sync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        if self._buffer:
+            self._file.write(''.join(self._buffer))
+            self._buffer = []
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def read(self) -> dict:
+        """
+        Return {row_id: value} for every complete line, keeping the last value per row id.
+        """
+
+        self.sync()
+        results = {}
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                results[record['row_id']] = record['value']
+
+        return results
+
+    def close(self) -> None:
+        self.sync()
+        self._file.close()
+
+    def remove(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        os.remove(self.path)
@@ -0,0 +1,62 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+REVIEW_ID_COLUMN = 'Review_Id'
+REVIEW_KEY_COLUMNS = ('State_Province', 'Clinic_Name', 'Author_Name', 'Review_Text')
+FINGERPRINT_COLUMN = 'Content_Fingerprint'
+FINGERPRINT_COLUMNS = ('Clinic_Name', 'Author_Name', 'Review_Text', 'Response_Text')
+
+
+def review_ids(df: pd.DataFrame) -> np.ndarray:
+    """
+    Stable id of each review: the Review_Id column when the table has one, otherwise the row position.
+    """
+
+    if REVIEW_ID_COLUMN in df.columns:
+        return df[REVIEW_ID_COLUMN].to_numpy(dtype=np.int64)
+    return df.index.to_numpy(dtype=np.int64)
+
+
+def fingerprints(df: pd.DataFrame) -> np.ndarray:
+    """
+    Content fingerprint of each review, or None when the table has no Content_Fingerprint column.
+    """
+
+    if FINGERPRINT_COLUMN in df.columns:
+        return df[FINGERPRINT_COLUMN].to_numpy(dtype=np.int64)
+    return None
+
+
+def hash_columns(df: pd.DataFrame, columns: tuple) -> np.ndarray:
+    """
+    Non-negative int64 hash of each row's values in the given columns (the first 8 bytes of a BLAKE2b digest),
+    so it fits a Postgres BIGINT. Missing columns are skipped and missing values hash as 'nan'.
+    """
+
+    if df.empty:
+        return np.empty(0, dtype=np.int64)
+
+    keys = df[[column for column in columns if column in df.columns]].astype(str).fillna('nan').agg('\x1f'.join, axis=1)
+    digests = b''.join(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest() for key in keys)
+    return np.frombuffer(digests, dtype='>i8').astype(np.int64) & np.int64(0x7FFFFFFFFFFFFFFF)
+
+
+def make_review_ids(df: pd.DataFrame) -> np.ndarray:
+    """
+    Stable review ids hashed from province, clinic, author and text. Review_Date is not part of the key
+    because the scraped dates are relative ("2 months ago") and change between scrapes of the same review.
+    """
+
+    return hash_columns(df, REVIEW_KEY_COLUMNS)
+
+
+def make_fingerprints(df: pd.DataFrame) -> np.ndarray:
+    """
+    Content fingerprints: they change when anything a stage works from changes, such as a clinic's new
+    response to a review. The relative dates and the author's review count are left out, since they
+    drift between scrapes without the review changing.
+    """
+
+    return hash_columns(df, FINGERPRINT_COLUMNS)
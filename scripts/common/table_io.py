@@ -0,0 +1,361 @@
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from common.instrumentation import add_bytes, file_size
+
+TABLE_FILE = '_table.json'
+ROW_GROUP_SIZE = 50_000
+COMPRESSION = 'zstd'
+
+
+def is_csv(path: str) -> bool:
+    return path.lower().endswith('.csv')
+
+
+def is_parquet_file(path: str) -> bool:
+    return path.lower().endswith('.parquet') and not os.path.isdir(path)
+
+
+def is_table_dir(path: str) -> bool:
+    """
+    True for a column-group table: a directory of row-aligned Parquet files, one per group of columns
+    added together, listed in _table.json.
+    """
+
+    return os.path.exists(os.path.join(path, TABLE_FILE))
+
+
+def same_table(input_path: str, output_path: str) -> bool:
+    """
+    True when a stage's output goes into its input's own column-group table, so only new columns are appended.
+    """
+
+    return os.path.normpath(input_path) == os.path.normpath(output_path) and is_table_dir(input_path)
+
+
+def open_dataset(path: str) -> ds.Dataset:
+    """
+    A directory of Parquet files as a pyarrow dataset, with hive partition columns (such as State_Province
+    of the cleaned reviews) read back from the directory names.
+    """
+
+    return ds.dataset(path, format='parquet', partitioning='hive', exclude_invalid_files=True, ignore_prefixes=['_', '.'])
+
+
+def _load_meta(path: str) -> dict:
+    with open(os.path.join(path, TABLE_FILE)) as f:
+        return json.load(f)
+
+
+def _save_meta(path: str, meta: dict) -> None:
+    with open(os.path.join(path, TABLE_FILE) + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(os.path.join(path, TABLE_FILE) + '.tmp', os.path.join(path, TABLE_FILE))
+
+
+def table_columns(path: str) -> list:
+    """
+    Column names of a table without reading any rows.
+    """
+
+    if is_csv(path):
+        return pd.read_csv(path, nrows=0).columns.to_list()
+    if is_parquet_file(path):
+        return pq.ParquetFile(path).schema_arrow.names
+    if is_table_dir(path):
+        return [column for group in _load_meta(path)['groups'] for column in group['columns']]
+    return open_dataset(path).schema.names
+
+
+def table_schema(path: str):
+    """
+    Arrow schema of a Parquet file, column-group table or dataset, with its column types; None for a CSV,
+    whose types are only known from the values.
+    """
+
+    if is_csv(path):
+        return None
+    if is_parquet_file(path):
+        return pq.ParquetFile(path).schema_arrow
+    if is_table_dir(path):
+        fields = [field for group in _load_meta(path)['groups']
+                  for field in pq.ParquetFile(os.path.join(path, group['file'])).schema_arrow if field.name in group['columns']]
+        return pa.schema(fields)
+    return open_dataset(path).schema
+
+
+def _projection(path: str, columns) -> list:
+    """
+    The requested columns present in the table, in table order, or all of them. Missing columns are
+    skipped, like the usecols filters the stages used on CSVs.
+    """
+
+    names = table_columns(path)
+    if columns is None:
+        return names
+    return [name for name in names if name in set(columns)]
+
+
+def _group_columns(meta: dict, columns: list) -> list:
+    """
+    (file, columns) of every group holding some of the requested columns.
+    """
+
+    return [(group['file'], [column for column in group['columns'] if column in columns])
+            for group in meta['groups'] if any(column in columns for column in group['columns'])]
+
+
+def _parquet_bytes(file: str, columns: list) -> int:
+    """
+    Compressed on-disk size of the given columns of a Parquet file, from its footer.
+    """
+
+    metadata = pq.ParquetFile(file).metadata
+    wanted = set(columns)
+    return sum(row_group.column(i).total_compressed_size
+               for row_group in (metadata.row_group(j) for j in range(metadata.num_row_groups))
+               for i in range(row_group.num_columns) if row_group.column(i).path_in_schema in wanted)
+
+
+def _stored_bytes(path: str, columns: list) -> int:
+    """
+    Bytes a read of the given columns takes from disk: the whole file for a CSV, the column chunks otherwise.
+    """
+
+    if is_csv(path):
+        return file_size(path)
+    if is_parquet_file(path):
+        return _parquet_bytes(path, columns)
+    if is_table_dir(path):
+        return sum(_parquet_bytes(os.path.join(path, file), group) for file, group in _group_columns(_load_meta(path), columns))
+    return sum(_parquet_bytes(file, columns) for file in open_dataset(path).files)
+
+
+def read_table(path: str, columns=None) -> pd.DataFrame:
+    """
+    Read a CSV, a Parquet file, a column-group table or a Parquet dataset directory into a DataFrame,
+    loading only the requested columns. Only the column groups holding them are opened.
+    """
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"The input file '{path}' does not exist.")
+
+    columns = _projection(path, columns)
+    add_bytes(read=_stored_bytes(path, columns))
+    if is_csv(path):
+        return pd.read_csv(path, usecols=columns)[columns]
+    if is_parquet_file(path):
+        return pq.read_table(path, columns=columns).to_pandas()
+    if is_table_dir(path):
+        meta = _load_meta(path)
+        frames = [pq.read_table(os.path.join(path, file), columns=group).to_pandas() for file, group in _group_columns(meta, columns)]
+        if not frames:
+            return pd.DataFrame(index=pd.RangeIndex(meta['num_rows']))
+        return pd.concat(frames, axis=1)[columns]
+    return open_dataset(path).to_table(columns=columns).to_pandas()
+
+
+def iter_batches(path: str, columns=None, batch_size: int = ROW_GROUP_SIZE):
+    """
+    Stream the requested columns of a table as DataFrames. The index continues across batches, so row
+    positions match those of read_table. Column-group tables stream one row group at a time.
+    """
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"The input file '{path}' does not exist.")
+
+    columns = _projection(path, columns)
+    add_bytes(read=_stored_bytes(path, columns))
+    if is_csv(path):
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=batch_size):
+            yield chunk[columns]
+        return
+
+    if is_table_dir(path):
+        files = [(pq.ParquetFile(os.path.join(path, file)), group) for file, group in _group_columns(_load_meta(path), columns)]
+        batches = ((pd.concat([f.read_row_group(i, columns=group).to_pandas() for f, group in files], axis=1)[columns]
+                    for i in range(files[0][0].num_row_groups)) if files else iter(()))
+    elif is_parquet_file(path):
+        batches = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns))
+    else:
+        batches = (batch.to_pandas() for batch in open_dataset(path).to_batches(columns=columns, batch_size=batch_size))
+
+    start = 0
+    for batch in batches:
+        batch.index = pd.RangeIndex(start, start + batch.shape[0])
+        start += batch.shape[0]
+        yield batch
+
+
+class TableWriter:
+    """
+    Write a table chunk by chunk, as CSV, a single Parquet file, or a column-group table directory.
+
+    With append=True the chunks are new columns for an existing column-group table: they are written,
+    row-aligned, to a new group file and nothing already in the table is rewritten. A column that already
+    exists is replaced; its old group file is removed once none of its columns are in use.
+
+    Otherwise the table is written to a staging path next to it and moved into place on close, so an
+    existing table, which may be the input being streamed, is untouched until the new one is complete.
+    """
+
+    def __init__(self, path: str, append: bool = False, row_group_size: int = ROW_GROUP_SIZE):
+        if append and not is_table_dir(path):
+            raise ValueError(f"Columns can only be appended to a column-group table, not '{path}'.")
+
+        self.path = path
+        self.append = append
+        self.row_group_size = row_group_size
+        self.num_rows = 0
+        self._columns = None
+        self._writer = None
+        self._pending = []
+
+        self._is_file = is_csv(path) or is_parquet_file(path)
+        parent, name = os.path.split(os.path.normpath(path))
+        self._staging = path if append else os.path.join(parent, f'.writing-{name}')
+        if self._is_file:
+            self._file = self._staging
+            directory = parent
+        else:
+            if append:
+                self._meta = _load_meta(path)
+                self.row_group_size = self._meta['row_group_size']
+            else:
+                if os.path.exists(self._staging):
+                    shutil.rmtree(self._staging)
+                self._meta = {'num_rows': 0, 'row_group_size': row_group_size, 'groups': [], 'next_group': 0}
+            self._file = os.path.join(self._staging, f"group-{self._meta['next_group']:03d}.parquet")
+            directory = self._staging
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self._columns is None:
+            self._columns = [str(column) for column in df.columns]
+
+        if is_csv(self._file):
+            df.to_csv(self._file, mode='w' if self.num_rows == 0 else 'a', header=self.num_rows == 0, index=False)
+            self.num_rows += df.shape[0]
+            return
+
+        self._pending.append(pa.Table.from_pandas(df, preserve_index=False))
+        self.num_rows += df.shape[0]
+        # Group files of one table must share their row group boundaries to be read back in lockstep.
+        pending = pa.concat_tables(self._pending, promote_options='permissive')
+        full = pending.num_rows - pending.num_rows % self.row_group_size
+        if full:
+            self._write_arrow(pending.slice(0, full))
+        self._pending = [pending.slice(full)] if pending.num_rows > full else []
+
+    def _write_arrow(self, table: pa.Table) -> None:
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._file, table.schema, compression=COMPRESSION)
+        self._writer.write_table(table.cast(self._writer.schema), row_group_size=self.row_group_size)
+
+    def close(self) -> None:
+        if self._pending:
+            self._write_arrow(pa.concat_tables(self._pending, promote_options='permissive'))
+            self._pending = []
+        if self._writer is not None:
+            self._writer.close()
+        elif not is_csv(self._file) and self._columns is not None:
+            pq.write_table(pa.Table.from_pandas(pd.DataFrame(columns=self._columns), preserve_index=False), self._file)
+        add_bytes(written=file_size(self._file))
+
+        if self._is_file:
+            if os.path.exists(self._staging):
+                os.replace(self._staging, self.path)
+            return
+
+        if self.append and self.num_rows != self._meta['num_rows']:
+            os.remove(self._file)
+            raise ValueError(f"Appended columns have {self.num_rows} rows, the table '{self.path}' has {self._meta['num_rows']}.")
+
+        columns = self._columns or []
+        groups = []
+        for group in self._meta['groups']:
+            group['columns'] = [column for column in group['columns'] if column not in columns]
+            if group['columns']:
+                groups.append(group)
+            else:
+                os.remove(os.path.join(self._staging, group['file']))
+        if self._columns is not None:
+            groups.append({'file': os.path.basename(self._file), 'columns': columns})
+        self._meta.update(num_rows=self._meta['num_rows'] if self.append else self.num_rows, groups=groups,
+                          next_group=self._meta['next_group'] + 1)
+        _save_meta(self._staging, self._meta)
+
+        if not self.append:
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path)
+            elif os.path.exists(self.path):
+                os.remove(self.path)
+            os.replace(self._staging, self.path)
+
+    def __enter__(self) -> 'TableWriter':
+        return self
+
+    def abort(self) -> None:
+        """
+        Drop what was written so far, leaving an existing table as it was.
+        """
+
+        if self._writer is not None:
+            self._writer.close()
+        if not self._is_file and not self.append:
+            shutil.rmtree(self._staging, ignore_errors=True)
+        elif os.path.exists(self._file):
+            os.remove(self._file)
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_table(df: pd.DataFrame, path: str) -> None:
+    """
+    Write a whole DataFrame. The format follows the path: '.csv', '.parquet', or otherwise a
+    column-group table directory.
+    """
+
+    with TableWriter(path) as writer:
+        writer.write(df)
+
+
+def append_columns(path: str, df: pd.DataFrame) -> None:
+    """
+    Add (or replace) columns of a table, row-aligned with it. Column-group tables get a new group file and
+    keep their existing files untouched; CSV and single Parquet files are rewritten.
+    """
+
+    if is_table_dir(path):
+        with TableWriter(path, append=True) as writer:
+            writer.write(df.reset_index(drop=True))
+        return
+
+    table = read_table(path)
+    if table.shape[0] != df.shape[0]:
+        raise ValueError(f"Appended columns have {df.shape[0]} rows, the table '{path}' has {table.shape[0]}.")
+    for column in df.columns:
+        table[column] = df[column].to_numpy()
+    write_table(table, path)
+
+
+def export_csv(path: str, output_csv: str, columns=None, batch_size: int = ROW_GROUP_SIZE) -> int:
+    """
+    Stream a table (or selected columns of it) into one CSV. Returns the number of rows written.
+    """
+
+    with TableWriter(output_csv) as writer:
+        for batch in iter_batches(path, columns, batch_size):
+            writer.write(batch)
+    return writer.num_rows
@@ -1,83 +1,311 @@
 import os
 import sys
 import asyncio
+import time
 import aiohttp
-from asyncio import Queue
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-import openai
 
-RATE_LIMIT = 50  # Number of tasks per minute
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.api_cache import ApiCache, cache_key
+from common.instrumentation import count, instrumented_run, measure, observe
+from common.manifest import Manifest, merge_delta, stage_name
+from common.rate_limit import RateLimiter, backoff_delay, estimate_tokens, parse_duration
+from common.result_journal import ResultJournal
+from common.reviews import fingerprints, review_ids
+from common.table_io import read_table, write_table
+from data_cleaning.rule_anonymizer import RuleAnonymizer
+
+STAGE = 'anonymize'
+OUTPUT_COLUMN = 'Anonymized_Review_Text'
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+MODEL = 'gpt-3.5-turbo'
+SYSTEM_PROMPT = "You are anonymizing review text for author privacy."
+USER_PROMPT_TEMPLATE = "Anonymize this review by replacing city/states, business/clinic names, and individual name(s) (including dr. or pronouns) with X. For reference, the business name to anonymize is {clinic_name}.\n\n{text}."
+
+REQUESTS_PER_MINUTE = 3500
+TOKENS_PER_MINUTE = 90_000
+MAX_IN_FLIGHT = 50  # Upper bound on concurrent requests; the rate limiter does the pacing
+MAX_RETRIES = 6
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class AnonymizationError(Exception):
+    """
+    Raised when a review could not be anonymized after all retries.
+    """
+
+
+def build_prompt(text: str, clinic_name: str) -> str:
+    clinic_name = clinic_name.replace("_", " ")  # replace underscores with spaces
+    return USER_PROMPT_TEMPLATE.format(clinic_name=clinic_name, text=text)
+
+
+def review_cache_key(text: str, clinic_name: str, model: str = MODEL) -> str:
+    return cache_key(model, SYSTEM_PROMPT + USER_PROMPT_TEMPLATE, build_prompt(text, clinic_name))
+
+
+def estimate_request_tokens(text: str, clinic_name: str) -> int:
+    """
+    Tokens a request counts against the tokens-per-minute limit: the prompt plus a completion
+    about as long as the review itself.
+    """
+
+    return estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(build_prompt(text, clinic_name)) + estimate_tokens(text)
+
+
+def completion_content(body) -> str:
+    """
+    Text of the first choice of a chat completion body. Raises AnonymizationError if the body has no
+    choices, or the content is missing or empty (e.g. a refusal or a filtered completion).
+    """
+
+    try:
+        content = body['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError) as err:
+        raise AnonymizationError(f'Malformed completion body: {str(body)[:200]}') from err
+    if not isinstance(content, str) or not content.strip():
+        raise AnonymizationError(f'Empty completion content: {str(body)[:200]}')
+    return content
+
+
+async def request_anonymized_review(session: aiohttp.ClientSession, limiter: RateLimiter, text: str, clinic_name: str, api_key: str,
+                                    model: str = MODEL, url: str = OPENAI_CHAT_URL, max_retries: int = MAX_RETRIES) -> str:
+    """
+    Send one chat completion request, pacing it through the limiter and retrying throttled
+    and transient failures with jittered backoff. Raises AnonymizationError if it still fails.
+    """
+
+    tokens = estimate_request_tokens(text, clinic_name)
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": build_prompt(text, clinic_name)}
+        ]
+    }
+
+    error = None
+    for attempt in range(max_retries + 1):
+        await limiter.acquire_async(tokens)
+        retry_after = None
+        start = time.perf_counter()
+        try:
+            async with session.post(url, headers={"Authorization": f"Bearer {api_key}"}, json=payload) as response:
+                observe('api_request_seconds', time.perf_counter() - start, endpoint='chat')
+                count('api_requests', endpoint='chat', status=response.status)
+                if response.status == 200:
+                    try:
+                        body = await response.json()
+                    except ValueError as err:
+                        raise AnonymizationError(f'Invalid JSON in completion response: {err}') from err
+                    limiter.on_success(response.headers)
+                    return completion_content(body)
+
+                error = f'{response.status}: {(await response.text())[:200]}'
+                if response.status not in RETRY_STATUS_CODES:
+                    raise AnonymizationError(error)
+
+                retry_after = parse_duration(response.headers.get('Retry-After'))
+                if response.status == 429:
+                    limiter.on_throttled(retry_after)
+                    count('api_throttled', endpoint='chat')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            count('api_requests', endpoint='chat', status='error')
+            error = repr(err)
+
+        if attempt < max_retries:
+            count('api_retries', endpoint='chat')
+            await asyncio.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+
+    raise AnonymizationError(f'Giving up after {max_retries + 1} attempts: {error}')
+
+
+async def get_anonymized_review(sem: asyncio.Semaphore, session: aiohttp.ClientSession, limiter: RateLimiter, text: str, clinic_name: str,
+                                api_key: str, model: str = MODEL, cache: ApiCache = None, url: str = OPENAI_CHAT_URL) -> str:
+    key = review_cache_key(text, clinic_name, model)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached.decode('utf-8')
 
-async def get_anonymized_review(sem: any, session: any, text: str, clinic_name: str, api_key: str, model: str = 'gpt-3.5-turbo') -> str:
     async with sem:
-        openai.api_key = api_key
-        clinic_name = clinic_name.replace("_", " ")  # replace underscores with spaces
-        message = f"Anonymize this review by replacing city/states, business/clinic names, and individual name(s) (including dr. or pronouns) with X. For reference, the business name to anonymize is {clinic_name}.\n\n{text}."
-        response = await session.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={"Authorization": f"Bearer {api_key}"},
-            json={
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": "You are anonymizing review text for author privacy."},
-                    {"role": "user", "content": message}
-                ]
-            }
-        )
-        response = await response.json()
-        if 'choices' not in response:
-            print(f"Error: {response}")
-            return None  # Return None or handle error appropriately
-        return response['choices'][0]['message']['content']
-
-async def rate_limiter(task_queue: Queue, sem, session, rows, api_key):
-    for idx, row in tqdm(rows.iterrows(), total=rows.shape[0]):
-        await task_queue.put(asyncio.ensure_future(get_anonymized_review(sem, session, row['Review_Text'], row['Clinic_Name'], api_key)))
-        if (idx + 1) % RATE_LIMIT == 0:  # Wait for 60 seconds every n tasks
-            await asyncio.sleep(60)
-
-async def main(input_csv: str, output_csv: str, api_key: str) -> None:
+        content = await request_anonymized_review(session, limiter, text, clinic_name, api_key, model, url)
+
+    if cache is not None:
+        cache.put(key, content.encode('utf-8'))
+    return content
+
+
+async def anonymize_rows(rows: pd.DataFrame, journal: ResultJournal, api_key: str, cache: ApiCache = None, url: str = OPENAI_CHAT_URL,
+                         requests_per_minute: float = REQUESTS_PER_MINUTE, tokens_per_minute: float = TOKENS_PER_MINUTE) -> list:
+    """
+    Anonymize every row concurrently and journal each result by review id as soon as it completes,
+    in completion order. Returns the review ids of rows that failed.
+    """
+
+    sem = asyncio.Semaphore(MAX_IN_FLIGHT)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    failed = []
+
+    async def anonymize_row(row_id, row):
+        try:
+            return row_id, await get_anonymized_review(sem, session, limiter, row['Review_Text'], row['Clinic_Name'], api_key, cache=cache, url=url), None
+        except AnonymizationError as err:
+            return row_id, None, err
+
+    connector = aiohttp.TCPConnector(limit=MAX_IN_FLIGHT)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = [asyncio.ensure_future(anonymize_row(row_id, row)) for row_id, (_, row) in zip(review_ids(rows), rows.iterrows())]
+            for next_done in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+                row_id, content, err = await next_done
+                if err is not None:
+                    print(f"Error at review {row_id}: {err}")
+                    failed.append(row_id)
+                    continue
+                journal.append(int(row_id), content)
+    finally:
+        journal.sync()
+    print(f'throttled responses: {limiter.throttled}')
+    return failed
+
+
+def apply_results(df_out: pd.DataFrame, results: dict) -> int:
+    """
+    Write journaled {review id: anonymized text} results into the output table by review id, so they land on
+    the right rows however the table was reordered since. Returns the number of rows filled.
+    """
+
+    if not results:
+        return 0
+    values = pd.Series(review_ids(df_out)).map(pd.Series(results, dtype=object))
+    hit = values.notna().to_numpy()
+    df_out.loc[df_out.index[hit], OUTPUT_COLUMN] = values[hit].to_numpy()
+    return int(hit.sum())
+
+
+def apply_delta(df_in: pd.DataFrame, df_out: pd.DataFrame, manifest: Manifest, stage: str) -> tuple:
+    """
+    Bring the output table in line with the input: reviews that are new, or whose content changed since they
+    were anonymized, are (re)taken from the input with an empty anonymized text, and reviews gone from the input
+    are dropped. Returns (merged output, mask over df_in of reviews to mark once anonymized, removed review ids).
+    """
+
+    ids, prints = review_ids(df_in), fingerprints(df_in)
+    new, changed, removed = manifest.delta(stage, ids, prints)
+
+    out_ids = review_ids(df_out)
+    if fingerprints(df_out) is not None:
+        # Also catches rows anonymized before the manifest existed whose content has changed since.
+        present = np.isin(ids, out_ids)
+        out_prints = pd.Series(fingerprints(df_out), index=out_ids)
+        changed[present] |= out_prints.loc[ids[present]].to_numpy() != prints[present]
+    take = ~np.isin(ids, out_ids) | changed
+    print(f'Delta: {int(take.sum())} new or changed, {removed.shape[0]} removed reviews')
+
+    updates = df_in[take].assign(**{OUTPUT_COLUMN: np.nan})
+    return merge_delta(df_out, updates, ids), new | take, removed
+
+
+async def main(input_csv: str, output_csv: str, api_key: str, cache_path: str = None, url: str = OPENAI_CHAT_URL,
+               manifest_path: str = None, rule_pass: bool = False) -> None:
+    """
+    Anonymize every review of the output table that has no anonymized text yet. Without an existing output,
+    it starts as a copy of the input. With a manifest, new and changed input reviews are merged in first,
+    so only they are sent to the API. With rule_pass, known clinic, author and place names are redacted
+    locally first and only reviews with names the rules cannot resolve are sent to the API; it is off by
+    default because the rules miss lowercase names (see RuleAnonymizer).
+    """
+
     if not os.path.exists(input_csv):
         raise FileNotFoundError(f"The input file '{input_csv}' does not exist.")
 
-    # Set up a semaphore for rate limiting
-    sem = asyncio.Semaphore(RATE_LIMIT)
+    # Results are journaled by review id as they arrive and merged into the output table once at the end.
+    # A journal left by an interrupted run is merged after the delta, which may reorder the rows.
+    if os.path.exists(output_csv):
+        df_out = read_table(output_csv)
+    else:
+        df_out = read_table(input_csv).assign(**{OUTPUT_COLUMN: np.nan})
+    # An all-empty column reads back as float; results are strings.
+    df_out[OUTPUT_COLUMN] = df_out[OUTPUT_COLUMN].astype(object)
+    journal = ResultJournal(output_csv + '.journal.jsonl')
+
+    manifest = None
+    if manifest_path is not None:
+        df_in = read_table(input_csv)
+        if fingerprints(df_in) is not None:
+            manifest = Manifest(manifest_path)
+            stage = stage_name(STAGE, output_csv)
+            df_out, to_mark, removed = apply_delta(df_in, df_out, manifest, stage)
+
+    recovered = apply_results(df_out, journal.read())
+    if recovered:
+        print(f'Recovered {recovered} rows from the journal')
 
     # Get rows that still need to be processed
-    df_out = pd.read_csv(output_csv)
-    unprocessed_rows = df_out[df_out['Anonymized_Review_Text'].isna() | (df_out['Anonymized_Review_Text'].str.strip() == "")]
+    unprocessed_rows = df_out[df_out['Anonymized_Review_Text'].isna() | (df_out['Anonymized_Review_Text'].astype(str).str.strip() == "")]
+
+    # Fill rows whose prompt is already cached without an API call
+    cache = ApiCache(cache_path) if cache_path else None
+    if cache is not None and not unprocessed_rows.empty:
+        with measure('cache', rows=unprocessed_rows.shape[0]):
+            keys = [review_cache_key(row['Review_Text'], row['Clinic_Name']) for _, row in unprocessed_rows.iterrows()]
+            cached = cache.get_many(list(set(keys)))
+            hit = [key in cached for key in keys]
+            df_out.loc[unprocessed_rows.index[hit], 'Anonymized_Review_Text'] = [cached[key].decode('utf-8') for key in keys if key in cached]
+            unprocessed_rows = unprocessed_rows[[not h for h in hit]]
+        count('cache_hits', sum(hit))
+        print(f'Filled {sum(hit)} rows from the cache')
+
+    if rule_pass and not unprocessed_rows.empty:
+        with measure('rule_pass', rows=unprocessed_rows.shape[0]):
+            texts, to_llm = RuleAnonymizer.from_reviews(df_out).route(unprocessed_rows)
+            df_out.loc[unprocessed_rows.index[~to_llm], 'Anonymized_Review_Text'] = texts[~to_llm].to_numpy()
+        count('rule_pass_anonymized', int((~to_llm).sum()))
+        print(f'Rule pass anonymized {int((~to_llm).sum())} rows; {to_llm.mean():.1%} of the rest routed to the LLM')
+        unprocessed_rows = unprocessed_rows[to_llm]
+
     print(f'Number of unprocessed rows: {unprocessed_rows.shape[0]}')
 
-    # Create aiohttp session
-    async with aiohttp.ClientSession() as session:
-        task_queue = asyncio.Queue()
-        asyncio.create_task(rate_limiter(task_queue, sem, session, unprocessed_rows, api_key))
+    with measure('api', rows=unprocessed_rows.shape[0]):
+        failed = await anonymize_rows(unprocessed_rows, journal, api_key, cache, url)
+    count('failed_rows', len(failed))
 
-        for idx in tqdm(range(unprocessed_rows.shape[0])):
-            task = await task_queue.get()
-            resp = await task
+    with measure('write', rows=df_out.shape[0]):
+        apply_results(df_out, journal.read())
+        write_table(df_out, output_csv)
+        journal.remove()
 
-            df_out.loc[unprocessed_rows.index[idx], 'Anonymized_Review_Text'] = resp
+    if manifest is not None:
+        anonymized = df_out.set_index(review_ids(df_out))[OUTPUT_COLUMN].reindex(review_ids(df_in))
+        done = to_mark & anonymized.notna().to_numpy() & (anonymized.astype(str).str.strip() != '').to_numpy()
+        manifest.mark(stage, review_ids(df_in)[done], fingerprints(df_in)[done])
+        manifest.forget(stage, removed)
+        manifest.close()
 
-            # Save progress every 20 reviews
-            if idx % 20 == 0:
-                df_out.to_csv(output_csv, index=False)
-                print(f'saving at idx: {idx}')
+    if failed:
+        print(f'{len(failed)} rows failed and remain unprocessed for the next run.')
 
-        df_out.to_csv(output_csv, index=False)
+    if cache is not None:
+        print(f'cache: {cache.stats()}')
+        cache.close()
 
 if __name__ == '__main__':
     if len(sys.argv) < 4:
-        print("Usage: python anonymize_reviews.py input.csv output.csv api_key")
+        print("Usage: python anonymize_reviews.py input.csv output.csv api_key [cache.sqlite] [manifest.sqlite]")
         sys.exit(1)
 
     input_csv = sys.argv[1]
     output_csv = sys.argv[2]
     api_key = sys.argv[3]
+    cache_path = sys.argv[4] if len(sys.argv) > 4 else None
+    manifest_path = sys.argv[5] if len(sys.argv) > 5 else None
 
     print(f'input csv: {input_csv}')
     print(f'output csv: {output_csv}')
 
-    asyncio.run(main(input_csv, output_csv, api_key))
+    with instrumented_run('anonymize_reviews'):
+        asyncio.run(main(input_csv, output_csv, api_key, cache_path, manifest_path=manifest_path))
@@ -1,61 +1,203 @@
-import pandas as pd
+import hashlib
+import json
 import os
+import re
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-
-def clean_reviews(input_dir, output_csv):
-
-    df_list = []
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            if file.endswith('.csv'):
-
-                csv_path = os.path.join(root, file)
-                df = pd.read_csv(csv_path)
-
-                column_mapping = {
-                    'd4r55': 'Author_Name',
-                    'RfnDt': 'Author_Review_Count',
-                    'rsqaWe': 'Review_Date',
-                    'wiI7pd': 'Review_Text',
-                    'DZSIDd': 'Response_Date',
-                    'wiI7pd 2': 'Response_Text'
-                }
-
-                df.rename(columns=column_mapping, inplace=True)
-
-                if 'Author_Name' in df.columns:
-                    df['Author_Name'] = df['Author_Name'].astype(str)
-                    df = df[df['Author_Name'].str.strip() != ('' or 'nan')]
-
-                if 'Review_Text' in df.columns:
-                    df['Review_Text'] = df['Review_Text'].astype(str)
-                    df = df[~df['Review_Text'].str.endswith('…')]
-                    df = df[df['Review_Text'] != 'nan']
-
-                if 'Response_Text' in df.columns:
-                    df['Response_Text'] = df['Response_Text'].astype(str)
-
-                columns_to_keep = [
-                    'Author_Name',
-                    'Author_Review_Count',
-                    'Review_Date',
-                    'Review_Text',
-                    'Response_Date',
-                    'Response_Text'
-                ]
-                df = df[df.columns.intersection(columns_to_keep)]
-
-                df['State_Province'] = os.path.basename(root)
-                df['Clinic_Name'] = os.path.splitext(file)[0]
-
-                df_list.append(df)
-
-    all_data = pd.concat(df_list, ignore_index=True)
-    all_data.to_csv(output_csv, index=False)
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import add_bytes, file_size, instrumented_run, measure
+from common.reviews import FINGERPRINT_COLUMN, REVIEW_ID_COLUMN, make_fingerprints, make_review_ids
+from common.table_io import export_csv
+
+COLUMN_MAPPING = {
+    'd4r55': 'Author_Name',
+    'RfnDt': 'Author_Review_Count',
+    'rsqaWe': 'Review_Date',
+    'wiI7pd': 'Review_Text',
+    'DZSIDd': 'Response_Date',
+    'wiI7pd 2': 'Response_Text'
+}
+
+COLUMNS_TO_KEEP = [
+    'Author_Name',
+    'Author_Review_Count',
+    'Review_Date',
+    'Review_Text',
+    'Response_Date',
+    'Response_Text'
+]
+
+PARTITION_COLUMN = 'State_Province'
+SOURCES_FILE = '_sources.json'
+
+SCHEMA = pa.schema([(REVIEW_ID_COLUMN, pa.int64())] + [(column, pa.string()) for column in COLUMNS_TO_KEEP]
+                   + [('Clinic_Name', pa.string()), (FINGERPRINT_COLUMN, pa.int64())])
+
+
+def find_clinic_files(input_dir: str) -> list:
+    """
+    (csv path, State_Province, Clinic_Name) of every clinic CSV under input_dir, in a stable order.
+    """
+
+    files = []
+    for root, dirs, names in os.walk(input_dir):
+        for name in names:
+            if name.endswith('.csv'):
+                files.append((os.path.join(root, name), os.path.basename(root), os.path.splitext(name)[0]))
+    return sorted(files)
+
+
+def filter_reviews(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Drop reviews without an author name, without text, or with text truncated by the scraper ('…').
+    """
+
+    keep = pd.Series(True, index=df.index)
+    if 'Author_Name' in df.columns:
+        keep &= df['Author_Name'].fillna('').str.strip() != ''
+    if 'Review_Text' in df.columns:
+        keep &= df['Review_Text'].notna() & ~df['Review_Text'].fillna('').str.endswith('…')
+    return df[keep]
+
+
+def read_clinic_file(csv_path: str, state_province: str, clinic_name: str) -> pd.DataFrame:
+    """
+    Read the needed columns of one clinic CSV as strings, rename them, filter, and assign stable review ids
+    and content fingerprints.
+    """
+
+    df = pd.read_csv(csv_path, usecols=lambda column: column in COLUMN_MAPPING, dtype=str)
+    df = filter_reviews(df.rename(columns=COLUMN_MAPPING))
+    df = df.reindex(columns=COLUMNS_TO_KEEP)
+
+    df[PARTITION_COLUMN] = state_province
+    df['Clinic_Name'] = clinic_name
+    df.insert(0, REVIEW_ID_COLUMN, make_review_ids(df))
+    df[FINGERPRINT_COLUMN] = make_fingerprints(df)
+
+    # The same author and text scraped twice from one clinic is the same review.
+    return df.drop_duplicates(subset=REVIEW_ID_COLUMN)
+
+
+def partition_file(output_dir: str, csv_path: str, state_province: str, clinic_name: str) -> str:
+    safe_name = re.sub(r'[^\w.-]+', '_', clinic_name)[:80]
+    digest = hashlib.sha1(csv_path.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(output_dir, f'{PARTITION_COLUMN}={state_province}', f'{safe_name}-{digest}.parquet')
+
+
+def _ingest_file(args: tuple) -> tuple:
+    """
+    Clean one clinic CSV and write it as its own Parquet file in the State_Province partition.
+    Only the row count goes back to the parent process, so memory does not grow with the number of files.
+    """
+
+    output_dir, csv_path, state_province, clinic_name = args
+    df = read_clinic_file(csv_path, state_province, clinic_name)
+    if df.empty:
+        return csv_path, 0
+
+    path = partition_file(output_dir, csv_path, state_province, clinic_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(df.drop(columns=[PARTITION_COLUMN]), schema=SCHEMA, preserve_index=False)
+    pq.write_table(table, path, compression='zstd')
+    return csv_path, df.shape[0]
+
+
+def source_state(csv_path: str) -> list:
+    stat = os.stat(csv_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_sources(output_dir: str) -> dict:
+    path = os.path.join(output_dir, SOURCES_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_sources(output_dir: str, sources: dict) -> None:
+    with open(os.path.join(output_dir, SOURCES_FILE), 'w') as f:
+        json.dump(sources, f, indent=2, sort_keys=True)
+
+
+def clean_reviews(input_dir: str, output_dir: str, workers: int = None, overwrite: bool = False, output_csv: str = None,
+                  incremental: bool = False) -> int:
+    """
+    Clean every clinic CSV under input_dir in a process pool and write a Parquet dataset partitioned by
+    State_Province, one file per clinic, with a stable Review_Id and a Content_Fingerprint per review.
+    Optionally also export one CSV.
+
+    With incremental, an existing dataset is updated in place: only clinic files that are new or changed
+    (by size and modification time) since the last run are re-ingested, and the output of deleted clinic
+    files is removed. Returns the number of reviews written.
+    """
+
+    if not os.path.exists(input_dir):
+        raise FileNotFoundError(f"The input directory '{input_dir}' does not exist.")
+
+    sources = load_sources(output_dir) if incremental and not overwrite else {}
+    if os.path.exists(output_dir) and not sources:
+        if not overwrite:
+            should_proceed = input(f"The output directory '{output_dir}' already exists. Do you want to overwrite it? (y/n): ")
+            if should_proceed.lower() != 'y':
+                sys.exit(f"Execution stopped. The output directory '{output_dir}' already exists.")
+        shutil.rmtree(output_dir)
+
+    files = find_clinic_files(input_dir)
+    current = {csv_path: source_state(csv_path) for csv_path, _, _ in files}
+    for csv_path in set(sources) - set(current):
+        output_file = sources.pop(csv_path)['output']
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+    tasks = [(output_dir, csv_path, state_province, clinic_name) for csv_path, state_province, clinic_name in files
+             if sources.get(csv_path, {}).get('state') != current[csv_path]]
+    print(f'{len(tasks)} of {len(files)} clinic files are new or changed')
+    for _, csv_path, state_province, clinic_name in tasks:
+        output_file = partition_file(output_dir, csv_path, state_province, clinic_name)
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+    with measure('ingest') as record:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                counts = list(tqdm(executor.map(_ingest_file, tasks, chunksize=8), total=len(tasks), desc='Cleaning clinic files'))
+        else:
+            counts = [_ingest_file(task) for task in tqdm(tasks, desc='Cleaning clinic files')]
+        # The files are read and written in the worker processes; credit their sizes here.
+        record.add_rows(sum(count for _, count in counts))
+        add_bytes(read=sum(file_size(csv_path) for _, csv_path, _, _ in tasks),
+                  written=sum(file_size(partition_file(*task)) for task in tasks))
+
+    for (_, csv_path, state_province, clinic_name), (_, count) in zip(tasks, counts):
+        sources[csv_path] = {'state': current[csv_path], 'output': partition_file(output_dir, csv_path, state_province, clinic_name),
+                             'rows': count}
+    os.makedirs(output_dir, exist_ok=True)
+    save_sources(output_dir, sources)
+
+    total = sum(count for _, count in counts)
+    print(f'Wrote {total} reviews from {len(tasks)} clinic files to {output_dir}')
+
+    if output_csv is not None:
+        with measure('export_csv', rows=total):
+            export_csv(output_dir, output_csv)
+
+    return total
 
 
 if __name__ == '__main__':
     input_dir = '../../data/raw_data'
+    output_dir = '../data/cleaned_reviews'
     output_csv = '../data/cleaned_reviews.csv'
 
-    clean_reviews(input_dir, output_csv)
\ No newline at end of file
+    with instrumented_run('clean_reviews'):
+        clean_reviews(input_dir, output_dir, output_csv=output_csv, incremental=True)
@@ -0,0 +1,206 @@
+import os
+import re
+import sys
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.table_io import read_table
+
+TOKEN = re.compile(r"\w+(?:'\w+)?")
+TITLES = frozenset(['dr', 'doctor', 'mr', 'mrs', 'ms', 'miss', 'prof', 'nurse'])
+# Titles that are always followed by a name, however it is cased ("dr patel", "DR. SMITH").
+ABBREVIATED_TITLES = frozenset(['dr', 'mr', 'mrs', 'ms', 'prof'])
+# Words that are always capitalized, so the corpus never uses them in lowercase.
+CAPITALIZED_WORDS = frozenset(['i', "i'm", "i've", "i'd", "i'll", 'ok'])
+# Third-person pronouns that identify an individual; the API prompt asks for these to be replaced as well.
+PRONOUNS = frozenset(['he', 'him', 'his', 'himself', 'she', 'her', 'hers', 'herself'])
+GAZETTEER_COLUMNS = {'Clinic_Name': 'clinic', 'Author_Name': 'author', 'State_Province': 'place'}
+REDACTION = 'X'
+MIN_NAME_TOKEN_LENGTH = 3
+
+
+def tokenize(text: str) -> list:
+    """
+    (start, end, lowercase token) of every word in the text.
+    """
+
+    return [(match.start(), match.end(), match.group().lower()) for match in TOKEN.finditer(text)]
+
+
+class AhoCorasick:
+    """
+    Word-level Aho-Corasick automaton: finds every phrase of a gazetteer in one pass over a token list,
+    however many phrases there are. Phrases are sequences of lowercase tokens, so matches always fall on
+    word boundaries.
+    """
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]  # (phrase length, label) of the longest phrase ending at each state
+        self.dict_link = [0]  # nearest state on the fail chain with an output
+        self._built = False
+
+    def add(self, phrase: tuple, label: str) -> None:
+        state = 0
+        for token in phrase:
+            if token not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(None)
+                self.dict_link.append(0)
+                self.goto[state][token] = len(self.goto) - 1
+            state = self.goto[state][token]
+        if self.output[state] is None:
+            self.output[state] = (len(phrase), label)
+        self._built = False
+
+    def build(self) -> 'AhoCorasick':
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for token, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token, 0)
+                link = self.fail[child]
+                self.dict_link[child] = link if self.output[link] is not None else self.dict_link[link]
+        self._built = True
+        return self
+
+    def find(self, tokens: list) -> list:
+        """
+        Non-overlapping (first token, last token + 1, label) matches, preferring the leftmost, then the longest.
+        """
+
+        if not self._built:
+            self.build()
+
+        matches = []
+        state = 0
+        for position, token in enumerate(tokens):
+            while state and token not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(token, 0)
+
+            found = state if self.output[state] is not None else self.dict_link[state]
+            while found:
+                length, label = self.output[found]
+                matches.append((position + 1 - length, position + 1, label))
+                found = self.dict_link[found]
+
+        selected = []
+        for start, end, label in sorted(matches, key=lambda match: (match[0], -match[1])):
+            if not selected or start >= selected[-1][1]:
+                selected.append((start, end, label))
+        return selected
+
+
+def corpus_lexicon(texts, min_count: int = 2) -> frozenset:
+    """
+    Words the corpus uses in lowercase at least min_count times. A capitalized word mid-sentence that is
+    not in the lexicon is probably a name.
+    """
+
+    counts = Counter(word for text in texts if isinstance(text, str) for word in TOKEN.findall(text) if word.islower())
+    return frozenset(word for word, count in counts.items() if count >= min_count)
+
+
+def gazetteer_phrases(values, lexicon: frozenset) -> set:
+    """
+    Lowercase token phrases to redact for a gazetteer column: every full value (underscores read as spaces),
+    plus its single name tokens that are not ordinary words of the corpus.
+    """
+
+    phrases = set()
+    for value in pd.Series(values).dropna().astype(str).unique():
+        tokens = tuple(token for _, _, token in tokenize(value.replace('_', ' ')))
+        if not tokens:
+            continue
+        phrases.add(tokens)
+        for token in tokens:
+            if len(token) >= MIN_NAME_TOKEN_LENGTH and not token.isdigit() and token not in lexicon:
+                phrases.add((token,))
+    return phrases
+
+
+class RuleAnonymizer:
+    """
+    Local anonymization pass run before the chat API.
+
+    Redacts what the API prompt asks for: known clinic, author and place names from the review table,
+    titled names ("Dr. Smith", "dr patel") and gendered pronouns are replaced with X, with one multi-pattern
+    match per review. Anything else that may be a name routes the review to the LLM: a word starting with
+    a capital letter, at sentence start or in all caps included, that the corpus never uses in lowercase,
+    and a full title ("doctor", "nurse") followed by such a word. Places are only known from State_Province,
+    so a city is routed like any other unknown name. A lowercase name without a title is not recognised,
+    which is why the pass is opt-in.
+    """
+
+    def __init__(self, matcher: AhoCorasick, lexicon: frozenset):
+        self.matcher = matcher
+        self.lexicon = lexicon
+
+    @classmethod
+    def from_reviews(cls, df: pd.DataFrame, text_column: str = 'Review_Text', min_count: int = 2) -> 'RuleAnonymizer':
+        lexicon = corpus_lexicon(df[text_column], min_count)
+        matcher = AhoCorasick()
+        for column, label in GAZETTEER_COLUMNS.items():
+            if column in df.columns:
+                for phrase in gazetteer_phrases(df[column], lexicon):
+                    matcher.add(phrase, label)
+        return cls(matcher.build(), lexicon)
+
+    def anonymize(self, text: str) -> tuple:
+        """
+        (redacted text, True when the review still needs the LLM).
+        """
+
+        spans = tokenize(text)
+        redact = [(start, end) for start, end, _ in self.matcher.find([token for _, _, token in spans])]
+        covered = {i for start, end in redact for i in range(start, end)}
+
+        ambiguous = False
+        for i, (start, end, token) in enumerate(spans):
+            if i in covered:
+                continue
+            if token in PRONOUNS:
+                redact.append((i, i + 1))
+                continue
+            if token in TITLES and i + 1 < len(spans) and i + 1 not in covered:
+                following_start, _, following = spans[i + 1]
+                if token in ABBREVIATED_TITLES or text[following_start].isupper():
+                    redact.append((i, i + 2))
+                    covered.add(i + 1)
+                elif following not in self.lexicon:
+                    ambiguous = True
+                continue
+            if text[start].isupper() and token not in self.lexicon and token not in TITLES and token not in CAPITALIZED_WORDS:
+                ambiguous = True
+
+        for start, end in sorted(redact, reverse=True):
+            text = text[:spans[start][0]] + REDACTION + text[spans[end - 1][1]:]
+        return text, ambiguous
+
+    def route(self, rows: pd.DataFrame, text_column: str = 'Review_Text') -> tuple:
+        """
+        Run the pass over a review table. Returns (redacted texts, boolean mask of rows to send to the LLM).
+        """
+
+        results = [self.anonymize(text) if isinstance(text, str) else (text, True) for text in rows[text_column]]
+        texts = pd.Series([text for text, _ in results], index=rows.index, dtype=object)
+        return texts, np.array([ambiguous for _, ambiguous in results], dtype=bool)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python rule_anonymizer.py reviews.csv")
+        sys.exit(1)
+
+    reviews = read_table(sys.argv[1])
+    _, to_llm = RuleAnonymizer.from_reviews(reviews).route(reviews)
+    print(f'{to_llm.mean():.1%} of {to_llm.shape[0]} reviews would be routed to the LLM')
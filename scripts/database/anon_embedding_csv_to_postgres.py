@@ -1,8 +1,40 @@
+import io
+import itertools
+import math
 import os
-import ast
+import struct
+import sys
+import time
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 from sqlalchemy import create_engine
 from dotenv import load_dotenv
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import add_bytes, add_rows, instrumented_run, measure
+from common.manifest import Manifest, stage_name
+from common.reviews import FINGERPRINT_COLUMN, REVIEW_ID_COLUMN, review_ids
+from common.table_io import iter_batches, read_table, table_columns, table_schema
+from embedding_analysis.embedding_store import EmbeddingStore
+
+STAGE = 'postgres'
+ID_COLUMN = 'review_id'
+FINGERPRINT = FINGERPRINT_COLUMN.lower()
+EMBEDDING_COLUMN = 'anonymous_embedding'
+VECTOR_TYPES = ('real[]', 'vector')
+# Columns of the review tables whose type is known; everything else follows the input's schema.
+KNOWN_TYPES = {ID_COLUMN: 'BIGINT', FINGERPRINT: 'BIGINT', 'cluster': 'BIGINT', 'sentiment': 'DOUBLE PRECISION',
+               'preprocessed_review_text': 'TEXT'}
+# Columns of the cluster_reviews and score_sentiment outputs that db_cluster_analytics aggregates.
+ANNOTATION_COLUMNS = ('Cluster', 'Sentiment', 'Preprocessed_Review_Text')
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('>h', -1)
+NULL_FIELD = struct.pack('>i', -1)
+FLOAT4_OID = 700
 
 
 def load_env_vars() -> dict:
@@ -28,42 +60,389 @@ def create_sqlalchemy_engine(credentials: dict):
         f"postgresql://{credentials['username']}:{credentials['password']}@{credentials['host']}:{credentials['port']}/{credentials['db_name']}")
 
 
-def load_data(input_csv: str) -> pd.DataFrame:
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = df.columns.str.lower().str.replace(' ', '_')
+    return df
+
+
+def read_annotations(annotation_tables: list) -> pd.DataFrame:
     """
-    Load data from the CSV file and prepare it for insertion into the database.
+    The ANNOTATION_COLUMNS of other stage outputs (e.g. the cluster_reviews output for Cluster and
+    Preprocessed_Review_Text, the score_sentiment output for Sentiment), indexed by review id, with the
+    loader's column names. The first table that has a column provides it.
     """
-    df = pd.read_csv(input_csv)
-    df = df.dropna(subset=['Anonymous_Embedding'])
 
-    df['Anonymous_Embedding'] = df['Anonymous_Embedding'].apply(ast.literal_eval)
-    df.columns = df.columns.str.lower().str.replace(' ', '_')
+    frames = []
+    found = set()
+    for path in annotation_tables:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"The annotation table '{path}' does not exist.")
+        columns = table_columns(path)
+        if REVIEW_ID_COLUMN not in columns:
+            raise ValueError(f"The annotation table '{path}' has no {REVIEW_ID_COLUMN} column, so it cannot be joined to the reviews.")
+        wanted = [column for column in ANNOTATION_COLUMNS if column in columns and column not in found]
+        if not wanted:
+            raise ValueError(f"The annotation table '{path}' has none of the columns {', '.join(ANNOTATION_COLUMNS)} left to load.")
+        found.update(wanted)
+        frame = read_table(path, [REVIEW_ID_COLUMN] + wanted).drop_duplicates(REVIEW_ID_COLUMN)
+        frames.append(frame.set_index(REVIEW_ID_COLUMN))
+    return normalize_columns(pd.concat(frames, axis=1))
 
-    return df
+
+def iter_chunks(input_csv: str, store_dir: str, chunksize: int = 10_000, annotations: pd.DataFrame = None, input_ids: list = None):
+    """
+    Stream the input table (CSV or Parquet) in chunks and yield (DataFrame with a review_id column, float32 embedding matrix)
+    for the rows that have an embedding in the store. With annotations (see read_annotations), their columns
+    are joined on by review id, NULL for reviews they do not cover. With input_ids, the review ids of every
+    input row, embedded or not, are collected in it.
+    """
+
+    store = EmbeddingStore(store_dir)
+    filled_ids = store.row_ids[np.asarray(store.filled)]
+
+    for chunk in iter_batches(input_csv, batch_size=chunksize):
+        chunk = chunk.drop(columns=['Anonymous_Embedding'], errors='ignore')
+        ids = review_ids(chunk)
+        if input_ids is not None:
+            input_ids.append(np.asarray(ids, dtype=np.int64))
+        has_embedding = np.isin(ids, filled_ids)
+        chunk = normalize_columns(chunk[has_embedding].copy())
+        if chunk.empty:
+            continue
+
+        chunk[ID_COLUMN] = ids[has_embedding]
+        if annotations is not None:
+            for column in annotations.columns:
+                chunk[column] = annotations[column].reindex(chunk[ID_COLUMN]).to_numpy()
+        _, matrix = store.load(ids[has_embedding])
+        yield chunk, matrix
+
+
+def arrow_column_type(data_type: pa.DataType) -> str:
+    if pa.types.is_boolean(data_type):
+        return 'BOOLEAN'
+    if pa.types.is_integer(data_type):
+        return 'BIGINT'
+    if pa.types.is_floating(data_type):
+        return 'DOUBLE PRECISION'
+    return 'TEXT'
+
+
+def column_type(values: pd.Series) -> str:
+    """
+    Type of a CSV column, judged from one chunk: numeric only if every value of the chunk is a number, and then
+    DOUBLE PRECISION, so whole-number floats are not truncated by later chunks. Columns that are empty in the
+    chunk (such as Response_Text of clinics without responses) and all others are TEXT.
+    """
+
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return 'BOOLEAN'
+    if pd.api.types.is_numeric_dtype(values.dtype) and values.notna().all():
+        return 'DOUBLE PRECISION'
+    return 'TEXT'
 
 
-def insert_data(df: pd.DataFrame, engine, table_name: str = 'reviews') -> None:
+def table_column_types(input_csv: str, chunk: pd.DataFrame) -> dict:
     """
-    Insert data from DataFrame into PostgreSQL.
+    Postgres type of each column: KNOWN_TYPES, then the input's Arrow schema for Parquet inputs, then
+    column_type for CSV columns.
     """
-    df.to_sql(table_name, engine, if_exists='append', index=False)
 
+    schema = table_schema(input_csv)
+    arrow_types = {} if schema is None else {name.lower().replace(' ', '_'): schema.field(name).type for name in schema.names}
+    types = {}
+    for column in chunk.columns:
+        if column in KNOWN_TYPES:
+            types[column] = KNOWN_TYPES[column]
+        elif column in arrow_types:
+            types[column] = arrow_column_type(arrow_types[column])
+        else:
+            types[column] = column_type(chunk[column])
+    return types
 
-def main(input_csv: str, overwrite: bool = False) -> None:
+
+def unique_chunks(chunks):
+    """
+    Drop rows whose review id already appeared, in the chunk or an earlier one, so COPY into a fresh table and
+    INSERT ... ON CONFLICT never see an id twice. Duplicate ids come from reviews with identical key columns.
+    """
+
+    seen = set()
+    for chunk, matrix in chunks:
+        keep = np.ones(chunk.shape[0], dtype=bool)
+        for position, review_id in enumerate(chunk[ID_COLUMN].tolist()):
+            if review_id in seen:
+                keep[position] = False
+            else:
+                seen.add(review_id)
+        if not keep.all():
+            print(f'Skipping {int((~keep).sum())} rows with duplicate review ids')
+        if keep.any():
+            yield chunk[keep], matrix[keep]
+
+
+def _is_null(value) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value)) or value is pd.NA
+
+
+def field_encoder(pg_type: str):
     """
-    Main function to load data from a CSV file and insert it into a PostgreSQL database.
+    Encoder from a Python value to a length-prefixed binary COPY field of the given type.
+    Values are coerced, so a column keeps its type even if a later chunk infers another dtype.
+    """
+
+    if pg_type == 'BIGINT':
+        return lambda value: NULL_FIELD if _is_null(value) else struct.pack('>iq', 8, int(value))
+    if pg_type == 'DOUBLE PRECISION':
+        return lambda value: NULL_FIELD if _is_null(value) else struct.pack('>id', 8, float(value))
+    if pg_type == 'BOOLEAN':
+        return lambda value: NULL_FIELD if _is_null(value) else struct.pack('>ib', 1, bool(value))
+
+    def encode_text(value):
+        if _is_null(value):
+            return NULL_FIELD
+        data = str(value).replace('\x00', '').encode('utf-8')
+        return struct.pack('>i', len(data)) + data
+
+    return encode_text
+
+
+def embedding_fields(matrix: np.ndarray, vector_type: str) -> list:
+    """
+    Binary COPY fields for each embedding row, encoded in bulk with NumPy.
+    real[] uses the array wire format (header plus a length-prefixed float4 per element);
+    vector uses pgvector's format (int16 dimension, int16 unused, float4 elements).
+    """
+
+    n, dim = matrix.shape
+    if vector_type == 'vector':
+        prefix = struct.pack('>ihh', 4 + 4 * dim, dim, 0)
+        body = matrix.astype('>f4')
+    else:
+        prefix = struct.pack('>iiiiii', 20 + 8 * dim, 1, 0, FLOAT4_OID, dim, 1)
+        body = np.empty((n, dim), dtype=[('length', '>i4'), ('value', '>f4')])
+        body['length'] = 4
+        body['value'] = matrix
+
+    return [prefix + row.tobytes() for row in body]
+
+
+def encode_copy_chunk(df: pd.DataFrame, columns: list, column_types: dict, matrix: np.ndarray, vector_type: str) -> io.BytesIO:
+    """
+    Encode a chunk as a complete PGCOPY binary stream: scalar columns, then the embedding column.
+    """
+
+    encoders = [field_encoder(column_types[column]) for column in columns]
+    field_count = struct.pack('>h', len(columns) + 1)
+    vectors = embedding_fields(matrix, vector_type)
+
+    buffer = io.BytesIO()
+    buffer.write(PGCOPY_HEADER)
+    for values, vector in zip(zip(*(df[column].tolist() for column in columns)), vectors):
+        buffer.write(field_count)
+        for encode, value in zip(encoders, values):
+            buffer.write(encode(value))
+        buffer.write(vector)
+    buffer.write(PGCOPY_TRAILER)
+    buffer.seek(0)
+
+    return buffer
+
+
+def create_table(cursor, table_name: str, column_types: dict, vector_type: str, dim: int) -> None:
+    if vector_type == 'vector':
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS vector')
+        embedding_type = f'vector({dim})'
+    else:
+        embedding_type = 'REAL[]'
+
+    definitions = [f'{ID_COLUMN} BIGINT PRIMARY KEY']
+    definitions += [f'"{column}" {pg_type}' for column, pg_type in column_types.items() if column != ID_COLUMN]
+    definitions.append(f'{EMBEDDING_COLUMN} {embedding_type}')
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS {table_name} ({", ".join(definitions)})')
+
+
+def secondary_indexes(cursor, table_name: str) -> list:
+    """
+    (name, definition) of the table's non-primary, non-unique indexes.
+    """
+
+    cursor.execute('''
+        SELECT index_class.relname, pg_get_indexdef(index_class.oid)
+        FROM pg_index
+        JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+        WHERE pg_index.indrelid = %s::regclass AND NOT pg_index.indisprimary AND NOT pg_index.indisunique
+    ''', (table_name,))
+    return cursor.fetchall()
+
+
+def copy_chunk(cursor, table_name: str, columns: list, buffer: io.BytesIO, upsert: bool) -> None:
+    """
+    COPY one encoded chunk. With upsert, the chunk goes through a temporary staging table
+    and is merged with INSERT ... ON CONFLICT (review_id) DO UPDATE, so reruns are idempotent.
+    """
+
+    column_list = ', '.join(f'"{column}"' for column in columns + [EMBEDDING_COLUMN])
+    if not upsert:
+        cursor.copy_expert(f'COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT binary)', buffer)
+        return
+
+    staging = f'{table_name}_staging'
+    cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table_name} INCLUDING DEFAULTS)')
+    cursor.execute(f'TRUNCATE {staging}')
+    cursor.copy_expert(f'COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT binary)', buffer)
+    updates = ', '.join(f'"{column}" = EXCLUDED."{column}"' for column in columns + [EMBEDDING_COLUMN] if column != ID_COLUMN)
+    cursor.execute(f'INSERT INTO {table_name} ({column_list}) SELECT {column_list} FROM {staging} '
+                   f'ON CONFLICT ({ID_COLUMN}) DO UPDATE SET {updates}')
+
+
+def delta_chunks(chunks, manifest: Manifest, stage: str):
+    """
+    Keep only the rows of each chunk that are new or changed for the stage.
+    """
+
+    processed = manifest.processed(stage)
+    for chunk, matrix in chunks:
+        ids = chunk[ID_COLUMN].to_numpy(dtype=np.int64)
+        new, changed, _ = manifest.delta(stage, ids, chunk[FINGERPRINT].to_numpy(dtype=np.int64), processed)
+        pending = new | changed
+        if pending.any():
+            yield chunk[pending], matrix[pending]
+
+
+def delete_removed(connection, table_name: str, manifest: Manifest, stage: str, input_ids: list) -> None:
+    """
+    Delete loaded reviews that are no longer in the input, and forget them in the manifest. input_ids holds
+    every input review id (see iter_chunks), so a review whose embedding is pending after a text change is kept.
+    """
+
+    processed = manifest.processed(stage).index.to_numpy()
+    removed = np.setdiff1d(processed, np.concatenate(input_ids) if input_ids else np.empty(0, dtype=np.int64))
+    if removed.shape[0] == 0:
+        return
+
+    cursor = connection.cursor()
+    cursor.execute(f'DELETE FROM {table_name} WHERE {ID_COLUMN} = ANY(%s)', (removed.tolist(),))
+    connection.commit()
+    cursor.close()
+    manifest.forget(stage, removed)
+    print(f'Deleted {removed.shape[0]} reviews that are no longer in the input')
+
+
+def load_reviews(connection, input_csv: str, store_dir: str, table_name: str = 'reviews', vector_type: str = 'real[]',
+                 overwrite: bool = False, chunksize: int = 10_000, defer_indexes: bool = True, post_load_indexes: list = (),
+                 manifest: Manifest = None, annotation_tables: list = ()) -> int:
+    """
+    Stream reviews and their embeddings into PostgreSQL with binary COPY, one committed chunk at a time.
+
+    Rows are keyed on the stable review id and upserted, so a rerun updates rows instead of duplicating them;
+    repeated ids within the input are loaded once. Column types come from table_column_types, not from the
+    values of the first chunk alone. With annotation_tables, the cluster, sentiment and preprocessed text
+    columns db_cluster_analytics needs are joined on by review id (see read_annotations). A freshly created (or overwritten) table is loaded with COPY directly. With defer_indexes, secondary
+    indexes are dropped before the load and rebuilt afterwards, together with any post_load_indexes
+    statements (for example an ivfflat index on the vector column). With a manifest and fingerprinted input,
+    only new or changed reviews are loaded and reviews gone from the input are deleted.
+    Returns the number of rows loaded.
+    """
+
+    if vector_type not in VECTOR_TYPES:
+        raise ValueError(f'Unknown vector type {vector_type}. Please choose one of {VECTOR_TYPES}.')
+
+    annotations = read_annotations(annotation_tables) if annotation_tables else None
+    input_ids = []
+    chunks = unique_chunks(iter_chunks(input_csv, store_dir, chunksize, annotations, input_ids))
+    stage = stage_name(STAGE, table_name)
+    if manifest is not None and FINGERPRINT_COLUMN in table_columns(input_csv):
+        if overwrite:
+            manifest.forget(stage)
+        chunks = delta_chunks(chunks, manifest, stage)
+    else:
+        manifest = None
+    try:
+        first_chunk, first_matrix = next(chunks)
+    except StopIteration:
+        print('No new or changed rows with embeddings to load.')
+        if manifest is not None:
+            delete_removed(connection, table_name, manifest, stage, input_ids)
+        return 0
+
+    columns = [ID_COLUMN] + [column for column in first_chunk.columns if column != ID_COLUMN]
+    column_types = table_column_types(input_csv, first_chunk[columns])
+
+    cursor = connection.cursor()
+    if overwrite:
+        cursor.execute(f'DROP TABLE IF EXISTS {table_name}')
+    cursor.execute('SELECT to_regclass(%s)', (table_name,))
+    upsert = cursor.fetchone()[0] is not None
+    create_table(cursor, table_name, column_types, vector_type, first_matrix.shape[1])
+
+    deferred = secondary_indexes(cursor, table_name) if defer_indexes else []
+    for name, _ in deferred:
+        cursor.execute(f'DROP INDEX "{name}"')
+    connection.commit()
+
+    rows = 0
+    start = time.perf_counter()
+    with measure('copy'), tqdm(desc='Loading reviews', unit='rows') as progress:
+        for chunk, matrix in itertools.chain([(first_chunk, first_matrix)], chunks):
+            buffer = encode_copy_chunk(chunk, columns, column_types, matrix, vector_type)
+            add_bytes(written=buffer.getbuffer().nbytes)
+            copy_chunk(cursor, table_name, columns, buffer, upsert)
+            connection.commit()
+            if manifest is not None:
+                manifest.mark(stage, chunk[ID_COLUMN].to_numpy(), chunk[FINGERPRINT].to_numpy())
+            rows += chunk.shape[0]
+            add_rows(chunk.shape[0])
+            progress.update(chunk.shape[0])
+
+    if manifest is not None:
+        delete_removed(connection, table_name, manifest, stage, input_ids)
+
+    with measure('indexes'):
+        for _, definition in deferred:
+            cursor.execute(definition)
+        for statement in post_load_indexes:
+            cursor.execute(statement)
+        cursor.execute(f'ANALYZE {table_name}')
+        connection.commit()
+    cursor.close()
+
+    elapsed = time.perf_counter() - start
+    print(f'Loaded {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/sec)')
+    return rows
+
+
+def main(input_csv: str, store_dir: str, overwrite: bool = False, vector_type: str = 'real[]', table_name: str = 'reviews',
+         manifest_path: str = None, annotation_tables: list = ()) -> None:
+    """
+    Main function to stream data from a CSV file and its embedding store into a PostgreSQL database.
+    With overwrite, the table is dropped and recreated; otherwise rows are upserted by review id.
+    With a manifest, only new or changed reviews are sent, so reload with overwrite when only the
+    annotation tables (the cluster and sentiment outputs joined on by review id) have changed.
     """
     if not os.path.exists(input_csv):
         raise FileNotFoundError(f"The input file '{input_csv}' does not exist.")
 
     credentials = load_env_vars()
     engine = create_sqlalchemy_engine(credentials)
-    df = load_data(input_csv)
-
-    insert_data(df, engine)
+    connection = engine.raw_connection()
+    manifest = Manifest(manifest_path) if manifest_path is not None else None
+    try:
+        load_reviews(connection, input_csv, store_dir, table_name, vector_type, overwrite, manifest=manifest,
+                     annotation_tables=annotation_tables)
+    finally:
+        connection.close()
+        if manifest is not None:
+            manifest.close()
 
 
 if __name__ == '__main__':
     input_csv = '/Users/ianspence/Desktop/review-analysis/data/anonymized_reviews_qc6_23743_embeddings.csv'
+    store_dir = '/Users/ianspence/Desktop/review-analysis/data/anonymized_reviews_qc6_23743_embeddings'
+    manifest_path = '/Users/ianspence/Desktop/review-analysis/output/manifest.sqlite'
+    annotation_tables = ['./output/word_count_analysis/csv/reviews_with_9_clusters.csv',
+                         './output/sentiment_analysis/csv/review_sentiment_VADER.csv']
     overwrite = False
 
-    main(input_csv, overwrite)
+    with instrumented_run('load_postgres'):
+        main(input_csv, store_dir, overwrite, manifest_path=manifest_path, annotation_tables=annotation_tables)
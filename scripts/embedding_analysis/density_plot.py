@@ -0,0 +1,119 @@
+import numpy as np
+
+GRID_SIZE = 1000
+DENSITY_THRESHOLD = 100_000  # Above this many points, 'auto' rendering draws a density image instead of markers
+NOISE_COLOR = (0.85, 0.85, 0.85, 1.0)
+
+
+def grid_extent(x: np.ndarray, y: np.ndarray) -> tuple:
+    """
+    (x_min, x_max, y_min, y_max) of the points, widened where all values are equal so every bin has a width.
+    """
+
+    extent = []
+    for values in (x, y):
+        low, high = float(np.min(values)), float(np.max(values))
+        if high <= low:
+            low, high = low - 0.5, high + 0.5
+        extent += [low, high]
+    return tuple(extent)
+
+
+def bin_index(x: np.ndarray, y: np.ndarray, extent: tuple, bins: int) -> np.ndarray:
+    """
+    Flat index (row * bins + column) of the grid cell of every point, rows along y.
+    """
+
+    x_min, x_max, y_min, y_max = extent
+    columns = np.clip(((x - x_min) / (x_max - x_min) * bins).astype(np.int64), 0, bins - 1)
+    rows = np.clip(((y - y_min) / (y_max - y_min) * bins).astype(np.int64), 0, bins - 1)
+    return rows * bins + columns
+
+
+def aggregate_grid(x: np.ndarray, y: np.ndarray, values: np.ndarray = None, statistic: str = 'count', bins: int = GRID_SIZE,
+                   extent: tuple = None) -> tuple:
+    """
+    Aggregate points into a bins x bins grid, one pass of np.bincount over the points.
+
+    statistic='count' gives the number of points per cell, 'mean' the mean of values per cell and
+    'majority' the most frequent value (e.g. a cluster label) per cell. Cells without points are NaN
+    for 'mean' and 'majority'. Returns (grid with rows along y, extent).
+    """
+
+    if statistic not in ('count', 'mean', 'majority'):
+        raise ValueError(f'Unknown statistic {statistic}. Please choose "count", "mean" or "majority".')
+
+    extent = extent or grid_extent(x, y)
+    index = bin_index(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), extent, bins)
+    counts = np.bincount(index, minlength=bins * bins)
+
+    if statistic == 'count':
+        grid = counts.astype(np.float64)
+    elif statistic == 'mean':
+        sums = np.bincount(index, weights=np.asarray(values, dtype=np.float64), minlength=bins * bins)
+        grid = np.full(bins * bins, np.nan)
+        np.divide(sums, counts, out=grid, where=counts > 0)
+    else:
+        labels, codes = np.unique(np.asarray(values), return_inverse=True)
+        # Count each (cell, label) pair, then write the labels in increasing count order: the last write, the majority, wins.
+        pairs, pair_counts = np.unique(index * labels.shape[0] + codes.ravel(), return_counts=True)
+        order = np.argsort(pair_counts, kind='stable')
+        grid = np.full(bins * bins, np.nan)
+        grid[pairs[order] // labels.shape[0]] = labels[pairs[order] % labels.shape[0]]
+
+    return grid.reshape(bins, bins), extent
+
+
+def label_image(grid: np.ndarray, cmap_name: str = 'tab20') -> np.ndarray:
+    """
+    RGBA image of a majority-label grid: one colour per label, light grey for noise (label -1),
+    transparent where there are no points.
+    """
+
+    import matplotlib.pyplot as plt
+
+    cmap = plt.get_cmap(cmap_name)
+    image = np.zeros(grid.shape + (4,))
+    filled = ~np.isnan(grid)
+    labels = grid[filled].astype(np.int64)
+    colors = cmap(np.mod(labels, cmap.N))
+    colors[labels < 0] = NOISE_COLOR
+    image[filled] = colors
+    return image
+
+
+def plot_density(coordinates: np.ndarray, values: np.ndarray, output_png: str, statistic: str = 'mean', bins: int = GRID_SIZE,
+                 cmap: str = 'coolwarm', title: str = None, colorbar_label: str = None) -> None:
+    """
+    Plot 2-D or 3-D coordinates as an aggregated image instead of one marker per point, so the drawing
+    cost depends on the grid size, not the number of points. 3-D coordinates are drawn as their three
+    pairwise projections side by side. See aggregate_grid for the statistics.
+    """
+
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+
+    if coordinates.shape[1] not in (2, 3):
+        raise ValueError(f'Density plots need 2 or 3 components, not {coordinates.shape[1]}.')
+
+    pairs = [(0, 1)] if coordinates.shape[1] == 2 else [(0, 1), (0, 2), (1, 2)]
+    size = 10 if len(pairs) == 1 else 8
+    fig, axes = plt.subplots(1, len(pairs), figsize=(size * len(pairs), size), squeeze=False)
+
+    for ax, (i, j) in zip(axes[0], pairs):
+        grid, extent = aggregate_grid(coordinates[:, i], coordinates[:, j], values, statistic, bins)
+        if statistic == 'majority':
+            ax.imshow(label_image(grid), origin='lower', extent=extent, aspect='auto', interpolation='nearest')
+        else:
+            image = np.ma.masked_invalid(np.where(grid > 0, grid, np.nan)) if statistic == 'count' else np.ma.masked_invalid(grid)
+            mappable = ax.imshow(image, origin='lower', extent=extent, aspect='auto', interpolation='nearest',
+                                 cmap='viridis' if statistic == 'count' else cmap, norm=LogNorm() if statistic == 'count' else None)
+            fig.colorbar(mappable, ax=ax, label=colorbar_label or ('Reviews' if statistic == 'count' else None))
+        if len(pairs) > 1:
+            ax.set_xlabel(f'Component {i + 1}')
+            ax.set_ylabel(f'Component {j + 1}')
+
+    if title is not None:
+        fig.suptitle(title)
+    fig.savefig(output_png, dpi=300, bbox_inches='tight')
+    plt.close(fig)
@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import count, observe
+from common.rate_limit import RateLimiter, backoff_delay, estimate_tokens, parse_duration
+
+OPENAI_EMBEDDINGS_URL = 'https://api.openai.com/v1/embeddings'
+
+MAX_INPUTS_PER_REQUEST = 2048  # API limit on the number of inputs in one request
+MAX_TOKENS_PER_INPUT = 8191  # Model context length for text-embedding-ada-002
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class EmbeddingRequestError(Exception):
+    """
+    Raised when a batch still fails after all retries, or fails with a non-retryable status.
+    """
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class EmbeddingClient:
+    """
+    Batched, concurrent client for the embeddings endpoint.
+
+    Reviews are packed into requests bounded by an input count and an estimated token budget,
+    several requests run at once over a pooled keep-alive session, and a shared RateLimiter
+    adapts to 429 responses and rate-limit headers. Failed requests are retried with jittered
+    exponential backoff; batches that still fail are reported rather than filled with placeholders.
+    """
+
+    def __init__(self, api_key: str, model: str = 'text-embedding-ada-002', url: str = OPENAI_EMBEDDINGS_URL,
+                 concurrency: int = 8, max_inputs_per_request: int = 256, max_tokens_per_request: int = 100_000,
+                 requests_per_minute: float = 3000, tokens_per_minute: float = 1_000_000,
+                 max_retries: int = 6, timeout: float = 60):
+        self.model = model
+        self.url = url
+        self.concurrency = concurrency
+        self.max_inputs_per_request = min(max_inputs_per_request, MAX_INPUTS_PER_REQUEST)
+        self.max_tokens_per_request = max_tokens_per_request
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json',
+        })
+
+        self.request_count = 0
+        self.retry_count = 0
+        self.failed_row_ids = []
+
+    def make_batches(self, row_ids, texts) -> list:
+        """
+        Pack (row_ids, texts) into batches that respect the input-count and token limits.
+        Texts longer than the model context are truncated.
+        """
+
+        max_chars = MAX_TOKENS_PER_INPUT * 3  # Conservative: English text averages about four characters per token
+
+        batches = []
+        batch_ids, batch_texts, batch_tokens = [], [], 0
+        for row_id, text in zip(row_ids, texts):
+            text = text[:max_chars]
+            tokens = estimate_tokens(text)
+            if batch_texts and (len(batch_texts) >= self.max_inputs_per_request or batch_tokens + tokens > self.max_tokens_per_request):
+                batches.append((batch_ids, batch_texts, batch_tokens))
+                batch_ids, batch_texts, batch_tokens = [], [], 0
+            batch_ids.append(row_id)
+            batch_texts.append(text)
+            batch_tokens += tokens
+
+        if batch_texts:
+            batches.append((batch_ids, batch_texts, batch_tokens))
+
+        return batches
+
+    def embed_batch(self, texts: list, tokens: int = None) -> np.ndarray:
+        """
+        Embed one batch of texts, retrying throttled and transient failures with backoff.
+        Returns a float32 matrix with one row per text, in input order.
+        """
+
+        if tokens is None:
+            tokens = sum(estimate_tokens(text) for text in texts)
+
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            self.request_count += 1
+            start = time.perf_counter()
+            try:
+                response = self.session.post(self.url, json={'input': texts, 'model': self.model}, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                count('api_requests', endpoint='embeddings', status='error')
+                error = err
+                delay = backoff_delay(attempt)
+            else:
+                observe('api_request_seconds', time.perf_counter() - start, endpoint='embeddings')
+                count('api_requests', endpoint='embeddings', status=response.status_code)
+                if response.status_code == 200:
+                    self.limiter.on_success(response.headers)
+                    data = sorted(response.json()['data'], key=lambda item: item['index'])
+                    return np.asarray([item['embedding'] for item in data], dtype=np.float32)
+
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise EmbeddingRequestError(f'{response.status_code}: {response.text[:500]}', response.status_code)
+
+                error = f'{response.status_code}: {response.text[:200]}'
+                retry_after = parse_duration(response.headers.get('Retry-After'))
+                if response.status_code == 429:
+                    self.limiter.on_throttled(retry_after)
+                    count('api_throttled', endpoint='embeddings')
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+
+            if attempt < self.max_retries:
+                self.retry_count += 1
+                count('api_retries', endpoint='embeddings')
+                time.sleep(delay)
+
+        raise EmbeddingRequestError(f'Giving up after {self.max_retries + 1} attempts: {error}')
+
+    def embed_or_split(self, row_ids: list, texts: list, tokens: int = None) -> list:
+        """
+        Embed a batch, bisecting it when the API rejects the request so that one bad
+        input only fails itself. Returns a list of (row_ids, matrix) parts.
+        """
+
+        try:
+            return [(row_ids, self.embed_batch(texts, tokens))]
+        except EmbeddingRequestError as err:
+            if err.status_code != 400 or len(texts) == 1:
+                print(f'Failed to embed {len(row_ids)} reviews: {err}')
+                self.failed_row_ids.extend(row_ids)
+                return []
+
+        middle = len(texts) // 2
+        return self.embed_or_split(row_ids[:middle], texts[:middle]) + self.embed_or_split(row_ids[middle:], texts[middle:])
+
+    def embed(self, row_ids, texts):
+        """
+        Embed all texts concurrently, yielding (row_ids, matrix) per batch as batches complete.
+        Row ids that fail permanently are collected in failed_row_ids instead of being yielded.
+        """
+
+        batches = self.make_batches(row_ids, texts)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self.embed_or_split, batch_ids, batch_texts, batch_tokens)
+                       for batch_ids, batch_texts, batch_tokens in batches]
+            for future in as_completed(futures):
+                for part in future.result():
+                    yield part
+
+    def embed_texts(self, texts: list) -> np.ndarray:
+        """
+        Embed a small list of texts synchronously, in order.
+        """
+
+        return self.embed_batch(list(texts))
+
+    def close(self) -> None:
+        self.session.close()
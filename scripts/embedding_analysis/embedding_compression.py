@@ -0,0 +1,270 @@
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import PCA
+from sklearn.metrics import adjusted_rand_score
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import instrumented_run, measure
+from embedding_analysis.embedding_store import EmbeddingStore
+from similarity_search.ivf_index import exact_search, normalize
+
+CODES_FILE = 'codes.npy'
+ROW_IDS_FILE = 'row_ids.npy'
+PARAMS_FILE = 'params.npz'
+META_FILE = 'meta.json'
+
+SCHEME = re.compile(r'^(?:pca(\d+)\+?)?(float32|float16|int8)?$')
+
+
+def parse_scheme(scheme: str) -> tuple:
+    """
+    (PCA dimension or None, quantization) of a scheme name such as 'float16', 'int8', 'pca256' or 'pca256+int8'.
+    """
+
+    match = SCHEME.match(scheme)
+    if not match or not scheme:
+        raise ValueError(f'Unknown scheme {scheme}. Please use float16, int8, pca<dim> or pca<dim>+<float16|int8>.')
+    dim = int(match.group(1)) if match.group(1) else None
+    return dim, match.group(2) or 'float32'
+
+
+class Compressor:
+    """
+    Compress float32 embeddings with optional PCA truncation followed by a quantization:
+    - float16: half precision, 2 bytes per value
+    - int8: per-dimension scalar quantization of the [min, max] range to 256 levels, 1 byte per value
+    Decoding returns float32 vectors in the compressed space (the PCA space for pca schemes), or
+    back in the original space with reconstruct=True.
+    """
+
+    def __init__(self, scheme: str, params: dict = None):
+        self.scheme = scheme
+        self.dim, self.quantization = parse_scheme(scheme)
+        self.params = params or {}
+
+    def fit(self, matrix: np.ndarray, sample_size: int = 50_000, random_state: int = 0) -> 'Compressor':
+        """
+        Fit the PCA and the int8 ranges on a random sample of rows.
+        """
+
+        rng = np.random.default_rng(random_state)
+        positions = np.sort(rng.choice(matrix.shape[0], min(sample_size, matrix.shape[0]), replace=False))
+        sample = np.asarray(matrix[positions], dtype=np.float32)
+
+        if self.dim is not None:
+            pca = PCA(n_components=self.dim, svd_solver='randomized', random_state=random_state).fit(sample)
+            self.params['components'] = pca.components_.astype(np.float32)
+            self.params['mean'] = pca.mean_.astype(np.float32)
+            sample = self.project(sample)
+
+        if self.quantization == 'int8':
+            low, high = sample.min(axis=0), sample.max(axis=0)
+            self.params['offset'] = low.astype(np.float32)
+            self.params['scale'] = (np.maximum(high - low, 1e-12) / 255).astype(np.float32)
+
+        return self
+
+    def project(self, matrix: np.ndarray) -> np.ndarray:
+        if self.dim is None:
+            return np.asarray(matrix, dtype=np.float32)
+        return (np.asarray(matrix, dtype=np.float32) - self.params['mean']) @ self.params['components'].T
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        projected = self.project(matrix)
+        if self.quantization == 'float16':
+            return projected.astype(np.float16)
+        if self.quantization == 'int8':
+            levels = np.rint((projected - self.params['offset']) / self.params['scale'])
+            return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+        return projected.astype(np.float32)
+
+    def decode(self, codes: np.ndarray, reconstruct: bool = False) -> np.ndarray:
+        if self.quantization == 'int8':
+            matrix = (codes.astype(np.float32) + 128) * self.params['scale'] + self.params['offset']
+        else:
+            matrix = codes.astype(np.float32)
+        if reconstruct and self.dim is not None:
+            matrix = matrix @ self.params['components'] + self.params['mean']
+        return matrix
+
+    def encode_chunks(self, matrix: np.ndarray, out: np.ndarray, chunksize: int = 50_000) -> None:
+        for start in range(0, matrix.shape[0], chunksize):
+            out[start:start + chunksize] = self.encode(matrix[start:start + chunksize])
+
+    def decode_chunks(self, codes: np.ndarray, reconstruct: bool = False, chunksize: int = 200_000) -> np.ndarray:
+        out_dim = codes.shape[1] if not reconstruct or self.dim is None else self.params['components'].shape[1]
+        out = np.empty((codes.shape[0], out_dim), dtype=np.float32)
+        for start in range(0, codes.shape[0], chunksize):
+            out[start:start + chunksize] = self.decode(codes[start:start + chunksize], reconstruct)
+        return out
+
+    @property
+    def code_dtype(self):
+        return {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}[self.quantization]
+
+    def bytes_per_vector(self, dim: int) -> int:
+        return (self.dim or dim) * np.dtype(self.code_dtype).itemsize
+
+
+class CompressedStore:
+    """
+    Compressed copy of an embedding store: a directory holding
+    - codes.npy: the encoded matrix (memory-mapped when loaded)
+    - row_ids.npy: int64 review id of each row
+    - params.npz: PCA components and mean, int8 offsets and scales
+    - meta.json: scheme, dimensions and the source store
+    """
+
+    def __init__(self, store_dir: str):
+        if not CompressedStore.exists(store_dir):
+            raise FileNotFoundError(f"The compressed store '{store_dir}' does not exist.")
+
+        with open(os.path.join(store_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        with np.load(os.path.join(store_dir, PARAMS_FILE)) as params:
+            self.compressor = Compressor(self.meta['scheme'], dict(params))
+        self.codes = np.load(os.path.join(store_dir, CODES_FILE), mmap_mode='r')
+        self.row_ids = np.load(os.path.join(store_dir, ROW_IDS_FILE))
+
+    @staticmethod
+    def exists(store_dir: str) -> bool:
+        return os.path.exists(os.path.join(store_dir, META_FILE))
+
+    @classmethod
+    def create(cls, store_dir: str, row_ids: np.ndarray, matrix: np.ndarray, scheme: str, sample_size: int = 50_000,
+               chunksize: int = 50_000, source: str = None) -> 'CompressedStore':
+        compressor = Compressor(scheme).fit(matrix, sample_size)
+        os.makedirs(store_dir, exist_ok=True)
+
+        codes = np.lib.format.open_memmap(os.path.join(store_dir, CODES_FILE), mode='w+', dtype=compressor.code_dtype,
+                                          shape=(matrix.shape[0], compressor.dim or matrix.shape[1]))
+        compressor.encode_chunks(matrix, codes, chunksize)
+        codes.flush()
+        del codes
+
+        np.save(os.path.join(store_dir, ROW_IDS_FILE), np.asarray(row_ids, dtype=np.int64))
+        np.savez(os.path.join(store_dir, PARAMS_FILE), **compressor.params)
+        with open(os.path.join(store_dir, META_FILE), 'w') as f:
+            json.dump({'scheme': scheme, 'dim': int(matrix.shape[1]), 'code_dim': int(compressor.dim or matrix.shape[1]),
+                       'n_rows': int(matrix.shape[0]), 'source': source}, f)
+
+        return cls(store_dir)
+
+    def load(self, reconstruct: bool = False) -> tuple:
+        """
+        (row_ids, float32 matrix) decoded from the codes.
+        """
+
+        return self.row_ids, self.compressor.decode_chunks(self.codes, reconstruct)
+
+
+def compress_store(store_dir: str, output_dir: str, scheme: str, sample_size: int = 50_000) -> CompressedStore:
+    """
+    Compress the filled rows of an embedding store with the given scheme.
+    """
+
+    row_ids, matrix = EmbeddingStore(store_dir).load()
+    return CompressedStore.create(output_dir, row_ids, matrix, scheme, sample_size, source=store_dir)
+
+
+def evaluate_schemes(matrix: np.ndarray, schemes, k: int = 10, n_queries: int = 500, n_clusters: int = 20, sample_size: int = 50_000,
+                     random_state: int = 0) -> pd.DataFrame:
+    """
+    Compare compression schemes on the same embeddings. For each scheme: bytes per vector, compression ratio,
+    encode and decode time, recall@k of the cosine nearest neighbours of sample queries (against exact search
+    on the float32 vectors), and cluster agreement: the share of rows assigned to the same K-means centroid,
+    with the centroids encoded and decoded like the data, and the adjusted Rand index of a K-means refit on
+    the decoded vectors started from those centroids.
+    """
+
+    rng = np.random.default_rng(random_state)
+    matrix = np.asarray(matrix, dtype=np.float32)
+    reference = normalize(matrix)
+    row_ids = np.arange(matrix.shape[0])
+    queries = rng.choice(matrix.shape[0], min(n_queries, matrix.shape[0]), replace=False)
+    truth, _ = exact_search(reference, row_ids, reference[queries], k + 1)
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state, n_init=3, batch_size=4096).fit(reference)
+    labels = kmeans.labels_
+
+    results = []
+    for scheme in schemes:
+        compressor = Compressor(scheme)
+        start = time.perf_counter()
+        compressor.fit(matrix, sample_size, random_state=random_state)
+        codes = np.empty((matrix.shape[0], compressor.dim or matrix.shape[1]), dtype=compressor.code_dtype)
+        compressor.encode_chunks(matrix, codes)
+        encode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = normalize(compressor.decode_chunks(codes))
+        decode_seconds = time.perf_counter() - start
+
+        found, _ = exact_search(decoded, row_ids, decoded[queries], k + 1)
+        recall = np.mean([np.intersect1d(f[f != q], t[t != q][:k]).shape[0] / k for f, t, q in zip(found, truth, queries)])
+
+        centroids = normalize(compressor.decode(compressor.encode(kmeans.cluster_centers_)))
+        assigned = np.argmax(decoded @ centroids.T, axis=1)
+        refit = MiniBatchKMeans(n_clusters=n_clusters, init=centroids, n_init=1, random_state=random_state, batch_size=4096).fit_predict(decoded)
+
+        size = compressor.bytes_per_vector(matrix.shape[1])
+        results.append({
+            'scheme': scheme,
+            'dim': compressor.dim or matrix.shape[1],
+            'bytes_per_vector': size,
+            'compression_ratio': round(matrix.shape[1] * 4 / size, 1),
+            f'recall@{k}': round(float(recall), 4),
+            'cluster_agreement': round(float((assigned == labels).mean()), 4),
+            'refit_ari': round(float(adjusted_rand_score(labels, refit)), 4),
+            'encode_seconds': round(encode_seconds, 3),
+            'decode_seconds': round(decode_seconds, 3),
+        })
+
+    return pd.DataFrame(results)
+
+
+def main(store_dir: str, report_csv: str, schemes, output_dir: str = None, output_scheme: str = None, k: int = 10,
+         n_clusters: int = 20, overwrite: bool = False) -> None:
+    """
+    Main function to report how each compression scheme affects nearest-neighbour recall and cluster
+    agreement on the review embeddings, and optionally write a compressed store with the chosen scheme.
+    """
+
+    if not EmbeddingStore.exists(store_dir):
+        raise FileNotFoundError(f"The embedding store '{store_dir}' does not exist.")
+
+    if os.path.exists(report_csv) and not overwrite:
+        should_proceed = input(f"The output file '{report_csv}' already exists. Do you want to overwrite it? (y/n): ")
+        if should_proceed.lower() != 'y':
+            sys.exit(f"Execution stopped. The output file '{report_csv}' already exists.")
+
+    _, matrix = EmbeddingStore(store_dir).load()
+    with measure('evaluate', rows=matrix.shape[0]):
+        report = evaluate_schemes(matrix, schemes, k=k, n_clusters=n_clusters)
+    print(report.to_string(index=False))
+    report.to_csv(report_csv, index=False)
+
+    if output_dir is not None and output_scheme is not None:
+        with measure('compress', rows=matrix.shape[0]):
+            store = compress_store(store_dir, output_dir, output_scheme)
+        print(f"Wrote {store.meta['n_rows']} vectors as {output_scheme} to {output_dir}")
+
+
+if __name__ == '__main__':
+    store_dir = './output/embedding_analysis/store/review_embeddings'
+    report_csv = './output/embedding_analysis/csv/embedding_compression_report.csv'
+    schemes = ['float32', 'float16', 'int8', 'pca512', 'pca256', 'pca256+int8', 'pca128+int8']
+
+    # Write a compressed copy with the scheme picked from the report:
+    output_dir = None  # './output/embedding_analysis/store/review_embeddings_pca256_int8'
+    output_scheme = None  # 'pca256+int8'
+    overwrite = False
+
+    with instrumented_run('embedding_compression'):
+        main(store_dir, report_csv, schemes, output_dir, output_scheme, overwrite=overwrite)
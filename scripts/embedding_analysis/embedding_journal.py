@@ -0,0 +1,158 @@
+import os
+import zlib
+
+import numpy as np
+
+MAGIC = b'EMBJRNL1'
+HEADER = np.dtype([('magic', 'S8'), ('dim', '<i4')])
+
+
+def record_dtype(dim: int) -> np.dtype:
+    return np.dtype([('row_id', '<i8'), ('embedding', '<f4', (dim,)), ('crc', '<u4')])
+
+
+def checksums(records: np.ndarray) -> np.ndarray:
+    """
+    CRC32 of each record's row id and embedding bytes.
+    """
+
+    raw = records.view(np.uint8).reshape(records.shape[0], records.dtype.itemsize)
+    return np.fromiter((zlib.crc32(row[:-4]) for row in raw), dtype=np.uint32, count=records.shape[0])
+
+
+class EmbeddingJournal:
+    """
+    Append-only journal of (row id, embedding) results for an embedding run.
+
+    Records have a fixed size and carry a CRC32 of their row id and embedding, so a torn or
+    corrupt tail left by a crash is detected and ignored on read. Appends are buffered and
+    written with a single fsync every sync_every records.
+    """
+
+    def __init__(self, path: str, dim: int, sync_every: int = 1000):
+        self.path = path
+        self.dim = dim
+        self.sync_every = sync_every
+        self.dtype = record_dtype(dim)
+        self._buffer = []
+        self._buffered = 0
+        self._file = self._open()
+
+    def _open(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= HEADER.itemsize:
+            header = np.fromfile(self.path, dtype=HEADER, count=1)[0]
+            if header['magic'] != MAGIC or header['dim'] != self.dim:
+                raise ValueError(f"'{self.path}' is not an embedding journal of dimension {self.dim}.")
+            self._truncate_torn_tail()
+        else:
+            with open(self.path, 'wb') as f:
+                f.write(np.array([(MAGIC, self.dim)], dtype=HEADER).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        return open(self.path, 'ab')
+
+    def _truncate_torn_tail(self) -> None:
+        size = os.path.getsize(self.path)
+        complete = HEADER.itemsize + (size - HEADER.itemsize) // self.dtype.itemsize * self.dtype.itemsize
+        if complete != size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(complete)
+
+    def append(self, row_ids, embeddings) -> None:
+        """
+        Buffer results and sync them to disk once enough records have accumulated.
+        """
+
+        row_ids = np.atleast_1d(np.asarray(row_ids, dtype=np.int64))
+        records = np.empty(row_ids.shape[0], dtype=self.dtype)
+        records['row_id'] = row_ids
+        records['embedding'] = np.asarray(embeddings, dtype=np.float32).reshape(row_ids.shape[0], self.dim)
+        records['crc'] = checksums(records)
+
+        self._buffer.append(records.tobytes())
+        self._buffered += row_ids.shape[0]
+        if self._buffered >= self.sync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        if self._buffer:
+            self._file.write(b''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def read(self) -> tuple:
+        """
+        Return (row_ids, matrix) of every valid record, keeping the last record per row id.
+        Reading stops at the first record that fails its checksum.
+        """
+
+        self.sync()
+        records = np.fromfile(self.path, dtype=self.dtype, offset=HEADER.itemsize)
+
+        corrupt = np.flatnonzero(checksums(records) != records['crc'])
+        if corrupt.shape[0]:
+            position = corrupt[0]
+            print(f'Ignoring {records.shape[0] - position} journal records from corrupt position {position}.')
+            records = records[:position]
+
+        # Keep the last occurrence of each row id
+        reversed_ids = records['row_id'][::-1]
+        _, first_in_reversed = np.unique(reversed_ids, return_index=True)
+        latest = records.shape[0] - 1 - first_in_reversed
+
+        return records['row_id'][latest], records['embedding'][latest]
+
+    def row_ids(self) -> np.ndarray:
+        return self.read()[0]
+
+    def discard(self, row_ids) -> int:
+        """
+        Drop the records of row_ids, e.g. reviews whose text changed after an interrupted run journaled
+        them, so they are embedded again instead of merged from the stale record. Returns the number dropped.
+        """
+
+        kept_ids, matrix = self.read()
+        drop = np.isin(kept_ids, np.asarray(row_ids, dtype=np.int64))
+        if not drop.any():
+            return 0
+
+        records = np.empty(int((~drop).sum()), dtype=self.dtype)
+        records['row_id'] = kept_ids[~drop]
+        records['embedding'] = matrix[~drop]
+        records['crc'] = checksums(records)
+
+        self._file.close()
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(np.array([(MAGIC, self.dim)], dtype=HEADER).tobytes())
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, 'ab')
+
+        return int(drop.sum())
+
+    def compact_into(self, store) -> int:
+        """
+        Merge the journal into an EmbeddingStore in one pass, persist the store,
+        and reset the journal. Returns the number of rows merged.
+        """
+
+        row_ids, matrix = self.read()
+        if row_ids.shape[0]:
+            store.write(row_ids, matrix)
+        store.flush()
+
+        self._file.close()
+        os.remove(self.path)
+        self._file = self._open()
+
+        return row_ids.shape[0]
+
+    def close(self) -> None:
+        self.sync()
+        self._file.close()
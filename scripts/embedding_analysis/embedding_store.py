@@ -0,0 +1,233 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.reviews import REVIEW_ID_COLUMN, review_ids
+
+MATRIX_FILE = 'embeddings.npy'
+ROW_IDS_FILE = 'row_ids.npy'
+FILLED_FILE = 'filled.npy'
+META_FILE = 'meta.json'
+
+
+class EmbeddingStore:
+    """
+    Contiguous float32 embedding matrix stored as memory-mapped .npy files.
+
+    A store is a directory holding:
+    - embeddings.npy: float32 matrix of shape (n_rows, dim)
+    - row_ids.npy: int64 row id of each matrix row, linking it back to the review table
+    - filled.npy: bool flag per row, True once an embedding has been written
+    - meta.json: dimension, row count and the model that produced the embeddings
+    """
+
+    def __init__(self, store_dir: str, mode: str = 'r'):
+        if not EmbeddingStore.exists(store_dir):
+            raise FileNotFoundError(f"The embedding store '{store_dir}' does not exist.")
+
+        self.store_dir = store_dir
+        self.mode = mode
+
+        with open(os.path.join(store_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+
+        self.matrix = np.load(os.path.join(store_dir, MATRIX_FILE), mmap_mode=mode)
+        self.filled = np.load(os.path.join(store_dir, FILLED_FILE), mmap_mode=mode)
+        self.row_ids = np.load(os.path.join(store_dir, ROW_IDS_FILE))
+
+        self._order = np.argsort(self.row_ids, kind='stable')
+        self._sorted_ids = self.row_ids[self._order]
+
+    @classmethod
+    def create(cls, store_dir: str, row_ids: np.ndarray, dim: int, model: str = None, overwrite: bool = False) -> 'EmbeddingStore':
+        """
+        Allocate an empty store for the given row ids and open it for writing.
+        """
+
+        if EmbeddingStore.exists(store_dir) and not overwrite:
+            raise FileExistsError(f"The embedding store '{store_dir}' already exists.")
+
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        if np.unique(row_ids).shape[0] != row_ids.shape[0]:
+            raise ValueError('Row ids must be unique.')
+
+        os.makedirs(store_dir, exist_ok=True)
+
+        matrix = np.lib.format.open_memmap(os.path.join(store_dir, MATRIX_FILE), mode='w+', dtype=np.float32, shape=(row_ids.shape[0], dim))
+        filled = np.lib.format.open_memmap(os.path.join(store_dir, FILLED_FILE), mode='w+', dtype=np.bool_, shape=(row_ids.shape[0],))
+        matrix.flush()
+        filled.flush()
+        del matrix, filled
+
+        np.save(os.path.join(store_dir, ROW_IDS_FILE), row_ids)
+
+        with open(os.path.join(store_dir, META_FILE), 'w') as f:
+            json.dump({'dim': int(dim), 'n_rows': int(row_ids.shape[0]), 'model': model}, f)
+
+        return cls(store_dir, mode='r+')
+
+    @staticmethod
+    def exists(store_dir: str) -> bool:
+        return os.path.exists(os.path.join(store_dir, META_FILE))
+
+    @property
+    def dim(self) -> int:
+        return self.meta['dim']
+
+    def __len__(self) -> int:
+        return self.row_ids.shape[0]
+
+    def offsets(self, row_ids) -> np.ndarray:
+        """
+        Map row ids to their offsets in the matrix.
+        """
+
+        row_ids = np.atleast_1d(np.asarray(row_ids, dtype=np.int64))
+        positions = np.searchsorted(self._sorted_ids, row_ids)
+        positions = np.clip(positions, 0, len(self._sorted_ids) - 1)
+        missing = self._sorted_ids[positions] != row_ids
+        if missing.any():
+            raise KeyError(f'Row ids not in store: {row_ids[missing][:10].tolist()}')
+
+        return self._order[positions]
+
+    def write(self, row_ids, embeddings) -> None:
+        """
+        Write one or more embeddings in place. Call flush() to persist them.
+        """
+
+        offsets = self.offsets(row_ids)
+        self.matrix[offsets] = np.asarray(embeddings, dtype=np.float32).reshape(offsets.shape[0], self.dim)
+        self.filled[offsets] = True
+
+    def flush(self) -> None:
+        self.matrix.flush()
+        self.filled.flush()
+
+    def add_rows(self, row_ids, chunksize: int = 100_000) -> None:
+        """
+        Grow the store with empty rows for new row ids. The matrix is copied into new files
+        chunk by chunk, which then replace the old ones.
+        """
+
+        row_ids = np.setdiff1d(np.asarray(row_ids, dtype=np.int64), self.row_ids)
+        if row_ids.shape[0] == 0:
+            return
+
+        n_old = len(self)
+        n_rows = n_old + row_ids.shape[0]
+        matrix_path = os.path.join(self.store_dir, MATRIX_FILE)
+        filled_path = os.path.join(self.store_dir, FILLED_FILE)
+
+        matrix = np.lib.format.open_memmap(matrix_path + '.tmp', mode='w+', dtype=np.float32, shape=(n_rows, self.dim))
+        filled = np.lib.format.open_memmap(filled_path + '.tmp', mode='w+', dtype=np.bool_, shape=(n_rows,))
+        for start in range(0, n_old, chunksize):
+            end = min(start + chunksize, n_old)
+            matrix[start:end] = self.matrix[start:end]
+        filled[:n_old] = self.filled
+        matrix.flush()
+        filled.flush()
+        del matrix, filled, self.matrix, self.filled
+
+        os.replace(matrix_path + '.tmp', matrix_path)
+        os.replace(filled_path + '.tmp', filled_path)
+        np.save(os.path.join(self.store_dir, ROW_IDS_FILE), np.concatenate([self.row_ids, row_ids]))
+        self.meta['n_rows'] = n_rows
+        with open(os.path.join(self.store_dir, META_FILE), 'w') as f:
+            json.dump(self.meta, f)
+
+        self.__init__(self.store_dir, self.mode)
+
+    def reset(self, row_ids) -> None:
+        """
+        Mark rows as pending again, for example because their text changed.
+        """
+
+        self.filled[self.offsets(row_ids)] = False
+
+    def pending_row_ids(self) -> np.ndarray:
+        """
+        Row ids that do not have an embedding yet.
+        """
+
+        return self.row_ids[~np.asarray(self.filled)]
+
+    def load(self, row_ids=None) -> tuple:
+        """
+        Return (row_ids, matrix) for the requested rows, or for every filled row.
+
+        When all rows are filled and no subset is requested, the matrix is the
+        memory-mapped array itself and nothing is copied.
+        """
+
+        if row_ids is not None:
+            offsets = self.offsets(row_ids)
+            return self.row_ids[offsets], self.matrix[offsets]
+
+        filled = np.asarray(self.filled)
+        if filled.all():
+            return self.row_ids, self.matrix
+
+        return self.row_ids[filled], self.matrix[filled]
+
+
+def load_embeddings(store_dir: str, row_ids=None) -> tuple:
+    """
+    Load (row_ids, matrix) from an embedding store in read-only, memory-mapped mode.
+    """
+
+    return EmbeddingStore(store_dir).load(row_ids)
+
+
+def attach_embeddings(df: pd.DataFrame, store_dir: str) -> tuple:
+    """
+    Align a review table with an embedding store using the table's review ids as row ids.
+    Rows without an embedding are dropped. Returns (aligned DataFrame, matrix).
+    """
+
+    store = EmbeddingStore(store_dir)
+    ids = review_ids(df)
+    has_embedding = np.isin(ids, store.row_ids[np.asarray(store.filled)])
+    df = df[has_embedding]
+    _, matrix = store.load(ids[has_embedding])
+
+    return df, matrix
+
+
+def csv_column_to_store(input_csv: str, column: str, store_dir: str, model: str = None, overwrite: bool = False) -> EmbeddingStore:
+    """
+    Convert a CSV column of stringified embedding lists into an embedding store.
+    Row ids are the review ids (the CSV row positions when the file has no Review_Id column).
+    """
+
+    if not os.path.exists(input_csv):
+        raise FileNotFoundError(f"The input file '{input_csv}' does not exist.")
+
+    df = pd.read_csv(input_csv, usecols=lambda name: name in (column, REVIEW_ID_COLUMN))
+    df = df[df[column].notna()]
+    values = df[column]
+    if values.empty:
+        raise ValueError(f"The column '{column}' has no embeddings.")
+
+    dim = np.fromstring(values.iloc[0].strip('[]'), sep=',', dtype=np.float32).shape[0]
+    store = EmbeddingStore.create(store_dir, review_ids(df), dim, model=model, overwrite=overwrite)
+
+    for offset, text in enumerate(tqdm(values.to_numpy(), desc='Converting embeddings')):
+        store.matrix[offset] = np.fromstring(text.strip('[]'), sep=',', dtype=np.float32)
+    store.filled[:] = True
+    store.flush()
+
+    return store
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print("Usage: python embedding_store.py input.csv embedding_column store_dir")
+        sys.exit(1)
+
+    csv_column_to_store(sys.argv[1], sys.argv[2], sys.argv[3])
@@ -1,77 +1,155 @@
 import os
 import sys
-import time
 
+import numpy as np
 import pandas as pd
-import requests
 from tqdm import tqdm
 from dotenv import load_dotenv
 
-def get_embedding(text: str, api_key: str, model: str = 'text-embedding-ada-002') -> list:
-    """
-    Sends a request to the OpenAI API to get an embedding for the given text.
-    Raises an exception if the API responds with an error.
-    """
-    url = 'https://api.openai.com/v1/embeddings'
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Content-Type': 'application/json',
-    }
-    data = {
-        'input': text,
-        'model': model,
-    }
-    response = requests.post(url, headers=headers, json=data)
-    response.raise_for_status()
-    return response.json()['data'][0]['embedding']
-
-
-def main(input_csv: str, output_csv: str, api_key: str, overwrite: bool = False) -> None:
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.api_cache import ApiCache, cache_key
+from common.instrumentation import count, instrumented_run, measure
+from common.manifest import Manifest, stage_name
+from common.reviews import FINGERPRINT_COLUMN, REVIEW_ID_COLUMN, fingerprints, review_ids
+from common.table_io import read_table
+from embedding_analysis.embedding_client import EmbeddingClient, OPENAI_EMBEDDINGS_URL
+from embedding_analysis.embedding_journal import EmbeddingJournal
+from embedding_analysis.embedding_store import EmbeddingStore
+
+STAGE = 'embedding'
+EMBEDDING_DIM = 1536
+JOURNAL_FILE = 'journal.bin'
+EMBEDDING_TEMPLATE = ''  # Embedding requests send the review text as is
+
+
+def get_embedding(text: str, api_key: str, model: str = 'text-embedding-ada-002', cache: ApiCache = None) -> list:
     """
-    Main function to load the raw reviews, get embeddings for each review,
-    and save the embeddings to a new CSV file.
+    Sends a request to the OpenAI API to get an embedding for the given text, unless it is cached.
+    Raises an exception if the API still responds with an error after retries.
     """
+    key = cache_key(model, EMBEDDING_TEMPLATE, text)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return np.frombuffer(cached, dtype=np.float32).tolist()
 
-    if not os.path.exists(input_csv):
-        raise FileNotFoundError(f"The input file '{input_csv}' does not exist.")
-
-    df_out = pd.read_csv(input_csv)
+    client = EmbeddingClient(api_key, model=model, concurrency=1)
+    try:
+        embedding = client.embed_texts([text])[0]
+    finally:
+        client.close()
 
-    # Set up rate limiting
-    RATE_LIMIT = 500  # Number of requests per minute
-    start_time = time.time()
-    request_count = 0
+    if cache is not None:
+        cache.put(key, embedding.tobytes())
+    return embedding.tolist()
 
-    start_idx = df_out[df_out['Anonymous_Embedding'].notna()].shape[0]
-    total_reviews = df_out.shape[0]  # total number of rows
 
-    for idx, review in enumerate(tqdm(df_out['Anonymized_Review_Text'][start_idx:], desc='Processing reviews'), start=start_idx):
-        # Check rate limiting
-        if request_count >= RATE_LIMIT:
-            time_elapsed = time.time() - start_time
-            if time_elapsed < 60:
-                time.sleep(60 - time_elapsed)
-            start_time = time.time()
-            request_count = 0
+def embed_reviews(texts: pd.Series, client: EmbeddingClient, journal: EmbeddingJournal, cache: ApiCache = None):
+    """
+    Journal an embedding for every review in texts (indexed by row id).
 
-        # Get the embedding for the review
-        try:
-            embedding = get_embedding(review, api_key)
-            df_out.loc[idx, 'Anonymous_Embedding'] = embedding
-        except requests.HTTPError as err:
-            print(f"Failed to get embedding for review: {review}")
-            print(f"Error: {err}")
-            df_out.loc[idx, 'Anonymous_Embedding'] = [0] * 1536  # Use a zero vector as a placeholder
+    Identical texts are requested once and fanned out to all their rows. Texts found in the
+    cache are journaled without a network call; new results are added to the cache.
+    """
 
-        request_count += 1
+    keys = np.array([cache_key(client.model, EMBEDDING_TEMPLATE, text) for text in texts], dtype=object)
+    unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    rows_by_unique = pd.Series(texts.index).groupby(inverse).indices
+    print(f'{unique_keys.shape[0]} distinct texts across {texts.shape[0]} rows')
+
+    cached = cache.get_many(unique_keys.tolist()) if cache is not None else {}
+    hit = np.array([key in cached for key in unique_keys], dtype=bool)
+    count('cache_hits', int(hit.sum()))
+    if hit.any():
+        hit_rows = hit[inverse]
+        journal.append(texts.index[hit_rows], np.stack([np.frombuffer(cached[key], dtype=np.float32) for key in keys[hit_rows]]))
+        print(f'{int(hit_rows.sum())} rows served from the cache')
+
+    missing = np.flatnonzero(~hit)
+    progress = tqdm(total=missing.shape[0], desc='Processing reviews')
+    for unique_ids, matrix in client.embed(missing, texts.iloc[first[missing]].to_list()):
+        positions = [rows_by_unique[unique_id] for unique_id in unique_ids]
+        journal.append(texts.index[np.concatenate(positions)], np.repeat(matrix, [len(p) for p in positions], axis=0))
+        if cache is not None:
+            cache.put_many({unique_keys[unique_id]: vector.tobytes() for unique_id, vector in zip(unique_ids, matrix)})
+        progress.update(len(unique_ids))
+    progress.close()
+
+
+def main(input_csv: str, store_dir: str, api_key: str, overwrite: bool = False, model: str = 'text-embedding-ada-002',
+         concurrency: int = 8, url: str = OPENAI_EMBEDDINGS_URL, cache_path: str = None, manifest_path: str = None) -> None:
+    """
+    Main function to load the anonymized reviews, get embeddings for each pending review
+    from the cache or in concurrent batches, journal the results, and merge them into a
+    memory-mapped embedding store keyed by review id. Reviews whose requests fail permanently
+    stay pending and are picked up by the next run. Reviews added to the input since the store
+    was created are added to it; with a manifest, reviews whose content changed are embedded again.
+    """
 
-        # Save progress every 500 reviews or after the last review
-        if (idx % 500 == 0) or (idx == total_reviews - 1):
-            df_out.to_csv(output_csv, index=False)
-            print(f'saving csv at idx: {idx}...')
+    if not os.path.exists(input_csv):
+        raise FileNotFoundError(f"The input file '{input_csv}' does not exist.")
 
-    # Save the embeddings to a new CSV file
-    df_out.to_csv(output_csv, index=False)
+    df = read_table(input_csv, [REVIEW_ID_COLUMN, FINGERPRINT_COLUMN, 'Anonymized_Review_Text'])
+    df.index = review_ids(df)
+
+    if EmbeddingStore.exists(store_dir) and not overwrite:
+        store = EmbeddingStore(store_dir, mode='r+')
+    else:
+        store = EmbeddingStore.create(store_dir, df.index.to_numpy(), EMBEDDING_DIM, model=model, overwrite=overwrite)
+    store.add_rows(df.index.to_numpy())
+
+    manifest = Manifest(manifest_path) if manifest_path is not None and fingerprints(df) is not None else None
+    if manifest is not None:
+        stage = stage_name(STAGE, store_dir)
+        new, changed, removed = manifest.delta(stage, df.index.to_numpy(), fingerprints(df))
+        store.reset(df.index[changed])
+        print(f'Delta: {int(new.sum())} new, {int(changed.sum())} changed, {removed.shape[0]} removed reviews')
+
+    # Results are appended to the journal during the run and merged into the store once at the end.
+    # Rows already in the journal from an interrupted run count as done, unless their content changed since.
+    journal_path = os.path.join(store_dir, JOURNAL_FILE)
+    if overwrite and os.path.exists(journal_path):
+        os.remove(journal_path)
+    journal = EmbeddingJournal(journal_path, store.dim)
+    if manifest is not None:
+        stale = journal.discard(df.index[changed])
+        if stale:
+            print(f'Discarded {stale} journaled embeddings of reviews whose content changed')
+
+    pending_ids = np.setdiff1d(store.pending_row_ids(), journal.row_ids())
+    pending_ids = pending_ids[np.isin(pending_ids, df.index.to_numpy())]
+    texts = df.loc[pending_ids, 'Anonymized_Review_Text']
+    blank = texts.isna() | (texts.astype(str).str.strip() == '')
+    texts = texts[~blank]
+    print(f'Number of unprocessed rows: {texts.shape[0]} ({int(blank.sum())} blank rows skipped)')
+
+    client = EmbeddingClient(api_key, model=model, url=url, concurrency=concurrency)
+    cache = ApiCache(cache_path) if cache_path else None
+
+    try:
+        with measure('embed', rows=texts.shape[0]):
+            embed_reviews(texts, client, journal, cache)
+    finally:
+        client.close()
+        journal.sync()
+        if cache is not None:
+            print(f'cache: {cache.stats()}')
+            cache.close()
+
+    with measure('merge'):
+        merged = journal.compact_into(store)
+    journal.close()
+    print(f'merged {merged} journaled embeddings into the store')
+
+    if manifest is not None:
+        done = (new | changed) & np.isin(df.index.to_numpy(), store.row_ids[np.asarray(store.filled)])
+        manifest.mark(stage, df.index[done], fingerprints(df)[done])
+        manifest.forget(stage, removed)
+        manifest.close()
+
+    print(f'requests: {client.request_count}, retries: {client.retry_count}, throttled: {client.limiter.throttled}')
+    if client.failed_row_ids:
+        print(f'{len(client.failed_row_ids)} reviews failed and remain pending for the next run.')
 
 
 if __name__ == '__main__':
@@ -79,11 +157,13 @@ if __name__ == '__main__':
     api_key = os.getenv('OPENAI_API_KEY')
 
     input_csv = '/Users/ianspence/Desktop/review-analysis/data/anonymized_reviews_qc6_23743_embeddings.csv'
-    output_csv = '/Users/ianspence/Desktop/review-analysis/data/anonymized_reviews_qc6_23743_embeddings.csv'
+    store_dir = '/Users/ianspence/Desktop/review-analysis/data/anonymized_reviews_qc6_23743_embeddings'
+    cache_path = '/Users/ianspence/Desktop/review-analysis/data/api_cache.sqlite'
 
     overwrite = False
 
     print(f'input csv: {input_csv}')
-    print(f'output csv: {output_csv}')
+    print(f'embedding store: {store_dir}')
 
-    main(input_csv, output_csv, api_key, overwrite)
\ No newline at end of file
+    with instrumented_run('generate_embeddings'):
+        main(input_csv, store_dir, api_key, overwrite, cache_path=cache_path)
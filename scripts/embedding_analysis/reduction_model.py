@@ -0,0 +1,175 @@
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+from sklearn.decomposition import PCA
+from tqdm import tqdm
+
+REDUCER_FILE = 'reducer.joblib'
+COORDINATES_FILE = 'coordinates.npy'
+ROW_IDS_FILE = 'row_ids.npy'
+META_FILE = 'meta.json'
+NUMBA_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'review-analysis', 'numba')
+
+
+def import_umap():
+    """
+    Import umap with numba's on-disk cache in a user directory. umap and pynndescent mark their JIT
+    functions cache=True, but numba writes that cache next to the installed package, which is often
+    read-only; then every run compiles them again. An existing NUMBA_CACHE_DIR takes precedence.
+    It only applies if numba has not been imported yet.
+    """
+
+    os.environ.setdefault('NUMBA_CACHE_DIR', NUMBA_CACHE_DIR)
+    os.makedirs(os.environ['NUMBA_CACHE_DIR'], exist_ok=True)
+    import umap
+    return umap
+
+
+def stratified_sample(n: int, size: int, strata=None, random_state: int = 0) -> np.ndarray:
+    """
+    Sorted positions of a sample of `size` rows. With strata, each stratum is sampled
+    in proportion to its size and keeps at least one row.
+    """
+
+    rng = np.random.default_rng(random_state)
+    if size >= n:
+        return np.arange(n)
+    if strata is None:
+        return np.sort(rng.choice(n, size=size, replace=False))
+
+    _, labels = np.unique(np.asarray(strata).astype(str), return_inverse=True)
+    counts = np.bincount(labels)
+    quotas = np.maximum(1, np.round(counts * size / n).astype(int))
+    sample = [rng.choice(np.flatnonzero(labels == label), size=min(quota, count), replace=False)
+              for label, (quota, count) in enumerate(zip(quotas, counts))]
+    return np.sort(np.concatenate(sample))
+
+
+class ReductionModel:
+    """
+    Float32 PCA + UMAP reducer fitted on a (stratified) sample of the embeddings.
+
+    The remaining rows are projected with transform() in chunks instead of being part of the fit.
+    A saved model directory holds the fitted reducers (reducer.joblib), the coordinates of every review
+    reduced so far (coordinates.npy, row_ids.npy) and the settings (meta.json), so re-plots reuse the
+    coordinates and new reviews are only transformed.
+    """
+
+    def __init__(self, n_components: int = 2, n_neighbors: int = 15, pca_components: int = 50, sample_size: int = 50_000,
+                 random_state: int = None, chunksize: int = 20_000):
+        self.n_components = n_components
+        self.n_neighbors = n_neighbors
+        self.pca_components = pca_components
+        self.sample_size = sample_size
+        self.random_state = random_state
+        self.chunksize = chunksize
+
+        self.pca = None
+        self.umap = None
+        self.row_ids = np.empty(0, dtype=np.int64)
+        self.coordinates = np.empty((0, n_components), dtype=np.float32)
+        self.meta = {}
+
+    @property
+    def settings(self) -> dict:
+        return {'n_components': self.n_components, 'n_neighbors': self.n_neighbors, 'pca_components': self.pca_components,
+                'sample_size': self.sample_size, 'random_state': self.random_state}
+
+    def _pre_reduce(self, matrix: np.ndarray) -> np.ndarray:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        return matrix if self.pca is None else self.pca.transform(matrix).astype(np.float32)
+
+    def fit(self, row_ids: np.ndarray, matrix: np.ndarray, strata=None) -> 'ReductionModel':
+        """
+        Fit PCA and UMAP on a sample, then transform the remaining rows in chunks.
+        """
+
+        umap = import_umap()
+
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        sample = stratified_sample(matrix.shape[0], self.sample_size, strata, self.random_state or 0)
+        fit_rows = np.asarray(matrix[sample], dtype=np.float32)
+
+        start = time.perf_counter()
+        if self.pca_components is not None and self.pca_components < matrix.shape[1]:
+            self.pca = PCA(n_components=self.pca_components, svd_solver='randomized', random_state=self.random_state or 0)
+            self.pca.fit(fit_rows)
+
+        self.umap = umap.UMAP(n_neighbors=self.n_neighbors, n_components=self.n_components, random_state=self.random_state)
+        sample_coordinates = self.umap.fit_transform(self._pre_reduce(fit_rows)).astype(np.float32)
+        fit_seconds = time.perf_counter() - start
+
+        rest = np.setdiff1d(np.arange(matrix.shape[0]), sample, assume_unique=True)
+        coordinates = np.empty((matrix.shape[0], self.n_components), dtype=np.float32)
+        coordinates[sample] = sample_coordinates
+        coordinates[rest] = self.transform(matrix, rest)
+
+        self.row_ids = row_ids
+        self.coordinates = coordinates
+        self.meta = {**self.settings, 'n_fit': int(sample.shape[0]), 'n_rows': int(matrix.shape[0]), 'dim': int(matrix.shape[1]),
+                     'fit_seconds': round(fit_seconds, 2), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'explained_variance': None if self.pca is None else round(float(self.pca.explained_variance_ratio_.sum()), 4)}
+        return self
+
+    def transform(self, matrix: np.ndarray, positions: np.ndarray = None) -> np.ndarray:
+        """
+        Project rows (all of them, or the given positions) with the fitted reducers, chunk by chunk.
+        """
+
+        if self.umap is None:
+            raise ValueError('The reduction model has not been fitted.')
+
+        positions = np.arange(matrix.shape[0]) if positions is None else np.asarray(positions)
+        coordinates = np.empty((positions.shape[0], self.n_components), dtype=np.float32)
+        for start in tqdm(range(0, positions.shape[0], self.chunksize), desc='Transforming embeddings'):
+            chunk = positions[start:start + self.chunksize]
+            coordinates[start:start + chunk.shape[0]] = self.umap.transform(self._pre_reduce(matrix[chunk]))
+
+        return coordinates
+
+    def reduce(self, row_ids: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        """
+        Coordinates for the given rows: cached ones are reused, new rows are transformed and added to the cache.
+        """
+
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        known = np.isin(row_ids, self.row_ids)
+        if not known.all():
+            new_coordinates = self.transform(matrix, np.flatnonzero(~known))
+            self.row_ids = np.concatenate([self.row_ids, row_ids[~known]])
+            self.coordinates = np.concatenate([self.coordinates, new_coordinates])
+            print(f'Transformed {int((~known).sum())} new reviews with the saved reducer')
+
+        order = np.argsort(self.row_ids, kind='stable')
+        return self.coordinates[order[np.searchsorted(self.row_ids, row_ids, sorter=order)]]
+
+    def save(self, model_dir: str) -> None:
+        os.makedirs(model_dir, exist_ok=True)
+        joblib.dump({'pca': self.pca, 'umap': self.umap}, os.path.join(model_dir, REDUCER_FILE))
+        np.save(os.path.join(model_dir, COORDINATES_FILE), self.coordinates)
+        np.save(os.path.join(model_dir, ROW_IDS_FILE), self.row_ids)
+        with open(os.path.join(model_dir, META_FILE), 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+    @staticmethod
+    def exists(model_dir: str) -> bool:
+        return os.path.exists(os.path.join(model_dir, META_FILE))
+
+    @classmethod
+    def load(cls, model_dir: str) -> 'ReductionModel':
+        if not ReductionModel.exists(model_dir):
+            raise FileNotFoundError(f"The reduction model '{model_dir}' does not exist.")
+
+        with open(os.path.join(model_dir, META_FILE)) as f:
+            meta = json.load(f)
+
+        model = cls(**{key: meta[key] for key in ('n_components', 'n_neighbors', 'pca_components', 'sample_size', 'random_state')})
+        reducers = joblib.load(os.path.join(model_dir, REDUCER_FILE))
+        model.pca, model.umap = reducers['pca'], reducers['umap']
+        model.coordinates = np.load(os.path.join(model_dir, COORDINATES_FILE))
+        model.row_ids = np.load(os.path.join(model_dir, ROW_IDS_FILE))
+        model.meta = meta
+        return model
@@ -0,0 +1,257 @@
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import PCA
+from sklearn.neighbors import NearestNeighbors
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import instrumented_run, measure
+from common.reviews import REVIEW_ID_COLUMN
+from common.table_io import read_table
+from embedding_analysis.density_plot import plot_density
+from embedding_analysis.embedding_store import attach_embeddings
+from embedding_analysis.reduction_model import import_umap
+
+
+def array_fingerprint(matrix: np.ndarray) -> str:
+    digest = hashlib.sha1(str(matrix.shape).encode('utf-8'))
+    digest.update(np.ascontiguousarray(matrix).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def config_name(n_neighbors: int, min_cluster_size: int = None, min_samples: int = None) -> str:
+    """
+    Name of a grid point, in the same form as our output filenames.
+    """
+
+    name = f'nneighbors{n_neighbors}'
+    if min_cluster_size is not None:
+        name += f'_hdbscan_minclustersize{min_cluster_size}_minsamples{min_samples}'
+    return name
+
+
+def knn_graph(matrix: np.ndarray, k: int, metric: str = 'euclidean') -> tuple:
+    """
+    (indices, distances) of the k nearest neighbours of every row, the row itself first, as UMAP expects.
+    """
+
+    distances, indices = NearestNeighbors(n_neighbors=k, metric=metric).fit(matrix).kneighbors(matrix)
+    return indices.astype(np.int64), distances.astype(np.float32)
+
+
+def make_clusterer(min_cluster_size: int, min_samples: int, memory: str = None):
+    """
+    HDBSCAN from the hdbscan package, with its core-distance tree cached in memory (a directory)
+    so runs with the same min_samples only redo the cluster extraction. Falls back to scikit-learn's HDBSCAN.
+    """
+
+    try:
+        import hdbscan
+        return hdbscan.HDBSCAN(min_cluster_size=min_cluster_size, min_samples=min_samples, memory=memory or None, core_dist_n_jobs=1)
+    except ImportError:
+        from sklearn.cluster import HDBSCAN
+        return HDBSCAN(min_cluster_size=min_cluster_size, min_samples=min_samples)
+
+
+def _reduce_task(args: tuple) -> dict:
+    """
+    Fit UMAP for one n_neighbors from the shared kNN graph, sliced to the first n_neighbors columns.
+    """
+
+    umap = import_umap()
+
+    cache_dir, n_neighbors, n_components, metric, random_state = args
+    reduced_path = os.path.join(cache_dir, f'{config_name(n_neighbors)}_{n_components}d_reduced.npy')
+    if os.path.exists(reduced_path):
+        return {'n_neighbors': n_neighbors, 'umap_seconds': 0.0, 'umap_cached': True}
+
+    matrix = np.load(os.path.join(cache_dir, 'matrix.npy'), mmap_mode='r')
+    indices = np.load(os.path.join(cache_dir, 'knn_indices.npy'), mmap_mode='r')
+    distances = np.load(os.path.join(cache_dir, 'knn_distances.npy'), mmap_mode='r')
+    precomputed_knn = (np.ascontiguousarray(indices[:, :n_neighbors]), np.ascontiguousarray(distances[:, :n_neighbors]), None)
+
+    start = time.perf_counter()
+    reducer = umap.UMAP(n_neighbors=n_neighbors, n_components=n_components, metric=metric, precomputed_knn=precomputed_knn,
+                        random_state=random_state)
+    reduced = reducer.fit_transform(np.asarray(matrix)).astype(np.float32)
+    seconds = time.perf_counter() - start
+
+    np.save(reduced_path, reduced)
+    return {'n_neighbors': n_neighbors, 'umap_seconds': round(seconds, 3), 'umap_cached': False}
+
+
+def _cluster_task(args: tuple) -> list:
+    """
+    Run HDBSCAN for every min_cluster_size of one (n_neighbors, min_samples) pair on the saved reduced embeddings.
+    """
+
+    cache_dir, n_neighbors, n_components, min_samples, min_cluster_sizes = args
+    reduced = np.load(os.path.join(cache_dir, f'{config_name(n_neighbors)}_{n_components}d_reduced.npy'))
+    memory = os.path.join(cache_dir, 'hdbscan_memory', f'{config_name(n_neighbors)}_{n_components}d')
+
+    results = []
+    for min_cluster_size in min_cluster_sizes:
+        start = time.perf_counter()
+        labels = make_clusterer(min_cluster_size, min_samples, memory).fit_predict(reduced)
+        seconds = time.perf_counter() - start
+
+        labels_path = os.path.join(cache_dir, f'{config_name(n_neighbors, min_cluster_size, min_samples)}_{n_components}d_labels.npy')
+        np.save(labels_path, labels.astype(np.int32))
+        results.append({
+            'n_neighbors': n_neighbors,
+            'min_cluster_size': min_cluster_size,
+            'min_samples': min_samples,
+            'n_clusters': int(np.unique(labels[labels >= 0]).shape[0]),
+            'noise_fraction': round(float((labels < 0).mean()), 4),
+            'hdbscan_seconds': round(seconds, 3),
+        })
+    return results
+
+
+def _plot_task(args: tuple) -> str:
+    """
+    Plot one configuration's saved reduced embeddings coloured by its HDBSCAN labels, as a density image.
+    """
+
+    cache_dir, plot_dir, n_neighbors, n_components, min_cluster_size, min_samples = args
+    name = config_name(n_neighbors, min_cluster_size, min_samples)
+    reduced = np.load(os.path.join(cache_dir, f'{config_name(n_neighbors)}_{n_components}d_reduced.npy'))
+    labels = np.load(os.path.join(cache_dir, f'{name}_{n_components}d_labels.npy'))
+
+    output_png = os.path.join(plot_dir, f'embeddings_{n_components}d_umap_{name}.png')
+    plot_density(reduced, labels, output_png, 'majority', title=name)
+    return output_png
+
+
+def prepare_cache(matrix: np.ndarray, cache_dir: str, max_neighbors: int, pca_components: int = 50, metric: str = 'euclidean') -> str:
+    """
+    Pre-reduce with PCA, compute the kNN graph once at the largest n_neighbors and save both for the workers.
+    Returns the run directory, keyed by the embeddings and settings so reruns reuse earlier results.
+    """
+
+    matrix = np.asarray(matrix, dtype=np.float32)
+    key = hashlib.sha1(f'{array_fingerprint(matrix)}-{pca_components}-{metric}'.encode('utf-8')).hexdigest()[:16]
+    run_dir = os.path.join(cache_dir, key)
+    os.makedirs(run_dir, exist_ok=True)
+
+    matrix_path = os.path.join(run_dir, 'matrix.npy')
+    if not os.path.exists(matrix_path):
+        if pca_components is not None and pca_components < matrix.shape[1]:
+            matrix = PCA(n_components=pca_components, svd_solver='randomized', random_state=0).fit_transform(matrix).astype(np.float32)
+        np.save(matrix_path, matrix)
+
+    meta_path = os.path.join(run_dir, 'knn.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f)['k'] >= max_neighbors:
+                return run_dir
+
+    start = time.perf_counter()
+    indices, distances = knn_graph(np.load(matrix_path), max_neighbors, metric)
+    np.save(os.path.join(run_dir, 'knn_indices.npy'), indices)
+    np.save(os.path.join(run_dir, 'knn_distances.npy'), distances)
+    with open(meta_path, 'w') as f:
+        json.dump({'k': max_neighbors, 'metric': metric, 'seconds': round(time.perf_counter() - start, 3)}, f)
+
+    return run_dir
+
+
+def sweep(matrix: np.ndarray, n_neighbors_values, min_cluster_sizes, min_samples_values, cache_dir: str, pca_components: int = 50,
+          n_components: int = 2, metric: str = 'euclidean', workers: int = None, random_state: int = None,
+          plot_dir: str = None) -> pd.DataFrame:
+    """
+    Run the UMAP x HDBSCAN grid and return one row per configuration with the cluster count,
+    noise fraction and timings. With a plot_dir, every configuration is also plotted there, its
+    clusters drawn as a majority-label density image.
+
+    The kNN graph is computed once at the largest n_neighbors and sliced for the smaller ones,
+    each UMAP embedding is computed once and reused by every HDBSCAN setting, and grid points
+    run in a process pool.
+    """
+
+    n_neighbors_values = sorted(set(n_neighbors_values))
+    min_cluster_sizes = sorted(set(min_cluster_sizes))
+    min_samples_values = sorted(set(min_samples_values))
+
+    start = time.perf_counter()
+    run_dir = prepare_cache(matrix, cache_dir, max(n_neighbors_values), pca_components, metric)
+    knn_seconds = time.perf_counter() - start
+    print(f'kNN graph ready in {knn_seconds:.1f}s ({run_dir})')
+
+    reduce_tasks = [(run_dir, k, n_components, metric, random_state) for k in n_neighbors_values]
+    cluster_tasks = [(run_dir, k, n_components, s, min_cluster_sizes) for k, s in itertools.product(n_neighbors_values, min_samples_values)]
+    workers = workers or os.cpu_count() or 1
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(reduce_tasks))) as executor:
+            reductions = list(executor.map(_reduce_task, reduce_tasks))
+        with ProcessPoolExecutor(max_workers=min(workers, len(cluster_tasks))) as executor:
+            clusterings = list(executor.map(_cluster_task, cluster_tasks))
+    else:
+        reductions = [_reduce_task(task) for task in reduce_tasks]
+        clusterings = [_cluster_task(task) for task in cluster_tasks]
+
+    results = pd.DataFrame([row for rows in clusterings for row in rows])
+    results = results.merge(pd.DataFrame(reductions), on='n_neighbors')
+    results['config'] = [config_name(*row) for row in results[['n_neighbors', 'min_cluster_size', 'min_samples']].itertuples(index=False)]
+    if plot_dir is not None:
+        os.makedirs(plot_dir, exist_ok=True)
+        plot_tasks = [(run_dir, plot_dir, row.n_neighbors, n_components, row.min_cluster_size, row.min_samples)
+                      for row in results.itertuples(index=False)]
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(plot_tasks))) as executor:
+                list(executor.map(_plot_task, plot_tasks))
+        else:
+            for task in plot_tasks:
+                _plot_task(task)
+
+    return results.sort_values(['n_neighbors', 'min_cluster_size', 'min_samples']).reset_index(drop=True)
+
+
+def main(input_csv: str, store_dir: str, results_csv: str, n_neighbors_values, min_cluster_sizes, min_samples_values, cache_dir: str,
+         pca_components: int = 50, n_components: int = 2, overwrite: bool = False, workers: int = None, plot_dir: str = None) -> None:
+    """
+    Main function to sweep UMAP n_neighbors against HDBSCAN min_cluster_size and min_samples over the
+    review embeddings and save the results table. Labels of every configuration are kept in the cache directory
+    and, with a plot_dir, plotted there.
+    """
+
+    if not os.path.exists(input_csv):
+        raise FileNotFoundError(f"The input file '{input_csv}' does not exist.")
+
+    if os.path.exists(results_csv) and not overwrite:
+        should_proceed = input(f"The output file '{results_csv}' already exists. Do you want to overwrite it? (y/n): ")
+        if should_proceed.lower() != 'y':
+            sys.exit(f"Execution stopped. The output file '{results_csv}' already exists.")
+
+    df = read_table(input_csv, [REVIEW_ID_COLUMN])
+    df, matrix = attach_embeddings(df, store_dir)
+
+    with measure('sweep', rows=matrix.shape[0]):
+        results = sweep(matrix, n_neighbors_values, min_cluster_sizes, min_samples_values, cache_dir, pca_components, n_components,
+                        workers=workers, plot_dir=plot_dir)
+    print(results.to_string(index=False))
+    results.to_csv(results_csv, index=False)
+
+
+if __name__ == '__main__':
+    input_csv = './output/embedding_analysis/csv/review_embeddings.csv'
+    store_dir = './output/embedding_analysis/store/review_embeddings'
+    results_csv = './output/embedding_analysis/csv/umap_hdbscan_sweep.csv'
+    cache_dir = './output/embedding_analysis/cache/umap_hdbscan_sweep'
+    n_neighbors_values = [3, 5, 10, 15, 30]
+    min_cluster_sizes = [20, 40, 80]
+    min_samples_values = [2, 4, 8]
+    plot_dir = None  # './output/embedding_analysis/png/umap_hdbscan_sweep' to plot every configuration
+    overwrite = False
+
+    with instrumented_run('umap_hdbscan_sweep'):
+        main(input_csv, store_dir, results_csv, n_neighbors_values, min_cluster_sizes, min_samples_values, cache_dir, overwrite=overwrite,
+             plot_dir=plot_dir)
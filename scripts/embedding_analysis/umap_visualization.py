@@ -2,12 +2,32 @@ import os
 import sys
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import ast
-import umap
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
 
-def plot_embeddings_2d(matrix: np.array, sentiments: np.array, output_png: str):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import instrumented_run, measure
+from common.reviews import REVIEW_ID_COLUMN, review_ids
+from common.table_io import read_table
+from embedding_analysis.density_plot import DENSITY_THRESHOLD, plot_density
+from embedding_analysis.embedding_store import attach_embeddings
+from embedding_analysis.reduction_model import ReductionModel
+from sentiment_analysis.score_sentiment import attach_sentiments, score_texts
+
+def plot_embeddings_2d(matrix: np.array, sentiments: np.array, output_png: str, render: str = 'auto'):
+    """
+    Plot the reduced embeddings coloured by sentiment. render='scatter' draws a marker per review;
+    'density' draws the mean sentiment per pixel as an image, which stays fast for millions of reviews;
+    'auto' picks density above DENSITY_THRESHOLD reviews.
+    """
+
+    if render not in ('auto', 'scatter', 'density'):
+        raise ValueError(f'Unknown render mode {render}. Please choose "auto", "scatter" or "density".')
+
+    if render == 'density' or (render == 'auto' and matrix.shape[0] > DENSITY_THRESHOLD):
+        plot_density(matrix, sentiments, output_png, 'mean', colorbar_label='Mean sentiment')
+        return
+
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 10))
     plt.scatter(matrix[:, 0], matrix[:, 1], c=sentiments, cmap='coolwarm', s=50)
     plt.colorbar()
@@ -15,36 +35,75 @@ def plot_embeddings_2d(matrix: np.array, sentiments: np.array, output_png: str):
     plt.close()
 
 
-def dimension_reduction(matrix: np.array, method: str, n_components: int):
-    if method.lower() == 'umap':
-        um = umap.UMAP(n_neighbors=15, n_components=n_components)
-        return um.fit_transform(matrix)
-    else:
+def dimension_reduction(matrix: np.array, method: str, n_components: int, row_ids: np.array = None, model_dir: str = None,
+                        pca_components: int = 50, sample_size: int = 50_000, strata: np.array = None, refit: bool = False):
+    """
+    Reduce the embeddings to n_components with float32 PCA + UMAP fitted on a stratified sample.
+
+    With a model_dir, the fitted reducer and the reduced coordinates are saved there and reused by later
+    runs with the same settings: re-plots read the saved coordinates and new reviews are only transformed.
+    """
+
+    if method.lower() != 'umap':
         raise ValueError(f'Unknown method {method}. Please choose "umap".')
 
+    row_ids = np.arange(matrix.shape[0]) if row_ids is None else row_ids
+    model = ReductionModel(n_components=n_components, pca_components=pca_components, sample_size=sample_size)
+
+    if model_dir is not None and ReductionModel.exists(model_dir) and not refit:
+        saved = ReductionModel.load(model_dir)
+        if saved.settings == model.settings and saved.meta['dim'] == matrix.shape[1]:
+            coordinates = saved.reduce(row_ids, matrix)
+            saved.save(model_dir)
+            return coordinates
+        print(f"The reducer in '{model_dir}' was fitted with different settings; refitting.")
+
+    model.fit(row_ids, matrix, strata)
+    print(f"Fitted the reducer on {model.meta['n_fit']} of {model.meta['n_rows']} reviews in {model.meta['fit_seconds']}s")
+    if model_dir is not None:
+        model.save(model_dir)
+    return model.reduce(row_ids, matrix)
+
 
 def calculate_sentiments(reviews: pd.Series) -> np.array:
-    sia = SentimentIntensityAnalyzer()
-    return reviews.apply(lambda review: sia.polarity_scores(review)['compound'])
+    return score_texts(reviews.to_list(), 'VADER')['Sentiment'].to_numpy()
 
 
-def main(input_csv: str, output_png: str, method: str = 'umap', n_components: int = 2):
+def main(input_csv: str, store_dir: str, output_png: str, method: str = 'umap', n_components: int = 2, sentiment_csv: str = None,
+         model_dir: str = None, pca_components: int = 50, sample_size: int = 50_000, stratify_column: str = None, refit: bool = False,
+         render: str = 'auto'):
     if not os.path.exists(input_csv):
         raise FileNotFoundError(f"The input file '{input_csv}' does not exist.")
 
-    df = pd.read_csv(input_csv)
-    df['Embedding'] = df.Embedding.apply(ast.literal_eval).apply(np.array)
-    matrix = np.array(df.Embedding.to_list())
+    df = read_table(input_csv, ['Review_Text', REVIEW_ID_COLUMN, stratify_column])
+    df, matrix = attach_embeddings(df, store_dir)
 
-    matrix_reduced = dimension_reduction(matrix, method, n_components)
+    strata = df[stratify_column].to_numpy() if stratify_column is not None else None
+    with measure('reduce', rows=matrix.shape[0]):
+        matrix_reduced = dimension_reduction(matrix, method, n_components, review_ids(df), model_dir, pca_components, sample_size, strata, refit)
 
-    sentiments = calculate_sentiments(df['Review_Text'])
-    plot_embeddings_2d(matrix_reduced, sentiments, output_png)
+    with measure('sentiment', rows=df.shape[0]):
+        if sentiment_csv is not None:
+            sentiments = attach_sentiments(df, sentiment_csv)['Sentiment'].to_numpy()
+        else:
+            sentiments = calculate_sentiments(df['Review_Text'])
+    with measure('plot'):
+        plot_embeddings_2d(matrix_reduced, sentiments, output_png, render)
 
 if __name__ == '__main__':
     input_csv = './output/embedding_analysis/csv/review_embeddings.csv'
+    store_dir = './output/embedding_analysis/store/review_embeddings'
     output_png = './output/embedding_analysis/png/embeddings_2d_sentiments.png'  # Output file for the 2D plot
     method = 'umap'  # Using 'umap'
     n_components = 2  # Number of dimensions for UMAP
+    sentiment_csv = './output/sentiment_analysis/csv/review_embeddings_sentiment_VADER.csv'
+    model_dir = './output/embedding_analysis/models/umap_2d_50_pca'  # Saved reducer and coordinates, reused by re-plots
+    pca_components = 50  # PCA pre-reduction before UMAP; None to disable
+    sample_size = 50_000  # Reviews used to fit the reducer; the rest are transformed
+    stratify_column = 'State_Province'
+    refit = False
+    render = 'auto'  # 'density' draws mean sentiment per pixel instead of one marker per review
 
-    main(input_csv, output_png, method, n_components)
\ No newline at end of file
+    with instrumented_run('umap_visualization'):
+        main(input_csv, store_dir, output_png, method, n_components, sentiment_csv, model_dir, pca_components, sample_size, stratify_column,
+             refit, render)
@@ -0,0 +1,308 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from common.instrumentation import instrumented_run
+
+# Only the stage module of the chosen subcommand is imported, inside its handler, so starting one stage
+# does not pay for the imports (sklearn, matplotlib, nltk, umap) of all the others.
+
+
+def run_clean(args) -> None:
+    from data_cleaning.clean_reviews import clean_reviews
+
+    clean_reviews(args.input_dir, args.output_dir, args.workers, args.overwrite, args.output_csv, args.incremental)
+
+
+def run_anonymize(args) -> None:
+    import asyncio
+
+    from data_cleaning.anonymize_reviews import main
+
+    asyncio.run(main(args.input, args.output, api_key(args), args.cache, args.url, args.manifest, args.rule_pass))
+
+
+def run_preprocess(args) -> None:
+    from word_count_analysis.preprocess_reviews import main
+
+    main(args.input, args.output, args.overwrite, args.workers, args.manifest)
+
+
+def run_cluster(args) -> None:
+    from word_count_analysis.cluster_reviews import main
+
+    main(args.input, args.num_clusters, args.output, args.overwrite, args.text_column, args.models_dir, args.streaming, args.batch_size)
+
+
+def run_assign(args) -> None:
+    from word_count_analysis.cluster_reviews import assign
+
+    assign(args.input, args.output, args.models_dir, args.version, args.overwrite)
+
+
+def run_elbow(args) -> None:
+    from word_count_analysis.generate_elbow import main
+
+    main(args.input, range(args.min_k, args.max_k), args.output, args.overwrite, args.method, args.warm_start, args.workers,
+         sample_size=args.sample_size, cache_dir=args.cache_dir, streaming=args.streaming)
+
+
+def run_analyze(args) -> None:
+    from word_count_analysis.analyze_clusters import main
+
+    main(args.input, args.heatmap, args.boxplot, args.overwrite, args.scoring, args.sentiment)
+
+
+def run_analyze_db(args) -> None:
+    from word_count_analysis.db_cluster_analytics import main
+
+    main(args.database_url, args.table, args.heatmap, args.boxplot, args.overwrite, args.scoring, args.run_id)
+
+
+def run_sentiment(args) -> None:
+    from sentiment_analysis.score_sentiment import main
+
+    main(args.input, args.output, args.scorer, args.text_column, args.overwrite, args.workers, args.manifest)
+
+
+def run_embed(args) -> None:
+    from embedding_analysis.generate_embeddings import main
+
+    main(args.input, args.store, api_key(args), args.overwrite, args.model, args.concurrency, args.url, args.cache, args.manifest)
+
+
+def run_umap(args) -> None:
+    from embedding_analysis.umap_visualization import main
+
+    main(args.input, args.store, args.output, args.method, args.n_components, args.sentiment, args.model_dir, args.pca_components,
+         args.sample_size, args.stratify_column, args.refit, args.render)
+
+
+def run_umap_sweep(args) -> None:
+    from embedding_analysis.umap_hdbscan_sweep import main
+
+    main(args.input, args.store, args.output, args.n_neighbors, args.min_cluster_sizes, args.min_samples, args.cache_dir,
+         args.pca_components, args.n_components, args.overwrite, args.workers, args.plot_dir)
+
+
+def run_load(args) -> None:
+    from database.anon_embedding_csv_to_postgres import main
+
+    main(args.input, args.store, args.overwrite, args.vector_type, args.table, args.manifest, args.annotations)
+
+
+def run_search(args) -> None:
+    from similarity_search.search_reviews import main
+
+    main(args.store, args.index_dir, args.similar, args.duplicates, args.recall, args.k, args.n_probe, args.duplicate_threshold,
+         args.n_lists, args.rebuild)
+
+
+def run_compress(args) -> None:
+    from embedding_analysis.embedding_compression import main
+
+    main(args.store, args.report, args.schemes, args.output_dir, args.output_scheme, args.k, args.n_clusters, args.overwrite)
+
+
+def api_key(args) -> str:
+    """
+    The OpenAI key from --api-key, else from OPENAI_API_KEY (a .env file is read if python-dotenv is installed).
+    """
+
+    if args.api_key:
+        return args.api_key
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        pass
+    else:
+        load_dotenv()
+    if not os.getenv('OPENAI_API_KEY'):
+        raise SystemExit('No API key: pass --api-key or set OPENAI_API_KEY.')
+    return os.getenv('OPENAI_API_KEY')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='review-analysis', description='Run one stage of the review analysis pipeline.')
+    parser.add_argument('--report-dir', default=None, help='Where the run report is written (default: $REVIEW_ANALYSIS_REPORT_DIR '
+                                                            'or ./output/reports)')
+    parser.add_argument('--profile', type=float, nargs='?', const=0.01, default=None,
+                        help='Sample the call stacks every PROFILE seconds (default 0.01) and write them next to the report')
+    commands = parser.add_subparsers(dest='command', metavar='command', required=True)
+
+    def command(name: str, handler, help: str) -> argparse.ArgumentParser:
+        subparser = commands.add_parser(name, help=help, description=help)
+        subparser.set_defaults(handler=handler)
+        return subparser
+
+    def overwrite(subparser: argparse.ArgumentParser) -> None:
+        subparser.add_argument('--overwrite', action='store_true', help='Replace existing outputs without asking')
+
+    clean = command('clean', run_clean, 'Clean the raw clinic CSVs into a partitioned Parquet dataset.')
+    clean.add_argument('--input-dir', default='../../data/raw_data')
+    clean.add_argument('--output-dir', default='../data/cleaned_reviews')
+    clean.add_argument('--output-csv', default=None, help='Also export the cleaned reviews as one CSV')
+    clean.add_argument('--incremental', action='store_true', help='Only clean clinic files that changed since the last run')
+    clean.add_argument('--workers', type=int, default=None)
+    overwrite(clean)
+
+    anonymize = command('anonymize', run_anonymize, 'Replace names in the reviews with the chat API, optionally after a local rule pass.')
+    anonymize.add_argument('input')
+    anonymize.add_argument('output')
+    anonymize.add_argument('--api-key', default=None, help='Default: $OPENAI_API_KEY')
+    anonymize.add_argument('--cache', default=None, help='SQLite cache of API responses')
+    anonymize.add_argument('--manifest', default=None, help='Manifest of reviews already anonymized, for incremental reruns')
+    anonymize.add_argument('--url', default='https://api.openai.com/v1/chat/completions')
+    anonymize.add_argument('--rule-pass', action='store_true', help='Redact known names locally and send only ambiguous reviews to the API')
+
+    preprocess = command('preprocess', run_preprocess, 'Tokenize, remove stopwords and lemmatize the review text.')
+    preprocess.add_argument('--input', default='./data/cleaned_reviews.csv')
+    preprocess.add_argument('--output', default='./output/word_count_analysis/csv/preprocessed_reviews.csv')
+    preprocess.add_argument('--manifest', default='./output/manifest.sqlite')
+    preprocess.add_argument('--workers', type=int, default=None)
+    overwrite(preprocess)
+
+    cluster = command('cluster', run_cluster, 'Cluster the preprocessed reviews with TF-IDF and K-means.')
+    cluster.add_argument('num_clusters', type=int)
+    cluster.add_argument('--input', default='./output/word_count_analysis/csv/preprocessed_reviews.csv')
+    cluster.add_argument('--output', default=None, help='Default: ./output/word_count_analysis/csv/reviews_with_<K>_clusters.csv')
+    cluster.add_argument('--models-dir', default=None, help='Default: ./output/word_count_analysis/models/tfidf_kmeans_<K>_clusters')
+    cluster.add_argument('--text-column', default='Preprocessed_Review_Text')
+    cluster.add_argument('--streaming', action='store_true', help='Out-of-core hashed TF-IDF and mini-batch K-means')
+    cluster.add_argument('--batch-size', type=int, default=20_000)
+    overwrite(cluster)
+
+    assign = command('assign', run_assign, 'Assign new reviews to the clusters of a saved model, without refitting.')
+    assign.add_argument('input')
+    assign.add_argument('output')
+    assign.add_argument('models_dir')
+    assign.add_argument('--version', type=int, default=None, help='Model version; default the latest')
+    overwrite(assign)
+
+    elbow = command('elbow', run_elbow, 'Sweep the number of clusters and plot the elbow curve.')
+    elbow.add_argument('--input', default='./output/word_count_analysis/preprocessed_reviews.csv')
+    elbow.add_argument('--output', default='./output/word_count_analysis/png/elbow_analysis.png')
+    elbow.add_argument('--min-k', type=int, default=1)
+    elbow.add_argument('--max-k', type=int, default=30, help='Exclusive')
+    elbow.add_argument('--method', default='kmeans')
+    elbow.add_argument('--warm-start', action='store_true')
+    elbow.add_argument('--sample-size', type=int, default=5000)
+    elbow.add_argument('--cache-dir', default='./output/word_count_analysis/k_sweep_cache')
+    elbow.add_argument('--streaming', action='store_true')
+    elbow.add_argument('--workers', type=int, default=None)
+    overwrite(elbow)
+
+    analyze = command('analyze', run_analyze, 'Plot the word count heatmap and sentiment boxplot per cluster.')
+    analyze.add_argument('input')
+    analyze.add_argument('heatmap')
+    analyze.add_argument('boxplot')
+    analyze.add_argument('--sentiment', default=None, help='Stored sentiment scores; scored with VADER when not given or missing')
+    analyze.add_argument('--scoring', default='count')
+    overwrite(analyze)
+
+    analyze_db = command('analyze-db', run_analyze_db, 'Plot the cluster heatmap and boxplot from aggregates computed in the database.')
+    analyze_db.add_argument('heatmap')
+    analyze_db.add_argument('boxplot')
+    analyze_db.add_argument('--database-url', default=None, help='e.g. sqlite:///reviews.sqlite; default: PostgreSQL from .env')
+    analyze_db.add_argument('--table', default='reviews')
+    analyze_db.add_argument('--scoring', default='count')
+    analyze_db.add_argument('--run-id', default=None, help='Cluster run the table comes from; caches the summary under it')
+    overwrite(analyze_db)
+
+    sentiment = command('sentiment', run_sentiment, 'Score the sentiment of every review once and store it by review id.')
+    sentiment.add_argument('--input', default='./output/word_count_analysis/csv/preprocessed_reviews.csv')
+    sentiment.add_argument('--output', default='./output/sentiment_analysis/csv/review_sentiment_VADER.csv')
+    sentiment.add_argument('--scorer', default='VADER')
+    sentiment.add_argument('--text-column', default='Preprocessed_Review_Text')
+    sentiment.add_argument('--manifest', default='./output/manifest.sqlite')
+    sentiment.add_argument('--workers', type=int, default=None)
+    overwrite(sentiment)
+
+    embed = command('embed', run_embed, 'Get an embedding for every anonymized review and store them.')
+    embed.add_argument('input')
+    embed.add_argument('store')
+    embed.add_argument('--api-key', default=None, help='Default: $OPENAI_API_KEY')
+    embed.add_argument('--model', default='text-embedding-ada-002')
+    embed.add_argument('--concurrency', type=int, default=8)
+    embed.add_argument('--cache', default=None, help='SQLite cache of API responses')
+    embed.add_argument('--manifest', default=None)
+    embed.add_argument('--url', default='https://api.openai.com/v1/embeddings')
+    overwrite(embed)
+
+    umap = command('umap', run_umap, 'Reduce the embeddings to 2 or 3 dimensions and plot them by sentiment.')
+    umap.add_argument('--input', default='./output/embedding_analysis/csv/review_embeddings.csv')
+    umap.add_argument('--store', default='./output/embedding_analysis/store/review_embeddings')
+    umap.add_argument('--output', default='./output/embedding_analysis/png/embeddings_2d_sentiments.png')
+    umap.add_argument('--sentiment', default='./output/sentiment_analysis/csv/review_embeddings_sentiment_VADER.csv')
+    umap.add_argument('--model-dir', default='./output/embedding_analysis/models/umap_2d_50_pca')
+    umap.add_argument('--method', default='umap')
+    umap.add_argument('--n-components', type=int, default=2)
+    umap.add_argument('--pca-components', type=int, default=50)
+    umap.add_argument('--sample-size', type=int, default=50_000)
+    umap.add_argument('--stratify-column', default='State_Province')
+    umap.add_argument('--refit', action='store_true')
+    umap.add_argument('--render', choices=['auto', 'scatter', 'density'], default='auto',
+                      help='density draws mean sentiment per pixel; auto uses it above 100,000 reviews')
+
+    sweep = command('umap-sweep', run_umap_sweep, 'Sweep UMAP and HDBSCAN parameters over the embeddings.')
+    sweep.add_argument('--input', default='./output/embedding_analysis/csv/review_embeddings.csv')
+    sweep.add_argument('--store', default='./output/embedding_analysis/store/review_embeddings')
+    sweep.add_argument('--output', default='./output/embedding_analysis/csv/umap_hdbscan_sweep.csv')
+    sweep.add_argument('--cache-dir', default='./output/embedding_analysis/cache/umap_hdbscan_sweep')
+    sweep.add_argument('--n-neighbors', type=int, nargs='+', default=[3, 5, 10, 15, 30])
+    sweep.add_argument('--min-cluster-sizes', type=int, nargs='+', default=[20, 40, 80])
+    sweep.add_argument('--min-samples', type=int, nargs='+', default=[2, 4, 8])
+    sweep.add_argument('--pca-components', type=int, default=50)
+    sweep.add_argument('--n-components', type=int, default=2)
+    sweep.add_argument('--workers', type=int, default=None)
+    sweep.add_argument('--plot-dir', default=None, help='Plot every configuration here as a cluster density image')
+    overwrite(sweep)
+
+    load = command('load', run_load, 'Load the reviews and their embeddings into PostgreSQL.')
+    load.add_argument('input')
+    load.add_argument('store')
+    load.add_argument('--table', default='reviews')
+    load.add_argument('--vector-type', default='real[]')
+    load.add_argument('--manifest', default=None)
+    load.add_argument('--annotations', nargs='*', default=(),
+                      help='Cluster and sentiment outputs whose Cluster, Sentiment and Preprocessed_Review_Text columns are joined on by review id')
+    overwrite(load)
+
+    search = command('search', run_search, 'Find similar and near-duplicate reviews with an IVF index.')
+    search.add_argument('--store', default='./output/embedding_analysis/store/review_embeddings')
+    search.add_argument('--index-dir', default='./output/similarity_search/index/review_embeddings_ivf')
+    search.add_argument('--similar', default='./output/similarity_search/csv/similar_reviews_top10.csv')
+    search.add_argument('--duplicates', default='./output/similarity_search/csv/near_duplicate_reviews.csv')
+    search.add_argument('--recall', default='./output/similarity_search/csv/ivf_recall.csv')
+    search.add_argument('--k', type=int, default=10)
+    search.add_argument('--n-probe', type=int, default=16)
+    search.add_argument('--duplicate-threshold', type=float, default=0.95)
+    search.add_argument('--n-lists', type=int, default=None)
+    search.add_argument('--rebuild', action='store_true')
+
+    compress = command('compress', run_compress, 'Report how compressing the embeddings affects recall and clusters.')
+    compress.add_argument('--store', default='./output/embedding_analysis/store/review_embeddings')
+    compress.add_argument('--report', default='./output/embedding_analysis/csv/embedding_compression_report.csv')
+    compress.add_argument('--schemes', nargs='+', default=['float32', 'float16', 'int8', 'pca512', 'pca256', 'pca256+int8', 'pca128+int8'])
+    compress.add_argument('--output-dir', default=None, help='Also write a compressed store here')
+    compress.add_argument('--output-scheme', default=None)
+    compress.add_argument('--k', type=int, default=10)
+    compress.add_argument('--n-clusters', type=int, default=20)
+    overwrite(compress)
+
+    return parser
+
+
+def main(argv=None) -> None:
+    args = build_parser().parse_args(argv)
+    if args.command == 'cluster':
+        args.output = args.output or f'./output/word_count_analysis/csv/reviews_with_{args.num_clusters}_clusters.csv'
+        args.models_dir = args.models_dir or f'./output/word_count_analysis/models/tfidf_kmeans_{args.num_clusters}_clusters'
+
+    with instrumented_run(args.command.replace('-', '_'), args.report_dir, args.profile):
+        args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import instrumented_run, measure
+from common.manifest import Manifest, merge_delta, stage_name
+from common.reviews import FINGERPRINT_COLUMN, REVIEW_ID_COLUMN, fingerprints, review_ids
+from common.table_io import read_table, write_table
+
+STAGE = 'sentiment'
+SCORER_COLUMN = 'Sentiment_Scorer'
+TEXT_COLUMN = 'Sentiment_Text_Column'
+
+
+class VaderScorer:
+    """
+    VADER polarity scores: compound plus the positive/negative/neutral breakdown.
+    """
+
+    name = 'VADER'
+    columns = ['Sentiment', 'Sentiment_Pos', 'Sentiment_Neg', 'Sentiment_Neu']
+
+    def __init__(self):
+        from nltk.sentiment.vader import SentimentIntensityAnalyzer
+        self.analyzer = SentimentIntensityAnalyzer()
+
+    def score(self, texts: list) -> np.ndarray:
+        scores = [self.analyzer.polarity_scores(text) for text in texts]
+        return np.array([[s['compound'], s['pos'], s['neg'], s['neu']] for s in scores], dtype=np.float64).reshape(len(texts), 4)
+
+
+class TextBlobScorer:
+    """
+    TextBlob pattern-analyzer scores: polarity (stored as the sentiment) and subjectivity.
+    """
+
+    name = 'TEXTBLOB'
+    columns = ['Sentiment', 'Sentiment_Subjectivity']
+
+    def __init__(self):
+        from textblob import TextBlob
+        self.text_blob = TextBlob
+
+    def score(self, texts: list) -> np.ndarray:
+        sentiments = [self.text_blob(text).sentiment for text in texts]
+        return np.array([[s.polarity, s.subjectivity] for s in sentiments], dtype=np.float64).reshape(len(texts), 2)
+
+
+SCORERS = {scorer.name: scorer for scorer in (VaderScorer, TextBlobScorer)}
+
+_scorers = {}
+
+
+def get_scorer(name: str):
+    """
+    Scorer instance for a name, created once per process.
+    """
+
+    name = name.upper()
+    if name not in SCORERS:
+        raise ValueError(f'Unknown sentiment scorer {name}. Please choose one of {sorted(SCORERS)}.')
+    if name not in _scorers:
+        _scorers[name] = SCORERS[name]()
+    return _scorers[name]
+
+
+def _score_chunk(args: tuple) -> np.ndarray:
+    name, texts = args
+    return get_scorer(name).score(texts)
+
+
+def score_texts(texts: list, scorer: str = 'VADER', workers: int = None, chunksize: int = 5_000) -> pd.DataFrame:
+    """
+    Score texts in chunks over a process pool. Returns one row per text with the scorer's columns.
+    """
+
+    texts = ['' if pd.isna(text) else str(text) for text in texts]
+    chunks = [texts[start:start + chunksize] for start in range(0, len(texts), chunksize)]
+    workers = min(workers or os.cpu_count() or 1, max(len(chunks), 1))
+    tasks = [(scorer, chunk) for chunk in chunks]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(tqdm(executor.map(_score_chunk, tasks), total=len(tasks), desc=f'Scoring sentiment ({scorer})'))
+    else:
+        results = [_score_chunk(task) for task in tqdm(tasks, desc=f'Scoring sentiment ({scorer})')]
+
+    columns = SCORERS[scorer.upper()].columns
+    matrix = np.concatenate(results) if results else np.empty((0, len(columns)))
+    return pd.DataFrame(matrix, columns=columns)
+
+
+def load_sentiments(sentiment_csv: str) -> pd.DataFrame:
+    """
+    Load stored sentiment scores indexed by review id. Scores of a table without review ids cannot be
+    matched to reviews reliably, so they are refused.
+    """
+
+    if not os.path.exists(sentiment_csv):
+        raise FileNotFoundError(f"The sentiment file '{sentiment_csv}' does not exist.")
+
+    sentiments = read_table(sentiment_csv)
+    if REVIEW_ID_COLUMN not in sentiments.columns:
+        raise ValueError(f"The sentiment file '{sentiment_csv}' has no {REVIEW_ID_COLUMN} column. Score a table with review ids "
+                         f"(the cleaned reviews) to join scores onto other tables.")
+    return sentiments.set_index(REVIEW_ID_COLUMN)
+
+
+def attach_sentiments(df: pd.DataFrame, sentiment_csv: str) -> pd.DataFrame:
+    """
+    Join stored sentiment columns onto a review table by review id. Both sides need a Review_Id column:
+    row positions are not ids, since stages such as cluster_reviews reorder the rows.
+    """
+
+    if REVIEW_ID_COLUMN not in df.columns:
+        raise ValueError(f'The review table has no {REVIEW_ID_COLUMN} column, so stored sentiments cannot be matched to its reviews. '
+                         f'Score this table directly instead.')
+
+    sentiments = load_sentiments(sentiment_csv)
+    missing = ~np.isin(review_ids(df), sentiments.index.to_numpy())
+    if missing.any():
+        raise ValueError(f"{int(missing.sum())} reviews have no score in '{sentiment_csv}'. Rerun the sentiment stage.")
+
+    scores = sentiments.loc[review_ids(df)]
+    scores.index = df.index
+    return df.drop(columns=[column for column in scores.columns if column in df.columns]).join(scores)
+
+
+def score_frame(df: pd.DataFrame, scorer: str, text_column: str, workers: int = None) -> pd.DataFrame:
+    """
+    Score a review table into the stored layout: Review_Id, the scorer's columns, the scorer and text column names.
+    A table without review ids is scored without them; such scores cannot be attached to other tables.
+    """
+
+    with measure('score', rows=df.shape[0]):
+        scores = score_texts(df[text_column].to_list(), scorer, workers)
+    if REVIEW_ID_COLUMN in df.columns:
+        scores.insert(0, REVIEW_ID_COLUMN, review_ids(df))
+    scores[SCORER_COLUMN] = scorer.upper()
+    scores[TEXT_COLUMN] = text_column
+    return scores
+
+
+def score_delta(df: pd.DataFrame, output_csv: str, manifest: Manifest, scorer: str, text_column: str, workers: int = None) -> int:
+    """
+    Score only new or changed reviews and merge them into the existing scores. Returns the number scored.
+    """
+
+    stage = stage_name(STAGE, output_csv)
+    ids, prints = review_ids(df), fingerprints(df)
+    new, changed, removed = manifest.delta(stage, ids, prints)
+    pending = new | changed
+    print(f'Delta: {int(new.sum())} new, {int(changed.sum())} changed, {removed.shape[0]} removed reviews')
+
+    updates = score_frame(df[pending], scorer, text_column, workers)
+    write_table(merge_delta(read_table(output_csv), updates, ids), output_csv)
+    manifest.mark(stage, ids[pending], prints[pending])
+    manifest.forget(stage, removed)
+    return updates.shape[0]
+
+
+def same_scoring(output_csv: str, scorer: str, text_column: str) -> bool:
+    stored = read_table(output_csv, [SCORER_COLUMN, TEXT_COLUMN])
+    return not stored.empty and stored[SCORER_COLUMN].iloc[0] == scorer.upper() and stored[TEXT_COLUMN].iloc[0] == text_column
+
+
+def main(input_csv: str, output_csv: str, scorer: str = 'VADER', text_column: str = 'Review_Text', overwrite: bool = False,
+         workers: int = None, manifest_path: str = None) -> None:
+    """
+    Main function to score the sentiment of every review once and save the scores,
+    keyed by review id, for the analysis scripts to reuse. With a manifest and existing scores
+    from the same scorer, only new or changed reviews are scored.
+    """
+
+    if not os.path.exists(input_csv):
+        raise FileNotFoundError(f"The input file '{input_csv}' does not exist.")
+
+    df = read_table(input_csv, [text_column, REVIEW_ID_COLUMN, FINGERPRINT_COLUMN])
+    manifest = Manifest(manifest_path) if manifest_path is not None and fingerprints(df) is not None else None
+
+    if manifest is not None and os.path.exists(output_csv) and not overwrite and same_scoring(output_csv, scorer, text_column):
+        score_delta(df, output_csv, manifest, scorer, text_column, workers)
+        manifest.close()
+        return
+
+    if os.path.exists(output_csv) and not overwrite:
+        should_proceed = input(f"The output file '{output_csv}' already exists. Do you want to overwrite it? (y/n): ")
+        if should_proceed.lower() != 'y':
+            sys.exit(f"Execution stopped. The output file '{output_csv}' already exists.")
+
+    write_table(score_frame(df, scorer, text_column, workers), output_csv)
+
+    if manifest is not None:
+        manifest.forget(stage_name(STAGE, output_csv))
+        manifest.mark(stage_name(STAGE, output_csv), review_ids(df), fingerprints(df))
+        manifest.close()
+
+
+if __name__ == '__main__':
+    input_csv = './output/word_count_analysis/csv/preprocessed_reviews.csv'
+    output_csv = './output/sentiment_analysis/csv/review_sentiment_VADER.csv'
+    scorer = 'VADER'
+    text_column = 'Preprocessed_Review_Text'
+    manifest_path = './output/manifest.sqlite'  # Only new or changed reviews are scored on reruns
+    overwrite = False
+
+    with instrumented_run('score_sentiment'):
+        main(input_csv, output_csv, scorer, text_column, overwrite, manifest_path=manifest_path)
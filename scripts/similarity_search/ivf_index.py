@@ -0,0 +1,285 @@
+import json
+import os
+import time
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from tqdm import tqdm
+
+CENTROIDS_FILE = 'centroids.npy'
+VECTORS_FILE = 'vectors.npy'
+ROW_IDS_FILE = 'row_ids.npy'
+OFFSETS_FILE = 'list_offsets.npy'
+META_FILE = 'meta.json'
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize rows as float32 so that inner products are cosine similarities.
+    """
+
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def top_k(scores: np.ndarray, k: int) -> tuple:
+    """
+    (indices, scores) of the k largest scores in each row, sorted descending.
+    """
+
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+def exact_search(vectors: np.ndarray, row_ids: np.ndarray, queries: np.ndarray, k: int = 10, chunksize: int = 100_000) -> tuple:
+    """
+    Brute-force cosine top-k over normalized vectors, scanned in chunks. Returns (row_ids, scores).
+    """
+
+    queries = normalize(np.atleast_2d(queries))
+    best_scores = np.full((queries.shape[0], 0), -np.inf, dtype=np.float32)
+    best_offsets = np.empty((queries.shape[0], 0), dtype=np.int64)
+
+    for start in range(0, vectors.shape[0], chunksize):
+        scores = queries @ np.asarray(vectors[start:start + chunksize]).T
+        offsets, scores = top_k(scores, k)
+        candidates = np.hstack([best_scores, scores])
+        candidate_offsets = np.hstack([best_offsets, offsets + start])
+        keep, best_scores = top_k(candidates, k)
+        best_offsets = np.take_along_axis(candidate_offsets, keep, axis=1)
+
+    return np.asarray(row_ids)[best_offsets], best_scores
+
+
+class IVFIndex:
+    """
+    Inverted-file (IVF-flat) index over normalized float32 embeddings.
+
+    Vectors are partitioned by their nearest coarse centroid and stored contiguously per list, so a query
+    scores the centroids, then scans only the n_probe closest lists. An index is a directory holding:
+    - centroids.npy: float32 (n_lists, dim) normalized coarse centroids
+    - vectors.npy: float32 (n_rows, dim) normalized vectors ordered by list
+    - row_ids.npy: int64 review id of each stored vector
+    - list_offsets.npy: int64 (n_lists + 1) start offset of each list in vectors.npy
+    - meta.json: dimension, sizes and build settings
+    The vectors are memory-mapped when the index is loaded.
+    """
+
+    def __init__(self, index_dir: str):
+        if not os.path.exists(os.path.join(index_dir, META_FILE)):
+            raise FileNotFoundError(f"The index '{index_dir}' does not exist.")
+
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+
+        self.centroids = np.load(os.path.join(index_dir, CENTROIDS_FILE))
+        self.vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode='r')
+        self.row_ids = np.load(os.path.join(index_dir, ROW_IDS_FILE))
+        self.list_offsets = np.load(os.path.join(index_dir, OFFSETS_FILE))
+
+        self._order = np.argsort(self.row_ids, kind='stable')
+
+    @classmethod
+    def build(cls, index_dir: str, row_ids: np.ndarray, matrix: np.ndarray, n_lists: int = None, train_size: int = 100_000,
+              chunksize: int = 100_000, random_state: int = 0) -> 'IVFIndex':
+        """
+        Train coarse centroids on a sample, assign every vector to its nearest centroid
+        and write the list-ordered vectors to index_dir.
+        """
+
+        n = matrix.shape[0]
+        n_lists = min(n_lists or max(1, int(4 * np.sqrt(n))), n)
+        rng = np.random.default_rng(random_state)
+        sample = np.sort(rng.choice(n, size=min(max(train_size, 40 * n_lists), n), replace=False))
+
+        start = time.perf_counter()
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, n_init=1, batch_size=4096, random_state=random_state)
+        kmeans.fit(normalize(matrix[sample]))
+        centroids = normalize(kmeans.cluster_centers_)
+
+        assignments = np.empty(n, dtype=np.int64)
+        for chunk_start in tqdm(range(0, n, chunksize), desc='Assigning vectors to lists'):
+            chunk = normalize(matrix[chunk_start:chunk_start + chunksize])
+            assignments[chunk_start:chunk_start + chunksize] = np.argmax(chunk @ centroids.T, axis=1)
+
+        order = np.argsort(assignments, kind='stable')
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))]).astype(np.int64)
+
+        os.makedirs(index_dir, exist_ok=True)
+        vectors = np.lib.format.open_memmap(os.path.join(index_dir, VECTORS_FILE), mode='w+', dtype=np.float32, shape=(n, matrix.shape[1]))
+        for chunk_start in range(0, n, chunksize):
+            rows = order[chunk_start:chunk_start + chunksize]
+            vectors[chunk_start:chunk_start + rows.shape[0]] = normalize(matrix[np.sort(rows)])[np.argsort(np.argsort(rows))]
+        vectors.flush()
+        del vectors
+
+        np.save(os.path.join(index_dir, CENTROIDS_FILE), centroids)
+        np.save(os.path.join(index_dir, ROW_IDS_FILE), np.asarray(row_ids, dtype=np.int64)[order])
+        np.save(os.path.join(index_dir, OFFSETS_FILE), list_offsets)
+
+        sizes = np.diff(list_offsets)
+        with open(os.path.join(index_dir, META_FILE), 'w') as f:
+            json.dump({'dim': int(matrix.shape[1]), 'n_rows': int(n), 'n_lists': int(n_lists), 'train_size': int(sample.shape[0]),
+                       'max_list_size': int(sizes.max()), 'build_seconds': round(time.perf_counter() - start, 2)}, f, indent=2)
+
+        return cls(index_dir)
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    def __len__(self) -> int:
+        return self.row_ids.shape[0]
+
+    def vectors_for(self, row_ids) -> np.ndarray:
+        """
+        Stored (normalized) vectors of the given review ids.
+        """
+
+        row_ids = np.atleast_1d(np.asarray(row_ids, dtype=np.int64))
+        positions = np.clip(np.searchsorted(self.row_ids, row_ids, sorter=self._order), 0, len(self) - 1)
+        offsets = self._order[positions]
+        missing = self.row_ids[offsets] != row_ids
+        if missing.any():
+            raise KeyError(f'Row ids not in index: {row_ids[missing][:10].tolist()}')
+
+        return np.asarray(self.vectors[offsets])
+
+    def search(self, queries: np.ndarray, k: int = 10, n_probe: int = 16) -> tuple:
+        """
+        Approximate cosine top-k for a batch of query vectors. Returns (row_ids, scores), each (n_queries, k);
+        rows with fewer than k candidates are padded with row id -1 and score -inf.
+        """
+
+        queries = normalize(np.atleast_2d(queries))
+        n_queries = queries.shape[0]
+        n_probe = min(n_probe, self.n_lists)
+        probes, _ = top_k(queries @ self.centroids.T, n_probe)
+
+        if n_queries == 1:
+            return self._search_one(queries[0], probes[0], k)
+
+        # Scan list by list so each list is read once per batch and scored against every query probing it.
+        probe_queries = np.repeat(np.arange(n_queries), n_probe)
+        probe_lists = probes.ravel()
+        order = np.argsort(probe_lists, kind='stable')
+        lists, starts = np.unique(probe_lists[order], return_index=True)
+        groups = np.split(probe_queries[order], starts[1:])
+
+        candidate_queries, candidate_offsets, candidate_scores = [], [], []
+        for list_id, query_ids in zip(lists, groups):
+            start, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            if start == end:
+                continue
+            found, scores = top_k(queries[query_ids] @ np.asarray(self.vectors[start:end]).T, k)
+            candidate_queries.append(np.repeat(query_ids, found.shape[1]))
+            candidate_offsets.append((found + start).ravel())
+            candidate_scores.append(scores.ravel())
+
+        result_ids = np.full((n_queries, k), -1, dtype=np.int64)
+        result_scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+        if not candidate_queries:
+            return result_ids, result_scores
+
+        candidate_queries = np.concatenate(candidate_queries)
+        candidate_offsets = np.concatenate(candidate_offsets)
+        candidate_scores = np.concatenate(candidate_scores)
+        order = np.lexsort((-candidate_scores, candidate_queries))
+        candidate_queries = candidate_queries[order]
+        ranks = np.arange(order.shape[0]) - np.searchsorted(candidate_queries, candidate_queries)
+        keep = ranks < k
+
+        result_ids[candidate_queries[keep], ranks[keep]] = self.row_ids[candidate_offsets[order][keep]]
+        result_scores[candidate_queries[keep], ranks[keep]] = candidate_scores[order][keep]
+        return result_ids, result_scores
+
+    def _search_one(self, query: np.ndarray, probes: np.ndarray, k: int) -> tuple:
+        spans = [(self.list_offsets[probe], self.list_offsets[probe + 1]) for probe in probes]
+        offsets = np.concatenate([np.arange(start, end) for start, end in spans])
+
+        result_ids = np.full((1, k), -1, dtype=np.int64)
+        result_scores = np.full((1, k), -np.inf, dtype=np.float32)
+        if offsets.shape[0] == 0:
+            return result_ids, result_scores
+
+        candidates = np.concatenate([self.vectors[start:end] for start, end in spans])
+        found, scores = top_k((candidates @ query)[None, :], k)
+        result_ids[0, :found.shape[1]] = self.row_ids[offsets[found[0]]]
+        result_scores[0, :found.shape[1]] = scores[0]
+        return result_ids, result_scores
+
+    def exact_search(self, queries: np.ndarray, k: int = 10) -> tuple:
+        """
+        Brute-force top-k over every stored vector, for exact results and recall checks.
+        """
+
+        return exact_search(self.vectors, self.row_ids, queries, k)
+
+    def similar_reviews(self, row_ids, k: int = 10, n_probe: int = 16, exact: bool = False) -> tuple:
+        """
+        Top-k most similar reviews to reviews already in the index, excluding each review itself.
+        """
+
+        row_ids = np.atleast_1d(np.asarray(row_ids, dtype=np.int64))
+        queries = self.vectors_for(row_ids)
+        found, scores = self.exact_search(queries, k + 1) if exact else self.search(queries, k + 1, n_probe)
+
+        keep = found != row_ids[:, None]
+        ranks = np.argsort(~keep, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(found, ranks, axis=1), np.take_along_axis(scores, ranks, axis=1)
+
+    def near_duplicates(self, threshold: float = 0.95, k: int = 10, n_probe: int = 8, batch_size: int = 1024) -> list:
+        """
+        Pairs of reviews whose cosine similarity is at least the threshold, as (row_id_a, row_id_b, similarity)
+        with row_id_a < row_id_b. Each review is compared with its k approximate nearest neighbours.
+        """
+
+        pairs = set()
+        for start in tqdm(range(0, len(self), batch_size), desc='Finding near-duplicates'):
+            ids = self.row_ids[start:start + batch_size]
+            found, scores = self.search(self.vectors[start:start + batch_size], k + 1, n_probe)
+            for query_id, neighbours, similarities in zip(ids, found, scores):
+                for neighbour, similarity in zip(neighbours, similarities):
+                    if similarity < threshold:
+                        break
+                    if neighbour != query_id and neighbour != -1:
+                        pairs.add((int(min(query_id, neighbour)), int(max(query_id, neighbour)), round(float(similarity), 6)))
+
+        return sorted(pairs)
+
+
+def evaluate_recall(index: IVFIndex, k: int = 10, n_probes: tuple = (1, 4, 16, 64), n_queries: int = 200, random_state: int = 0) -> list:
+    """
+    Recall@k of the IVF search against brute force for sampled stored vectors, with per-query latency.
+    """
+
+    rng = np.random.default_rng(random_state)
+    sample = rng.choice(len(index), size=min(n_queries, len(index)), replace=False)
+    queries = np.asarray(index.vectors[np.sort(sample)])
+
+    start = time.perf_counter()
+    truth, _ = index.exact_search(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / queries.shape[0]
+
+    results = [{'mode': 'exact', 'n_probe': None, 'recall': 1.0, 'mean_ms': round(exact_ms, 3), 'p95_ms': None}]
+    for n_probe in n_probes:
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found, _ = index.search(query, k, n_probe)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += np.intersect1d(found[0], expected).shape[0]
+        results.append({'mode': 'ivf', 'n_probe': min(n_probe, index.n_lists), 'recall': round(hits / truth.size, 4),
+                        'mean_ms': round(float(np.mean(latencies)), 3), 'p95_ms': round(float(np.percentile(latencies, 95)), 3)})
+
+    return results
@@ -0,0 +1,87 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import instrumented_run, measure
+from embedding_analysis.embedding_store import EmbeddingStore
+from similarity_search.ivf_index import IVFIndex, evaluate_recall
+
+
+def load_or_build_index(store_dir: str, index_dir: str, n_lists: int = None, rebuild: bool = False) -> IVFIndex:
+    """
+    Load the index in index_dir, building it from the embedding store first if it does not exist yet.
+    """
+
+    if os.path.exists(os.path.join(index_dir, 'meta.json')) and not rebuild:
+        return IVFIndex(index_dir)
+
+    row_ids, matrix = EmbeddingStore(store_dir).load()
+    index = IVFIndex.build(index_dir, row_ids, matrix, n_lists)
+    print(f"Built index with {len(index)} reviews in {index.n_lists} lists ({index.meta['build_seconds']}s)")
+    return index
+
+
+def similar_reviews_frame(index: IVFIndex, row_ids, k: int = 10, n_probe: int = 16, exact: bool = False,
+                          batch_size: int = 1024) -> pd.DataFrame:
+    """
+    Long table of the k most similar reviews for each review id: Review_Id, Rank, Similar_Review_Id, Similarity.
+    """
+
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    frames = []
+    for start in tqdm(range(0, row_ids.shape[0], batch_size), desc='Searching similar reviews'):
+        batch = row_ids[start:start + batch_size]
+        found, scores = index.similar_reviews(batch, k, n_probe, exact)
+        frames.append(pd.DataFrame({
+            'Review_Id': np.repeat(batch, found.shape[1]),
+            'Rank': np.tile(np.arange(1, found.shape[1] + 1), batch.shape[0]),
+            'Similar_Review_Id': found.ravel(),
+            'Similarity': scores.ravel(),
+        }))
+
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['Review_Id', 'Rank', 'Similar_Review_Id', 'Similarity'])
+    return df[df['Similar_Review_Id'] != -1]
+
+
+def main(store_dir: str, index_dir: str, similar_csv: str, duplicates_csv: str, recall_csv: str, k: int = 10, n_probe: int = 16,
+         duplicate_threshold: float = 0.95, n_lists: int = None, rebuild: bool = False) -> None:
+    """
+    Main function to build (or load) the ANN index over the review embeddings, report recall and latency
+    against brute force, and save the top-k similar reviews and the near-duplicate pairs.
+    """
+
+    if not EmbeddingStore.exists(store_dir):
+        raise FileNotFoundError(f"The embedding store '{store_dir}' does not exist.")
+
+    with measure('index'):
+        index = load_or_build_index(store_dir, index_dir, n_lists, rebuild)
+
+    with measure('recall'):
+        recall = pd.DataFrame(evaluate_recall(index, k))
+    print(recall.to_string(index=False))
+    recall.to_csv(recall_csv, index=False)
+
+    with measure('similar', rows=index.row_ids.shape[0]):
+        similar_reviews_frame(index, index.row_ids, k, n_probe).to_csv(similar_csv, index=False)
+
+    with measure('near_duplicates', rows=index.row_ids.shape[0]):
+        pairs = index.near_duplicates(duplicate_threshold)
+    pd.DataFrame(pairs, columns=['Review_Id_A', 'Review_Id_B', 'Similarity']).to_csv(duplicates_csv, index=False)
+    print(f'Found {len(pairs)} near-duplicate pairs with similarity >= {duplicate_threshold}')
+
+
+if __name__ == '__main__':
+    store_dir = './output/embedding_analysis/store/review_embeddings'
+    index_dir = './output/similarity_search/index/review_embeddings_ivf'
+    similar_csv = './output/similarity_search/csv/similar_reviews_top10.csv'
+    duplicates_csv = './output/similarity_search/csv/near_duplicate_reviews.csv'
+    recall_csv = './output/similarity_search/csv/ivf_recall.csv'
+    k = 10
+    n_probe = 16
+
+    with instrumented_run('search_reviews'):
+        main(store_dir, index_dir, similar_csv, duplicates_csv, recall_csv, k, n_probe)
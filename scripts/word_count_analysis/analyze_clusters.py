@@ -1,54 +1,122 @@
 import os
 import sys
-from collections import Counter
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
 
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-import seaborn as sns
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import CountVectorizer
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import instrumented_run, measure
+from common.reviews import REVIEW_ID_COLUMN
+from common.table_io import read_table
+from sentiment_analysis.score_sentiment import SCORER_COLUMN, attach_sentiments, score_texts
 
-def calculate_sentiment(text: str, analyzer: SentimentIntensityAnalyzer) -> float:
+
+def build_document_term_matrix(texts: pd.Series) -> tuple:
+    """
+    Build a sparse document-term count matrix from whitespace-tokenized preprocessed texts.
+    Returns (matrix of shape (n_reviews, n_terms), vocabulary array).
+    """
+
+    vectorizer = CountVectorizer(token_pattern=r'\S+', lowercase=False)
+    matrix = vectorizer.fit_transform(texts.fillna('').astype(str).to_numpy())
+
+    return matrix.tocsr(), vectorizer.get_feature_names_out()
+
+
+def cluster_term_counts(matrix: csr_matrix, labels: np.ndarray) -> tuple:
+    """
+    Aggregate document term counts per cluster with one sparse product of a
+    cluster-indicator matrix and the document-term matrix.
+    Returns (sorted cluster labels, dense counts of shape (n_clusters, n_terms)).
+    """
+
+    clusters, cluster_index = np.unique(labels, return_inverse=True)
+    indicator = csr_matrix((np.ones(labels.shape[0], dtype=np.int64), (cluster_index, np.arange(labels.shape[0]))),
+                           shape=(clusters.shape[0], labels.shape[0]))
+
+    return clusters, (indicator @ matrix).toarray()
+
+
+def top_k_terms(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Column indices of the k highest scores in each row, best first, using a partial sort.
+    """
+
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+
+    return np.take_along_axis(top, order, axis=1)
+
+
+def class_tfidf(counts: np.ndarray) -> np.ndarray:
+    """
+    c-TF-IDF: term frequency normalized per cluster, weighted by log(1 + A / f_t), where A is
+    the average number of words per cluster and f_t the term's frequency across all clusters.
+    Terms that are frequent in one cluster but rare overall score highest.
     """
-    Calculate sentiment polarity of a given text string using Vader.
+
+    words_per_cluster = counts.sum(axis=1, keepdims=True)
+    tf = counts / np.maximum(words_per_cluster, 1)
+    idf = np.log(1 + words_per_cluster.mean() / np.maximum(counts.sum(axis=0), 1))
+
+    return tf * idf
+
+
+def top_terms_frame(clusters: np.ndarray, scores: np.ndarray, vocabulary: np.ndarray, top_k: int) -> pd.DataFrame:
+    """
+    Arrange each cluster's top-k term scores as a terms x clusters DataFrame, with 0 for terms
+    outside a cluster's top k.
     """
 
-    # TextBlob
-    # return TextBlob(text).sentiment.polarity
+    top = top_k_terms(scores, top_k)
+    data = {}
+    for row, cluster in enumerate(clusters):
+        terms = top[row][scores[row, top[row]] > 0]
+        data[f'Cluster {cluster}'] = pd.Series(scores[row, terms], index=vocabulary[terms])
 
-    # Vader
-    sentiment_scores = analyzer.polarity_scores(text)
-    return sentiment_scores['compound']
+    df = pd.DataFrame(data)
+    df.fillna(0, inplace=True)
 
+    return df
 
-def calculate_word_counts(df: pd.DataFrame) -> pd.DataFrame:
+
+def calculate_word_counts(df: pd.DataFrame, top_k: int = 10) -> pd.DataFrame:
     """
-    Calculate word counts for each cluster.
+    Calculate counts of the most common words for each cluster.
     """
 
-    word_count_data = {}
+    matrix, vocabulary = build_document_term_matrix(df['Preprocessed_Review_Text'])
+    clusters, counts = cluster_term_counts(matrix, df['Cluster'].to_numpy())
+
+    return top_terms_frame(clusters, counts, vocabulary, top_k)
+
 
-    for cluster in sorted(df['Cluster'].unique()):
-        all_reviews_in_cluster = [word for review in df[df['Cluster'] == cluster]['Preprocessed_Review_Text'] for word in review]
-        word_counter_in_cluster = Counter(all_reviews_in_cluster)
-        most_common_words = [word for word, _ in word_counter_in_cluster.most_common(10)]
-        word_count_data[f'Cluster {cluster}'] = pd.Series(word_counter_in_cluster, index=most_common_words)
+def calculate_distinctive_terms(df: pd.DataFrame, top_k: int = 10) -> pd.DataFrame:
+    """
+    Calculate c-TF-IDF scores of the most distinctive words for each cluster.
+    """
 
-    word_count_df = pd.DataFrame(word_count_data)
-    word_count_df.fillna(0, inplace=True)
+    matrix, vocabulary = build_document_term_matrix(df['Preprocessed_Review_Text'])
+    clusters, counts = cluster_term_counts(matrix, df['Cluster'].to_numpy())
 
-    return word_count_df
+    return top_terms_frame(clusters, class_tfidf(counts), vocabulary, top_k)
 
 
-def plot_word_count_heatmap(df: pd.DataFrame, output_png: str) -> None:
+def plot_word_count_heatmap(df: pd.DataFrame, output_png: str, title: str = 'Word Count Heatmap') -> None:
     """
     Plot word count heatmap.
     """
 
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     plt.figure(figsize=(10, 18))
     sns.heatmap(df, cmap='viridis')
-    plt.title('Word Count Heatmap')
+    plt.title(title)
     plt.savefig(output_png, dpi=300, bbox_inches='tight')
     plt.close()
 
@@ -58,21 +126,47 @@ def plot_sentiment_boxplot(df: pd.DataFrame, output_png: str) -> None:
     Plot sentiment boxplot.
     """
 
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     plt.figure(figsize=(10, 8))
     sns.boxplot(x='Cluster', y='Sentiment', data=df)
-    plt.title('Sentiment Boxplot per Cluster')
+    scorer = f' ({df[SCORER_COLUMN].iloc[0]})' if SCORER_COLUMN in df.columns and not df.empty else ''
+    plt.title(f'Sentiment Boxplot per Cluster{scorer}')
     plt.xlabel('Cluster')
     plt.ylabel('Sentiment')
     plt.savefig(output_png, dpi=300, bbox_inches='tight')
     plt.close()
 
 
-def main(input_csv: str, heatmap_output_png: str, sentiment_output_png: str, overwrite: bool = False) -> None:
+def render_plots(plots: list) -> None:
+    """
+    Render independent plots, given as (function, arguments) pairs, each in its own process.
+    pyplot keeps global state, so processes rather than threads. On a single CPU they are rendered in turn.
+    """
+
+    if len(plots) < 2 or (os.cpu_count() or 1) < 2:
+        for function, arguments in plots:
+            function(*arguments)
+        return
+
+    with ProcessPoolExecutor(max_workers=len(plots)) as executor:
+        for future in [executor.submit(function, *arguments) for function, arguments in plots]:
+            future.result()
+
+
+def main(input_csv: str, heatmap_output_png: str, sentiment_output_png: str, overwrite: bool = False, scoring: str = 'count',
+         sentiment_csv: str = None) -> None:
     """
-    Main function to load data, preprocess 'Review_Text' column, calculate sentiment,
-    count word occurrences, and plot a word count heatmap and a sentiment box plot.
+    Main function to load data, attach stored sentiment scores (or score the preprocessed text
+    with VADER when no sentiment file is given or it does not exist yet), count word occurrences, and plot a word count
+    heatmap and a sentiment box plot, rendered in parallel.
+    With scoring='ctfidf' the heatmap shows c-TF-IDF scores of each cluster's most distinctive words.
     """
 
+    if scoring not in ('count', 'ctfidf'):
+        raise ValueError(f'Unknown scoring {scoring}. Please choose "count" or "ctfidf".')
+
     if not os.path.exists(input_csv):
         raise FileNotFoundError(f"The input file '{input_csv}' does not exist.")
 
@@ -88,14 +182,27 @@ def main(input_csv: str, heatmap_output_png: str, sentiment_output_png: str, ove
         if should_proceed.lower() != 'y':
             sys.exit(f"Execution stopped. The output file '{sentiment_output_png}' already exists.")
 
-    df = pd.read_csv(input_csv)
+    if sentiment_csv is not None and not os.path.exists(sentiment_csv):
+        print(f"The sentiment file '{sentiment_csv}' does not exist; scoring the preprocessed text with VADER instead.")
+        sentiment_csv = None
+
+    df = read_table(input_csv, [REVIEW_ID_COLUMN, 'Cluster', 'Preprocessed_Review_Text'])
 
-    vader_analyzer = SentimentIntensityAnalyzer()
-    df['Sentiment'] = df['Preprocessed_Review_Text'].apply(lambda text: calculate_sentiment(text, vader_analyzer))
+    with measure('sentiment', rows=df.shape[0]):
+        if sentiment_csv is not None:
+            df = attach_sentiments(df, sentiment_csv)
+        else:
+            df['Sentiment'] = score_texts(df['Preprocessed_Review_Text'].to_list(), 'VADER')['Sentiment'].to_numpy()
 
-    word_count_df = calculate_word_counts(df)
-    plot_word_count_heatmap(word_count_df, heatmap_output_png)
-    plot_sentiment_boxplot(df, sentiment_output_png)
+    with measure('word_counts', rows=df.shape[0]):
+        if scoring == 'ctfidf':
+            terms, title = calculate_distinctive_terms(df), 'Distinctive Term (c-TF-IDF) Heatmap'
+        else:
+            terms, title = calculate_word_counts(df), 'Word Count Heatmap'
+    with measure('plot'):
+        sentiments = df[[column for column in ('Cluster', 'Sentiment', SCORER_COLUMN) if column in df.columns]]
+        render_plots([(plot_word_count_heatmap, (terms, heatmap_output_png, title)),
+                      (plot_sentiment_boxplot, (sentiments, sentiment_output_png))])
 
 
 if __name__ == '__main__':
@@ -103,6 +210,8 @@ if __name__ == '__main__':
     input_csv = './output/embedding_analysis/csv/preprocessed_review_embeddings_with_20_clusters_50_pca.csv'
     heatmap_output_png = './output/embedding_analysis/png/word_count_heatmap_preprocessed_review_embeddings_with_20_clusters_50_pca.png'
     sentiment_output_png = './output/embedding_analysis/png/sentiment_boxplot_preprocessed_review_embeddings_with_20_clusters_50_pca.png'
+    sentiment_csv = './output/sentiment_analysis/csv/review_sentiment_VADER.csv'  # Written by score_sentiment
     overwrite = False
 
-    main(input_csv, heatmap_output_png, sentiment_output_png, overwrite)
+    with instrumented_run('analyze_clusters'):
+        main(input_csv, heatmap_output_png, sentiment_output_png, overwrite, sentiment_csv=sentiment_csv)
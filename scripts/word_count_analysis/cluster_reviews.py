@@ -6,50 +6,129 @@ from scipy.sparse import csr_matrix
 from sklearn.cluster import KMeans
 from sklearn.feature_extraction.text import TfidfVectorizer
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import instrumented_run, measure
+from common.reviews import REVIEW_ID_COLUMN, review_ids
+from common.table_io import append_columns, read_table, same_table, table_columns, write_table
+from word_count_analysis.model_artifacts import ClusterModel, save_artifacts
+from word_count_analysis.streaming_clustering import cluster_streaming
 
-def tfidf_clustering(tfidf_matrix: csr_matrix, num_clusters: int) -> pd.array:
-    """
-    Perform K-means clustering on a given TF-IDF matrix with a specific number of clusters.
 
-    TF-IDF (Term Frequency and Inverse Document Frequency) uses the relative frequency of words
-    to determine how relevant those words are to a given document.
+def fit_kmeans(tfidf_matrix: csr_matrix, num_clusters: int) -> KMeans:
+    """
+    Fit K-means on a given TF-IDF matrix with a specific number of clusters.
     """
 
     kmeans = KMeans(n_clusters=num_clusters, random_state=0, n_init='auto')
     kmeans.fit(tfidf_matrix)
 
-    return kmeans.predict(tfidf_matrix)
+    return kmeans
 
 
-def main(input_csv: str, num_clusters: int, output_csv: str, overwrite: bool = False) -> None:
+def tfidf_clustering(tfidf_matrix: csr_matrix, num_clusters: int) -> pd.array:
     """
-    Main function to load preprocessed data, vectorize the 'Review_Text' column,
-    perform K-means clustering, assign clusters to the original data, and save the updated data.
+    Perform K-means clustering on a given TF-IDF matrix with a specific number of clusters.
+
+    TF-IDF (Term Frequency and Inverse Document Frequency) uses the relative frequency of words
+    to determine how relevant those words are to a given document.
     """
 
+    return fit_kmeans(tfidf_matrix, num_clusters).labels_
+
+
+def check_paths(input_csv: str, output_csv: str, overwrite: bool) -> None:
     if not os.path.exists(input_csv):
         raise FileNotFoundError(f"The input file '{input_csv}' does not exist.")
 
-    if os.path.exists(output_csv) and not overwrite:
+    exists = 'Cluster' in table_columns(output_csv) if same_table(input_csv, output_csv) else os.path.exists(output_csv)
+    if exists and not overwrite:
         should_proceed = input(f"The output file '{output_csv}' already exists. Do you want to overwrite it? (y/n): ")
         if should_proceed.lower() != 'y':
             sys.exit(f"Execution stopped. The output file '{output_csv}' already exists.")
 
-    df = pd.read_csv(input_csv)
 
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(df['Review_Text'].values.astype('U'))
-    cluster_assignments = tfidf_clustering(tfidf_matrix, num_clusters)
+def assign(input_csv: str, output_csv: str, models_dir: str, version: int = None, overwrite: bool = False) -> None:
+    """
+    Assign clusters to new reviews with a saved model: transform and predict only, no refit.
+    """
+
+    check_paths(input_csv, output_csv, overwrite)
+
+    model = ClusterModel.load(models_dir, version)
+    df = read_table(input_csv, [model.text_column])
+    labels = model.assign(df[model.text_column].values)
+    print(f"Assigned {df.shape[0]} reviews with model version {model.meta['version']}")
 
-    df['Cluster'] = cluster_assignments
+    write_clusters(input_csv, output_csv, labels)
+
+
+def write_clusters(input_csv: str, output_csv: str, labels) -> None:
+    """
+    Save the cluster labels. When the output is the input's own column-group table, the Cluster column
+    is appended to it and nothing else is rewritten; otherwise the reviews are written out with their
+    cluster, sorted by cluster.
+    """
+
+    if same_table(input_csv, output_csv):
+        append_columns(output_csv, pd.DataFrame({'Cluster': labels}))
+        return
+
+    df = read_table(input_csv)
+    df['Cluster'] = labels
     df = df.sort_values(by='Cluster')
-    df.to_csv(output_csv, index=False)
+    write_table(df, output_csv)
+
+
+def main(input_csv: str, num_clusters: int, output_csv: str, overwrite: bool = False, text_column: str = 'Preprocessed_Review_Text',
+         models_dir: str = None, streaming: bool = False, batch_size: int = 20_000) -> None:
+    """
+    Main function to load preprocessed data, vectorize the text column (the same
+    'Preprocessed_Review_Text' column generate_elbow uses), perform K-means clustering,
+    assign clusters to the original data, and save the updated data (only the Cluster column is read and
+    appended when input and output are the same column-group table). With a models_dir,
+    the fitted vocabulary, IDF weights, TF-IDF matrix and centroids are saved as a new
+    model version for later assign runs.
+
+    With streaming, the reviews are read in batches and clustered with hashed TF-IDF and mini-batch
+    K-means (see streaming_clustering), so memory stays bounded for corpora larger than RAM.
+    """
+
+    check_paths(input_csv, output_csv, overwrite)
+
+    if streaming:
+        if models_dir is not None:
+            raise ValueError('Model artifacts are only saved by the in-memory path; run without models_dir when streaming.')
+        inertia = cluster_streaming(input_csv, num_clusters, output_csv, text_column, batch_size)
+        print(f'Streaming K-means inertia: {inertia:.1f}')
+        return
+
+    df = read_table(input_csv, [text_column, REVIEW_ID_COLUMN])
+
+    with measure('vectorize', rows=df.shape[0]):
+        vectorizer = TfidfVectorizer()
+        tfidf_matrix = vectorizer.fit_transform(df[text_column].values.astype('U'))
+    with measure('kmeans', rows=df.shape[0]):
+        kmeans = fit_kmeans(tfidf_matrix, num_clusters)
+
+    if models_dir is not None:
+        with measure('save_artifacts'):
+            version_dir = save_artifacts(models_dir, vectorizer, tfidf_matrix, kmeans, review_ids(df), text_column)
+        print(f'Saved model artifacts to {version_dir}')
+
+    with measure('write', rows=df.shape[0]):
+        write_clusters(input_csv, output_csv, kmeans.labels_)
 
 
 if __name__ == '__main__':
     input_csv = './output/word_count_analysis/csv/preprocessed_reviews.csv'
     num_clusters = 9
     output_csv = f'./output/word_count_analysis/csv/reviews_with_{num_clusters}_clusters.csv'
+    models_dir = f'./output/word_count_analysis/models/tfidf_kmeans_{num_clusters}_clusters'
     overwrite = False
 
-    main(input_csv, num_clusters, output_csv, overwrite)
+    with instrumented_run('cluster_reviews'):
+        main(input_csv, num_clusters, output_csv, overwrite, models_dir=models_dir)
+
+    # Assign new reviews against the latest saved model without refitting:
+    # assign('./output/word_count_analysis/csv/new_preprocessed_reviews.csv',
+    #        f'./output/word_count_analysis/csv/new_reviews_with_{num_clusters}_clusters.csv', models_dir)
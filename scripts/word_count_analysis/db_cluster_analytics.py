@@ -0,0 +1,294 @@
+import os
+import sys
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import add_rows, instrumented_run, measure
+from word_count_analysis.analyze_clusters import class_tfidf, plot_word_count_heatmap, render_plots, top_terms_frame
+
+SUMMARY_CACHE_SIZE = 32
+QUANTILES = (0.25, 0.5, 0.75)
+WHISKER_IQR = 1.5  # Whiskers reach the furthest sentiment within 1.5 IQR of the box, as in seaborn's boxplot
+FETCH_SIZE = 10_000
+
+# Column names as anon_embedding_csv_to_postgres loads them: lowercased, spaces replaced by underscores.
+CLUSTER_COLUMN = 'cluster'
+SENTIMENT_COLUMN = 'sentiment'
+TEXT_COLUMN = 'preprocessed_review_text'
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def fetch_frame(connection, query: str, params: dict = None, columns: list = None) -> pd.DataFrame:
+    """
+    Run a query with a server-side cursor (a named cursor on PostgreSQL) and collect the result in batches of FETCH_SIZE rows.
+    """
+
+    result = connection.execution_options(stream_results=True).execute(text(query), params or {})
+    columns = columns or list(result.keys())
+    frames = [pd.DataFrame(rows, columns=columns) for rows in result.partitions(FETCH_SIZE)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def check_columns(engine, table_name: str) -> None:
+    """
+    Raise a ValueError naming the columns the aggregates need that the table lacks. The loader only writes
+    them when given the cluster and sentiment outputs as annotation tables.
+    """
+
+    columns = {column['name'] for column in inspect(engine).get_columns(table_name)}
+    missing = [column for column in (CLUSTER_COLUMN, SENTIMENT_COLUMN, TEXT_COLUMN) if column not in columns]
+    if missing:
+        raise ValueError(f"The table '{table_name}' has no {', '.join(missing)} column(s). Load it with "
+                         f"anon_embedding_csv_to_postgres and the cluster_reviews and score_sentiment outputs as annotation_tables.")
+
+
+def cluster_counts(connection, table_name: str) -> pd.DataFrame:
+    """
+    Reviews and mean sentiment per cluster.
+    """
+
+    query = f'''
+        SELECT {quote(CLUSTER_COLUMN)} AS cluster, COUNT(*) AS reviews, AVG({quote(SENTIMENT_COLUMN)}) AS mean_sentiment
+        FROM {quote(table_name)}
+        WHERE {quote(CLUSTER_COLUMN)} IS NOT NULL
+        GROUP BY {quote(CLUSTER_COLUMN)}
+        ORDER BY {quote(CLUSTER_COLUMN)}
+    '''
+    return fetch_frame(connection, query).set_index('cluster')
+
+
+def sentiment_quantiles(connection, table_name: str, quantiles: tuple = QUANTILES) -> pd.DataFrame:
+    """
+    Sentiment quantiles per cluster, linearly interpolated like numpy.quantile and percentile_cont.
+
+    PostgreSQL computes them with percentile_cont. Other databases (SQLite) rank the sentiments per cluster
+    with window functions and return only the rows on either side of each quantile position, which are
+    interpolated here. Returns one row per cluster, one column per quantile.
+    """
+
+    cluster, sentiment = quote(CLUSTER_COLUMN), quote(SENTIMENT_COLUMN)
+    where = f'{cluster} IS NOT NULL AND {sentiment} IS NOT NULL'
+
+    if connection.dialect.name == 'postgresql':
+        percentiles = ', '.join(f'percentile_cont({q}) WITHIN GROUP (ORDER BY {sentiment}) AS q{i}' for i, q in enumerate(quantiles))
+        query = f'SELECT {cluster} AS cluster, {percentiles} FROM {quote(table_name)} WHERE {where} GROUP BY {cluster}'
+        df = fetch_frame(connection, query).set_index('cluster').sort_index()
+        df.columns = list(quantiles)
+        return df.astype(float)
+
+    positions = ' OR '.join(f'position = CAST(:q{i} * (n - 1) AS INTEGER) OR position = CAST(:q{i} * (n - 1) AS INTEGER) + 1'
+                            for i in range(len(quantiles)))
+    query = f'''
+        WITH ranked AS (
+            SELECT {cluster} AS cluster, {sentiment} AS value,
+                   ROW_NUMBER() OVER (PARTITION BY {cluster} ORDER BY {sentiment}) - 1 AS position,
+                   COUNT(*) OVER (PARTITION BY {cluster}) AS n
+            FROM {quote(table_name)}
+            WHERE {where}
+        )
+        SELECT cluster, position, n, value FROM ranked WHERE {positions}
+    '''
+    rows = fetch_frame(connection, query, {f'q{i}': q for i, q in enumerate(quantiles)})
+
+    results = {}
+    for cluster_label, group in rows.groupby('cluster'):
+        values = dict(zip(group['position'].astype(int), group['value'].astype(float)))
+        n = int(group['n'].iloc[0])
+        row = []
+        for q in quantiles:
+            position = q * (n - 1)
+            low = int(position)
+            upper = values.get(low + 1, values[low])
+            row.append(values[low] + (position - low) * (upper - values[low]))
+        results[cluster_label] = row
+    return pd.DataFrame.from_dict(results, orient='index', columns=list(quantiles)).sort_index()
+
+
+def whisker_stats(connection, table_name: str, quartiles: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per cluster, the furthest sentiments within WHISKER_IQR times the interquartile range of the box, and the
+    number of outliers beyond them. The bounds are sent as a VALUES list, so only one row per cluster comes back.
+    """
+
+    if quartiles.empty:
+        return pd.DataFrame(columns=['whislo', 'whishi', 'outliers'])
+
+    iqr = quartiles[0.75] - quartiles[0.25]
+    bounds = pd.DataFrame({'low': quartiles[0.25] - WHISKER_IQR * iqr, 'high': quartiles[0.75] + WHISKER_IQR * iqr})
+    values, params = [], {}
+    for i, (cluster_label, row) in enumerate(bounds.iterrows()):
+        values.append(f'(:c{i}, :l{i}, :h{i})')
+        params.update({f'c{i}': cluster_label.item() if hasattr(cluster_label, 'item') else cluster_label,
+                       f'l{i}': float(row['low']), f'h{i}': float(row['high'])})
+
+    cluster, sentiment = quote(CLUSTER_COLUMN), quote(SENTIMENT_COLUMN)
+    query = f'''
+        WITH bounds(cluster, low, high) AS (VALUES {', '.join(values)})
+        SELECT bounds.cluster AS cluster,
+               MIN(CASE WHEN {sentiment} >= bounds.low THEN {sentiment} END) AS whislo,
+               MAX(CASE WHEN {sentiment} <= bounds.high THEN {sentiment} END) AS whishi,
+               SUM(CASE WHEN {sentiment} < bounds.low OR {sentiment} > bounds.high THEN 1 ELSE 0 END) AS outliers
+        FROM {quote(table_name)} JOIN bounds ON {quote(table_name)}.{cluster} = bounds.cluster
+        WHERE {sentiment} IS NOT NULL
+        GROUP BY bounds.cluster
+    '''
+    return fetch_frame(connection, query, params).set_index('cluster').sort_index()
+
+
+def term_counts(connection, table_name: str, top_k: int = None) -> pd.DataFrame:
+    """
+    (cluster, term, count) of the whitespace-separated terms of the preprocessed text, counted in the database:
+    the top_k most frequent terms of each cluster, or every term when top_k is None. PostgreSQL splits the
+    text with regexp_split_to_table; other databases (SQLite) with a recursive CTE.
+    """
+
+    cluster, text_column = quote(CLUSTER_COLUMN), quote(TEXT_COLUMN)
+    where = f'{cluster} IS NOT NULL AND {text_column} IS NOT NULL'
+    if connection.dialect.name == 'postgresql':
+        terms = f'''WITH terms AS (
+            SELECT {cluster} AS cluster, regexp_split_to_table({text_column}, '\\s+') AS term FROM {quote(table_name)} WHERE {where}
+        )'''
+    else:
+        terms = f'''WITH RECURSIVE split(cluster, term, rest) AS (
+            SELECT {cluster}, '', {text_column} || ' ' FROM {quote(table_name)} WHERE {where}
+            UNION ALL
+            SELECT cluster, substr(rest, 1, instr(rest, ' ') - 1), substr(rest, instr(rest, ' ') + 1) FROM split WHERE rest <> ''
+        ), terms AS (
+            SELECT cluster, term FROM split
+        )'''
+
+    query = f'''
+        {terms}, counts AS (
+            SELECT cluster, term, COUNT(*) AS count FROM terms WHERE term <> '' GROUP BY cluster, term
+        ), ranked AS (
+            SELECT cluster, term, count, ROW_NUMBER() OVER (PARTITION BY cluster ORDER BY count DESC, term) AS rank FROM counts
+        )
+        SELECT cluster, term, count FROM ranked {'WHERE rank <= :top_k' if top_k is not None else ''} ORDER BY cluster, rank
+    '''
+    return fetch_frame(connection, query, {'top_k': top_k} if top_k is not None else None, ['cluster', 'term', 'count'])
+
+
+def terms_frame(counts: pd.DataFrame, scoring: str = 'count', top_k: int = 10) -> pd.DataFrame:
+    """
+    Arrange aggregated term counts as the terms x clusters DataFrame of analyze_clusters, with raw counts
+    of each cluster's top terms or, with scoring='ctfidf', c-TF-IDF scores computed from all term counts.
+    """
+
+    counts = counts.assign(count=counts['count'].astype(np.int64))
+    if scoring == 'ctfidf':
+        matrix = counts.pivot_table(index='cluster', columns='term', values='count', fill_value=0).sort_index()
+        return top_terms_frame(matrix.index.to_numpy(), class_tfidf(matrix.to_numpy(dtype=np.float64)), matrix.columns.to_numpy(), top_k)
+
+    data = {f'Cluster {cluster}': group.set_index('term')['count'] for cluster, group in counts.groupby('cluster', sort=True)}
+    return pd.DataFrame(data).fillna(0)
+
+
+def cluster_summary(engine, table_name: str, scoring: str = 'count', top_k: int = 10) -> dict:
+    """
+    Everything the cluster plots need, aggregated in the database: 'clusters' (reviews and mean sentiment per
+    cluster), 'boxplot' (quartiles, whiskers and outlier counts per cluster) and 'terms' (terms x clusters).
+    Only these per-cluster results are transferred, however many reviews the table holds.
+    """
+
+    if scoring not in ('count', 'ctfidf'):
+        raise ValueError(f'Unknown scoring {scoring}. Please choose "count" or "ctfidf".')
+    check_columns(engine, table_name)
+
+    with engine.connect() as connection:
+        with measure('counts'):
+            clusters = cluster_counts(connection, table_name)
+        with measure('quantiles'):
+            quartiles = sentiment_quantiles(connection, table_name)
+            boxplot = quartiles.join(whisker_stats(connection, table_name, quartiles))
+        with measure('terms'):
+            counts = term_counts(connection, table_name, top_k if scoring == 'count' else None)
+            add_rows(counts.shape[0])
+    return {'clusters': clusters, 'boxplot': boxplot, 'terms': terms_frame(counts, scoring, top_k)}
+
+
+@lru_cache(maxsize=None)
+def database_engine(database_url: str = None):
+    """
+    One engine per database URL. Without a URL, PostgreSQL with the loader's credentials from .env.
+    """
+
+    if database_url is None:
+        from database.anon_embedding_csv_to_postgres import create_sqlalchemy_engine, load_env_vars
+        return create_sqlalchemy_engine(load_env_vars())
+    return create_engine(database_url)
+
+
+@lru_cache(maxsize=SUMMARY_CACHE_SIZE)
+def cached_summary(database_url: str, table_name: str, run_id: str, scoring: str = 'count', top_k: int = 10) -> dict:
+    """
+    cluster_summary memoized in process by cluster run id, so repeated plots of the same clustering do not
+    query the database again. A new clustering needs a new run id; the cached frames must not be modified.
+    """
+
+    return cluster_summary(database_engine(database_url), table_name, scoring, top_k)
+
+
+def plot_sentiment_boxplot_stats(boxplot: pd.DataFrame, output_png: str, title: str = 'Sentiment Boxplot per Cluster') -> None:
+    """
+    Plot sentiment boxplots from precomputed per-cluster statistics. Outliers are counted, not drawn.
+    """
+
+    import matplotlib.pyplot as plt
+
+    stats = [{'label': str(cluster), 'q1': row[0.25], 'med': row[0.5], 'q3': row[0.75], 'whislo': row['whislo'],
+              'whishi': row['whishi'], 'fliers': []} for cluster, row in boxplot.iterrows()]
+    fig, ax = plt.subplots(figsize=(10, 8))
+    ax.bxp(stats, showfliers=False)
+    ax.set_title(title)
+    ax.set_xlabel('Cluster')
+    ax.set_ylabel('Sentiment')
+    fig.savefig(output_png, dpi=300, bbox_inches='tight')
+    plt.close(fig)
+
+
+def main(database_url: str, table_name: str, heatmap_output_png: str, sentiment_output_png: str, overwrite: bool = False,
+         scoring: str = 'count', run_id: str = None) -> None:
+    """
+    Main function to aggregate the cluster sizes, sentiment distributions and top terms of a loaded review
+    table in the database and plot the word count heatmap and sentiment boxplot from the aggregates.
+    The table needs cluster, sentiment and preprocessed_review_text columns, which the loader writes when
+    given the cluster and sentiment outputs as annotation tables. Without a database URL, the
+    PostgreSQL credentials of the loader are used. With a run id, the summary is cached for later calls.
+    """
+
+    for output_png in (heatmap_output_png, sentiment_output_png):
+        if os.path.exists(output_png) and not overwrite:
+            should_proceed = input(f"The output file '{output_png}' already exists. Do you want to overwrite it? (y/n): ")
+            if should_proceed.lower() != 'y':
+                sys.exit(f"Execution stopped. The output file '{output_png}' already exists.")
+
+    if run_id is None:
+        summary = cluster_summary(database_engine(database_url), table_name, scoring)
+    else:
+        summary = cached_summary(database_url, table_name, run_id, scoring)
+    print(summary['clusters'].to_string())
+    print(f"{int(summary['boxplot']['outliers'].sum())} sentiment outliers beyond the whiskers")
+
+    title = 'Distinctive Term (c-TF-IDF) Heatmap' if scoring == 'ctfidf' else 'Word Count Heatmap'
+    with measure('plot'):
+        render_plots([(plot_word_count_heatmap, (summary['terms'], heatmap_output_png, title)),
+                      (plot_sentiment_boxplot_stats, (summary['boxplot'], sentiment_output_png))])
+
+
+if __name__ == '__main__':
+    database_url = None  # e.g. 'sqlite:///./output/reviews.sqlite'; None for the PostgreSQL credentials in .env
+    table_name = 'reviews'
+    heatmap_output_png = './output/word_count_analysis/png/word_count_heatmap_reviews_table.png'
+    sentiment_output_png = './output/word_count_analysis/png/sentiment_boxplot_reviews_table.png'
+    run_id = 'tfidf_kmeans_9_clusters/v1'  # Cluster run the table's cluster column comes from
+    overwrite = False
+
+    with instrumented_run('db_cluster_analytics'):
+        main(database_url, table_name, heatmap_output_png, sentiment_output_png, overwrite, run_id=run_id)
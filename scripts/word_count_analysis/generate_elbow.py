@@ -1,25 +1,24 @@
 import os
 import sys
 
-import matplotlib.pyplot as plt
-import pandas as pd
 from scipy.sparse import csr_matrix
-from sklearn.cluster import KMeans
 from sklearn.feature_extraction.text import TfidfVectorizer
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import instrumented_run, measure
+from common.table_io import read_table
+from word_count_analysis.k_sweep import sweep_k
+from word_count_analysis.streaming_clustering import sweep_streaming
 
-def calculate_inertia(tfidf_matrix: csr_matrix, cluster_counts: range) -> list:
+
+def calculate_inertia(tfidf_matrix: csr_matrix, cluster_counts: range, **sweep_options) -> list:
     """
     Calculate inertia for various number of cluster centers.
+    Extra keyword arguments are passed to k_sweep.sweep_k (method, warm_start, workers, cache_dir, ...).
     """
 
-    inertias = []
-    for count in cluster_counts:
-        kmeans = KMeans(n_clusters=count, random_state=0, n_init='auto')
-        kmeans.fit(tfidf_matrix)
-        inertias.append(kmeans.inertia_)
-
-    return inertias
+    results = sweep_k(tfidf_matrix, cluster_counts, metrics=(), **sweep_options)
+    return results.set_index('k').loc[list(cluster_counts), 'inertia'].to_list()
 
 
 def plot_elbow_curve(cluster_counts: range, inertias: list, output_png: str) -> None:
@@ -27,6 +26,8 @@ def plot_elbow_curve(cluster_counts: range, inertias: list, output_png: str) ->
     Plot the elbow curve indicating the optimal number of clusters.
     """
 
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(6, 6))
     plt.plot(cluster_counts, inertias, 'bo-')
     plt.xlabel('Number of Clusters')
@@ -35,10 +36,14 @@ def plot_elbow_curve(cluster_counts: range, inertias: list, output_png: str) ->
     plt.savefig(output_png, dpi=300, bbox_inches='tight')
 
 
-def main(input_csv: str, cluster_counts: range, output_png: str, overwrite: bool = False) -> None:
+def main(input_csv: str, cluster_counts: range, output_png: str, overwrite: bool = False, method: str = 'kmeans',
+         warm_start: bool = False, workers: int = None, metrics: tuple = ('silhouette', 'davies_bouldin'),
+         sample_size: int = 5000, cache_dir: str = None, streaming: bool = False) -> None:
     """
-    Main function to load preprocessed data, vectorize the 'Review_Text' column,
-    perform elbow analysis and plot the resulting curve.
+    Main function to load preprocessed data, vectorize the 'Preprocessed_Review_Text' column,
+    sweep the cluster counts, plot the elbow curve and save the per-K results next to the plot.
+    With streaming, the reviews are read in batches with hashed TF-IDF and mini-batch K-means instead
+    (inertia only), for corpora that do not fit in memory.
     """
 
     if not os.path.exists(input_csv):
@@ -49,20 +54,33 @@ def main(input_csv: str, cluster_counts: range, output_png: str, overwrite: bool
         if should_proceed.lower() != 'y':
             sys.exit(f"Execution stopped. The output file '{output_png}' already exists.")
 
-    df = pd.read_csv(input_csv)
+    if streaming:
+        with measure('sweep'):
+            results = sweep_streaming(input_csv, cluster_counts)
+    else:
+        df = read_table(input_csv, ['Preprocessed_Review_Text'])
+
+        with measure('vectorize', rows=df.shape[0]):
+            vectorizer = TfidfVectorizer()
 
-    vectorizer = TfidfVectorizer()
+            tfidf_matrix = vectorizer.fit_transform(df['Preprocessed_Review_Text'].values.astype('U'))
 
-    tfidf_matrix = vectorizer.fit_transform(df['Preprocessed_Review_Text'].values.astype('U'))
+        with measure('sweep', rows=df.shape[0]):
+            results = sweep_k(tfidf_matrix, cluster_counts, method=method, warm_start=warm_start, workers=workers,
+                              metrics=metrics, sample_size=sample_size, cache_dir=cache_dir)
+    results.to_csv(os.path.splitext(output_png)[0] + '.csv', index=False)
+    print(results.to_string(index=False))
 
-    inertias = calculate_inertia(tfidf_matrix, cluster_counts)
-    plot_elbow_curve(cluster_counts, inertias, output_png)
+    with measure('plot'):
+        plot_elbow_curve(results['k'], results['inertia'], output_png)
 
 
 if __name__ == '__main__':
     input_csv = './output/word_count_analysis/preprocessed_reviews.csv'
     cluster_counts = range(1, 30)
     output_png = './output/word_count_analysis/png/elbow_analysis.png'
+    cache_dir = './output/word_count_analysis/k_sweep_cache'
     overwrite = False
 
-    main(input_csv, cluster_counts, output_png, overwrite)
+    with instrumented_run('generate_elbow'):
+        main(input_csv, cluster_counts, output_png, overwrite, cache_dir=cache_dir)
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+
+METHODS = ('kmeans', 'minibatch')
+METRICS = ('silhouette', 'davies_bouldin')
+
+
+def matrix_fingerprint(matrix: csr_matrix) -> str:
+    """
+    Content hash of a CSR matrix, used to key cached sweep results.
+    """
+
+    digest = hashlib.sha1(str(matrix.shape).encode('utf-8'))
+    for array in (matrix.data, matrix.indices, matrix.indptr):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def save_shared_matrix(matrix: csr_matrix, directory: str) -> None:
+    """
+    Save the CSR components as .npy files that worker processes memory-map instead of receiving a copy.
+    """
+
+    np.save(os.path.join(directory, 'data.npy'), matrix.data)
+    np.save(os.path.join(directory, 'indices.npy'), matrix.indices)
+    np.save(os.path.join(directory, 'indptr.npy'), matrix.indptr)
+    with open(os.path.join(directory, 'shape.json'), 'w') as f:
+        json.dump(list(matrix.shape), f)
+
+
+def load_shared_matrix(directory: str) -> csr_matrix:
+    with open(os.path.join(directory, 'shape.json')) as f:
+        shape = tuple(json.load(f))
+    arrays = [np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in ('data', 'indices', 'indptr')]
+    return csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+
+def make_model(k: int, method: str, init='k-means++', random_state: int = 0, batch_size: int = 4096):
+    n_init = 1 if isinstance(init, np.ndarray) else 'auto'
+    if method == 'minibatch':
+        return MiniBatchKMeans(n_clusters=k, init=init, n_init=n_init, random_state=random_state, batch_size=batch_size)
+    return KMeans(n_clusters=k, init=init, n_init=n_init, random_state=random_state)
+
+
+def davies_bouldin_sparse(matrix: csr_matrix, labels: np.ndarray) -> float:
+    """
+    Davies-Bouldin index computed directly on a sparse matrix, using
+    ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2 so that rows are never densified.
+    """
+
+    clusters, labels = np.unique(labels, return_inverse=True)
+    if clusters.shape[0] < 2:
+        return float('nan')
+
+    indicator = csr_matrix((np.ones(labels.shape[0]), (labels, np.arange(labels.shape[0]))), shape=(clusters.shape[0], labels.shape[0]))
+    sizes = np.asarray(indicator.sum(axis=1)).ravel()
+    centroids = np.asarray((indicator @ matrix).todense()) / sizes[:, None]
+
+    row_norms = np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    dot = np.asarray(matrix.multiply(centroids[labels]).sum(axis=1)).ravel()
+    distances = np.sqrt(np.maximum(row_norms - 2 * dot + centroid_norms[labels], 0))
+    scatter = np.bincount(labels, weights=distances) / sizes
+
+    separation = np.sqrt(np.maximum(centroid_norms[:, None] + centroid_norms[None, :] - 2 * centroids @ centroids.T, 0))
+    np.fill_diagonal(separation, np.inf)
+    ratios = (scatter[:, None] + scatter[None, :]) / separation
+
+    return float(ratios.max(axis=1).mean())
+
+
+def score_labels(matrix: csr_matrix, labels: np.ndarray, sample: np.ndarray, metrics: tuple) -> dict:
+    """
+    Compute the requested cluster quality metrics on a row sample.
+    """
+
+    scores = {}
+    sample_labels = labels[sample]
+    enough_clusters = 1 < np.unique(sample_labels).shape[0] < sample.shape[0]
+    for metric in metrics:
+        if not enough_clusters:
+            scores[metric] = float('nan')
+        elif metric == 'silhouette':
+            scores[metric] = float(silhouette_score(matrix[sample], sample_labels))
+        elif metric == 'davies_bouldin':
+            scores[metric] = davies_bouldin_sparse(matrix[sample], sample_labels)
+    return scores
+
+
+def fit_k(matrix: csr_matrix, k: int, method: str, sample: np.ndarray, metrics: tuple, init='k-means++', random_state: int = 0) -> tuple:
+    """
+    Fit one K and return (result row, fitted centroids). init may be a list of initializations, in which
+    case each is fitted and the model with the lowest inertia is kept; the time covers all of them.
+    """
+
+    start = time.perf_counter()
+    models = [make_model(k, method, candidate, random_state).fit(matrix) for candidate in (init if isinstance(init, list) else [init])]
+    model = min(models, key=lambda candidate: candidate.inertia_)
+    labels = model.labels_
+    seconds = time.perf_counter() - start
+
+    result = {'k': k, 'inertia': float(model.inertia_), 'n_iter': int(model.n_iter_), 'fit_seconds': round(seconds, 3)}
+    result.update(score_labels(matrix, labels, sample, metrics))
+    return result, model.cluster_centers_
+
+
+def _fit_shared(args: tuple) -> dict:
+    directory, k, method, sample, metrics, random_state = args
+    return fit_k(load_shared_matrix(directory), k, method, sample, metrics, random_state=random_state)[0]
+
+
+def next_centroids(matrix: csr_matrix, centroids: np.ndarray, sample: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Seed K centroids from the K-1 fitted ones plus one sampled row drawn with k-means++ D² weighting
+    (probability proportional to the squared distance to its nearest centroid), so the new centroid
+    is likely to land in a poorly covered region rather than on a single outlier.
+    """
+
+    rows = matrix[sample]
+    row_norms = np.asarray(rows.multiply(rows).sum(axis=1)).ravel()
+    squared = row_norms[:, None] - 2 * np.asarray(rows @ centroids.T) + (centroids ** 2).sum(axis=1)[None, :]
+    weights = np.maximum(squared.min(axis=1), 0)
+    seed = int(rng.choice(weights.shape[0], p=weights / weights.sum())) if weights.sum() > 0 else int(rng.integers(weights.shape[0]))
+
+    return np.vstack([centroids, rows[seed].toarray()])
+
+
+class SweepCache:
+    """
+    Per-K sweep results stored as JSON, keyed by the matrix fingerprint and sweep settings,
+    plus the centroids of the largest fitted K for warm-started sweeps.
+    """
+
+    def __init__(self, cache_dir: str, key: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.results_path = os.path.join(cache_dir, f'{key}.json')
+        self.centroids_path = os.path.join(cache_dir, f'{key}_centroids.npy')
+        self.results = {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path) as f:
+                self.results = {int(k): result for k, result in json.load(f).items()}
+
+    def save(self, results: dict, centroids: np.ndarray = None) -> None:
+        self.results.update(results)
+        with open(self.results_path, 'w') as f:
+            json.dump({str(k): result for k, result in sorted(self.results.items())}, f, indent=2)
+        if centroids is not None:
+            np.save(self.centroids_path, centroids)
+
+    def last_centroids(self) -> np.ndarray:
+        return np.load(self.centroids_path) if os.path.exists(self.centroids_path) else None
+
+
+def sweep_k(matrix: csr_matrix, cluster_counts, method: str = 'kmeans', warm_start: bool = False, workers: int = None,
+            metrics: tuple = ('silhouette',), sample_size: int = 5000, cache_dir: str = None, random_state: int = 0) -> pd.DataFrame:
+    """
+    Fit one clustering per K and return a table of inertia, sampled quality metrics and timing per K.
+
+    Cold sweeps spread K values across a process pool that memory-maps one shared copy of the matrix.
+    Warm-started sweeps run K in increasing order, seeding each K from the K-1 centroids plus a D²-sampled
+    row, and keep that fit only when its inertia beats a k-means++ fit of the same K.
+    With a cache_dir, K values already fitted with the same matrix and settings are reused,
+    so extending the range only fits the new K values.
+    """
+
+    if method not in METHODS:
+        raise ValueError(f'Unknown method {method}. Please choose one of {METHODS}.')
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f'Unknown metrics {sorted(unknown)}. Please choose from {METRICS}.')
+
+    rng = np.random.default_rng(random_state)
+    sample = np.sort(rng.choice(matrix.shape[0], size=min(sample_size, matrix.shape[0]), replace=False))
+
+    cache = None
+    cached = {}
+    if cache_dir is not None:
+        settings = f'{matrix_fingerprint(matrix)}-{method}-{"warm" if warm_start else "cold"}-{"_".join(metrics)}-{sample_size}-{random_state}'
+        cache = SweepCache(cache_dir, hashlib.sha1(settings.encode('utf-8')).hexdigest()[:16])
+        cached = cache.results
+
+    counts = sorted(set(cluster_counts))
+    todo = [k for k in counts if k not in cached]
+    results = {}
+
+    if warm_start:
+        fitted = sorted(cached)
+        centroids = cache.last_centroids() if cache is not None and fitted else None
+        for k in todo:
+            if centroids is not None and centroids.shape[0] == k - 1:
+                # The warm seed alone can settle in a worse local minimum than a fresh fit, which would bend the elbow curve.
+                init = [next_centroids(matrix, centroids, sample, rng), 'k-means++']
+            else:
+                init = 'k-means++'
+            results[k], centroids = fit_k(matrix, k, method, sample, metrics, init, random_state)
+            if cache is not None:
+                cache.save({k: results[k]}, centroids)
+    elif todo:
+        workers = min(workers or os.cpu_count() or 1, len(todo))
+        if workers > 1:
+            with tempfile.TemporaryDirectory() as directory:
+                save_shared_matrix(matrix, directory)
+                tasks = [(directory, k, method, sample, metrics, random_state) for k in todo]
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    results = {result['k']: result for result in executor.map(_fit_shared, tasks)}
+        else:
+            results = {k: fit_k(matrix, k, method, sample, metrics, random_state=random_state)[0] for k in todo}
+        if cache is not None:
+            cache.save(results)
+
+    results.update({k: cached[k] for k in counts if k in cached})
+    return pd.DataFrame([results[k] for k in counts])
@@ -0,0 +1,128 @@
+import json
+import os
+import time
+
+import numpy as np
+import sklearn
+from scipy.sparse import csr_matrix, load_npz, save_npz
+from sklearn.cluster import KMeans
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+TERMS_FILE = 'terms.json'
+IDF_FILE = 'idf.npy'
+MATRIX_FILE = 'tfidf_matrix.npz'
+ROW_IDS_FILE = 'row_ids.npy'
+CENTROIDS_FILE = 'centroids.npy'
+META_FILE = 'meta.json'
+
+
+def version_dirs(models_dir: str) -> dict:
+    """
+    Map version numbers to their directories (models_dir/v1, models_dir/v2, ...).
+    """
+
+    if not os.path.isdir(models_dir):
+        return {}
+    return {int(name[1:]): os.path.join(models_dir, name) for name in os.listdir(models_dir)
+            if name.startswith('v') and name[1:].isdigit() and os.path.exists(os.path.join(models_dir, name, META_FILE))}
+
+
+def resolve_version(models_dir: str, version: int = None) -> str:
+    """
+    Directory of the requested model version, or of the latest one.
+    """
+
+    versions = version_dirs(models_dir)
+    if not versions:
+        raise FileNotFoundError(f"No saved models in '{models_dir}'.")
+    if version is None:
+        version = max(versions)
+    if version not in versions:
+        raise FileNotFoundError(f"Model version {version} does not exist in '{models_dir}'.")
+    return versions[version]
+
+
+def save_artifacts(models_dir: str, vectorizer: TfidfVectorizer, tfidf_matrix: csr_matrix, kmeans: KMeans, row_ids: np.ndarray,
+                   text_column: str) -> str:
+    """
+    Save the fitted vocabulary, IDF weights, TF-IDF matrix and centroids as the next model version.
+    Arrays are stored in plain NumPy/SciPy formats so they do not depend on pickled sklearn objects.
+    Returns the version directory.
+    """
+
+    version = max(version_dirs(models_dir), default=0) + 1
+    version_dir = os.path.join(models_dir, f'v{version}')
+    os.makedirs(version_dir)
+
+    with open(os.path.join(version_dir, TERMS_FILE), 'w') as f:
+        json.dump(vectorizer.get_feature_names_out().tolist(), f)
+    np.save(os.path.join(version_dir, IDF_FILE), vectorizer.idf_)
+    save_npz(os.path.join(version_dir, MATRIX_FILE), tfidf_matrix)
+    np.save(os.path.join(version_dir, ROW_IDS_FILE), np.asarray(row_ids, dtype=np.int64))
+    np.save(os.path.join(version_dir, CENTROIDS_FILE), kmeans.cluster_centers_)
+
+    vectorizer_params = {key: value for key, value in vectorizer.get_params().items()
+                         if key not in ('dtype', 'vocabulary') and isinstance(value, (str, int, float, bool, type(None), tuple, list))}
+    meta = {
+        'version': version,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'text_column': text_column,
+        'num_clusters': int(kmeans.n_clusters),
+        'n_reviews': int(tfidf_matrix.shape[0]),
+        'n_terms': int(tfidf_matrix.shape[1]),
+        'inertia': float(kmeans.inertia_),
+        'vectorizer_params': vectorizer_params,
+        'sklearn_version': sklearn.__version__,
+    }
+    with open(os.path.join(version_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    return version_dir
+
+
+class ClusterModel:
+    """
+    A saved TF-IDF + KMeans model that can vectorize and assign new reviews without refitting.
+    """
+
+    def __init__(self, version_dir: str):
+        self.version_dir = version_dir
+        with open(os.path.join(version_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(version_dir, TERMS_FILE)) as f:
+            terms = json.load(f)
+
+        params = dict(self.meta['vectorizer_params'])
+        if 'ngram_range' in params:
+            params['ngram_range'] = tuple(params['ngram_range'])
+        self.vectorizer = TfidfVectorizer(vocabulary=terms, **params)
+        self.vectorizer.idf_ = np.load(os.path.join(version_dir, IDF_FILE))
+
+        self.centroids = np.load(os.path.join(version_dir, CENTROIDS_FILE))
+        self._centroid_norms = (self.centroids ** 2).sum(axis=1)
+
+    @classmethod
+    def load(cls, models_dir: str, version: int = None) -> 'ClusterModel':
+        return cls(resolve_version(models_dir, version))
+
+    @property
+    def text_column(self) -> str:
+        return self.meta['text_column']
+
+    def transform(self, texts) -> csr_matrix:
+        return self.vectorizer.transform(np.asarray(texts).astype('U'))
+
+    def assign(self, texts) -> np.ndarray:
+        """
+        Nearest-centroid cluster for each text: argmin ||c||^2 - 2 x.c, as KMeans.predict does.
+        """
+
+        matrix = self.transform(texts)
+        return np.argmin(self._centroid_norms[None, :] - 2 * np.asarray(matrix @ self.centroids.T), axis=1)
+
+    def tfidf_matrix(self) -> tuple:
+        """
+        The saved training matrix and the review ids of its rows.
+        """
+
+        return load_npz(os.path.join(self.version_dir, MATRIX_FILE)), np.load(os.path.join(self.version_dir, ROW_IDS_FILE))
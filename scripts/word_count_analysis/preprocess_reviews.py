@@ -1,11 +1,59 @@
 import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
 
-import nltk
 import pandas as pd
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import add_rows, instrumented_run, measure
+from common.manifest import Manifest, merge_delta, stage_name
+from common.reviews import FINGERPRINT_COLUMN, REVIEW_ID_COLUMN, fingerprints, review_ids
+from common.table_io import TableWriter, append_columns, iter_batches, read_table, same_table, table_columns, write_table
+
+STAGE = 'preprocess'
+OUTPUT_COLUMN = 'Preprocessed_Review_Text'
+PUNCTUATION = re.compile(r'[^\w\s]')
+LEMMA_CACHE_SIZE = 200_000
+
+# NLTK packages the pipeline uses, with the resource path nltk.data.find looks them up by.
+NLTK_DATA = {
+    'stopwords': 'corpora/stopwords',
+    'wordnet': 'corpora/wordnet',
+    'punkt': 'tokenizers/punkt',
+    'vader_lexicon': 'sentiment/vader_lexicon.zip',
+}
+
+_stopwords = None
+_lemmatizer = None
+
+
+def get_stopwords() -> frozenset:
+    """
+    English stopwords as a set, built once per process.
+    """
+
+    global _stopwords
+    if _stopwords is None:
+        from nltk.corpus import stopwords
+        _stopwords = frozenset(stopwords.words('english'))
+    return _stopwords
+
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize(word: str) -> str:
+    """
+    WordNet lemma of a word, memoized with bounded LRU eviction.
+    """
+
+    global _lemmatizer
+    if _lemmatizer is None:
+        from nltk.stem import WordNetLemmatizer
+        _lemmatizer = WordNetLemmatizer()
+    return _lemmatizer.lemmatize(word)
 
 
 def preprocess_text(text: str) -> str:
@@ -19,39 +67,148 @@ def preprocess_text(text: str) -> str:
     - Joins the words back into a single string
     """
 
-    text = text.lower()
-    text = re.sub(r'[^\w\s]', '', text)
-    words = text.split()
-    words = [word for word in words if word not in stopwords.words('english')]
-    lemmatizer = WordNetLemmatizer()
-    words = [lemmatizer.lemmatize(word) for word in words]
-    text = ' '.join(words)
+    stop_words = get_stopwords()
+    words = PUNCTUATION.sub('', text.lower()).split()
+    text = ' '.join([lemmatize(word) for word in words if word not in stop_words])
 
     return text
 
 
-def main(input_csv: str, output_csv: str, overwrite: bool = False) -> None:
+def preprocess_texts(texts: list) -> list:
+    return [preprocess_text(text) for text in texts]
+
+
+def ensure_nltk_data(packages=tuple(NLTK_DATA)) -> None:
+    """
+    Download the NLTK packages that are not installed locally yet. Installed ones are found on disk
+    without a request to the NLTK index.
+    """
+
+    import nltk
+
+    for package in packages:
+        try:
+            nltk.data.find(NLTK_DATA[package])
+        except LookupError:
+            nltk.download(package)
+
+
+def preprocess_chunk(texts: list, executor: ProcessPoolExecutor = None, workers: int = 1) -> list:
+    """
+    Preprocess a list of texts, split across the process pool when there is one.
+    """
+
+    if executor is None:
+        return preprocess_texts(texts)
+
+    part_size = max(1, -(-len(texts) // (workers * 4)))
+    parts = [texts[start:start + part_size] for start in range(0, len(texts), part_size)]
+    return [text for part in executor.map(preprocess_texts, parts) for text in part]
+
+
+def preprocess_table(input_path: str, output_path: str, text_column: str = 'Review_Text', output_column: str = OUTPUT_COLUMN,
+                     chunksize: int = 50_000, workers: int = None) -> int:
     """
-    Main function to download necessary NLTK data, load the raw reviews,
-    preprocess the 'Review_Text' column, and save the preprocessed data.
+    Stream the input table in chunks, preprocess the text column and write each chunk to the output,
+    so memory stays bounded by the chunk size. With more than one worker, each chunk is split across
+    a process pool. When the output is the input's own column-group table, only the text column is read
+    and the preprocessed column is appended to it. Returns the number of rows written.
     """
 
-    if not os.path.exists(input_csv):
-        raise FileNotFoundError(f"The input file '{input_csv}' does not exist.")
+    append = same_table(input_path, output_path)
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    rows = 0
+
+    try:
+        with tqdm(desc='Preprocessing reviews', unit='reviews') as progress, TableWriter(output_path, append=append) as writer:
+            for chunk in iter_batches(input_path, [text_column] if append else None, chunksize):
+                texts = preprocess_chunk(chunk[text_column].to_list(), executor, workers)
+                writer.write(pd.DataFrame({output_column: texts}) if append else chunk.assign(**{output_column: texts}))
+                rows += chunk.shape[0]
+                add_rows(chunk.shape[0])
+                progress.update(chunk.shape[0])
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
-    if os.path.exists(output_csv) and not overwrite:
-        should_proceed = input(f"The output file '{output_csv}' already exists. Do you want to overwrite it? (y/n): ")
+    return rows
+
+
+def preprocess_delta(input_path: str, output_path: str, manifest: Manifest, text_column: str = 'Review_Text',
+                     output_column: str = OUTPUT_COLUMN, workers: int = None) -> int:
+    """
+    Preprocess only the reviews that are new or changed since the last run (according to the manifest)
+    and merge them into the existing output, dropping reviews that are gone from the input.
+    Returns the number of reviews preprocessed.
+    """
+
+    stage = stage_name(STAGE, output_path)
+    append = same_table(input_path, output_path)
+    df = read_table(input_path, [REVIEW_ID_COLUMN, FINGERPRINT_COLUMN, text_column] if append else None)
+    ids, prints = review_ids(df), fingerprints(df)
+    new, changed, removed = manifest.delta(stage, ids, prints)
+    pending = new | changed
+    print(f'Delta: {int(new.sum())} new, {int(changed.sum())} changed, {removed.shape[0]} removed reviews')
+
+    updates = df[pending].copy()
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 and updates.shape[0] > 1000 else nullcontext() as executor:
+        with measure('preprocess', rows=updates.shape[0]):
+            updates[output_column] = preprocess_chunk(updates[text_column].to_list(), executor, workers)
+
+    if append:
+        # The column is row-aligned with its table, so only the reprocessed rows change.
+        column = read_table(output_path, [output_column])
+        column.loc[pending, output_column] = updates[output_column].to_numpy()
+        append_columns(output_path, column)
+    else:
+        write_table(merge_delta(read_table(output_path), updates, ids), output_path)
+    manifest.mark(stage, ids[pending], prints[pending])
+    manifest.forget(stage, removed)
+    return updates.shape[0]
+
+
+def main(input_path: str, output_path: str, overwrite: bool = False, workers: int = None, manifest_path: str = None) -> None:
+    """
+    Main function to download any missing NLTK data, stream the raw reviews,
+    preprocess the 'Review_Text' column in parallel, and save the preprocessed data.
+    The input and output can be CSV, Parquet or column-group tables; giving a column-group table as both
+    appends the preprocessed column to it. With a manifest and an existing output, only new or changed
+    reviews are preprocessed.
+    """
+
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"The input file '{input_path}' does not exist.")
+
+    output_exists = (OUTPUT_COLUMN in table_columns(output_path) if same_table(input_path, output_path)
+                     else os.path.exists(output_path))
+    manifest = Manifest(manifest_path) if manifest_path is not None else None
+    has_fingerprints = FINGERPRINT_COLUMN in table_columns(input_path)
+    if manifest is not None and not has_fingerprints:
+        print(f"'{input_path}' has no content fingerprints; preprocessing every review.")
+
+    if manifest is not None and has_fingerprints and output_exists and not overwrite:
+        ensure_nltk_data()
+        with measure('delta'):
+            preprocess_delta(input_path, output_path, manifest, workers=workers)
+        manifest.close()
+        return
+
+    if output_exists and not overwrite:
+        should_proceed = input(f"The output file '{output_path}' already exists. Do you want to overwrite it? (y/n): ")
         if should_proceed.lower() != 'y':
-            sys.exit(f"Execution stopped. The output file '{output_csv}' already exists.")
+            sys.exit(f"Execution stopped. The output file '{output_path}' already exists.")
 
-    nltk.download('stopwords')
-    nltk.download('wordnet')
-    nltk.download('punkt')
-    nltk.download('vader_lexicon')
+    ensure_nltk_data()
+    with measure('preprocess'):
+        preprocess_table(input_path, output_path, workers=workers)
 
-    df = pd.read_csv(input_csv)
-    df['Preprocessed_Review_Text'] = df['Review_Text'].apply(lambda x: preprocess_text(x))
-    df.to_csv(output_csv, index=False)
+    if manifest is not None and has_fingerprints:
+        done = read_table(output_path, [REVIEW_ID_COLUMN, FINGERPRINT_COLUMN])
+        manifest.forget(stage_name(STAGE, output_path))
+        manifest.mark(stage_name(STAGE, output_path), review_ids(done), fingerprints(done))
+        manifest.close()
 
 
 if __name__ == '__main__':
@@ -61,6 +218,11 @@ if __name__ == '__main__':
     # input_csv = './data/cleaned_reviews.csv'
     # output_csv = './output/word_count_analysis/csv/preprocessed_reviews.csv'
 
+    # A column-group table as both input and output gets the preprocessed column appended in place:
+    # input_csv = output_csv = './output/word_count_analysis/tables/reviews'
+
+    manifest_path = './output/manifest.sqlite'  # Only new or changed reviews are preprocessed on reruns
     overwrite = False
 
-    main(input_csv, output_csv, overwrite)
+    with instrumented_run('preprocess_reviews'):
+        main(input_csv, output_csv, overwrite, manifest_path=manifest_path)
@@ -0,0 +1,172 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, load_npz, save_npz
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import add_rows, measure
+from common.table_io import TableWriter, iter_batches, same_table, table_columns
+
+N_FEATURES = 2 ** 18
+BATCH_SIZE = 20_000
+
+
+class StreamingTfidf:
+    """
+    TF-IDF over a hashed vocabulary, fitted one batch of term counts at a time.
+
+    Terms are hashed into n_features columns, so there is no vocabulary to hold in memory, and document
+    frequencies are accumulated per batch. The weighting matches TfidfVectorizer's defaults: raw counts
+    times the smoothed IDF ln((1 + n) / (1 + df)) + 1, then L2-normalized rows.
+    """
+
+    def __init__(self, n_features: int = N_FEATURES):
+        self.hasher = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+        self.document_frequency = np.zeros(n_features, dtype=np.int64)
+        self.n_documents = 0
+        self._idf = None
+
+    def counts(self, texts) -> csr_matrix:
+        return self.hasher.transform(np.asarray(texts).astype('U'))
+
+    def partial_fit(self, counts: csr_matrix) -> 'StreamingTfidf':
+        self.document_frequency += np.bincount(counts.indices, minlength=self.document_frequency.shape[0])
+        self.n_documents += counts.shape[0]
+        self._idf = None
+        return self
+
+    @property
+    def idf(self) -> np.ndarray:
+        if self._idf is None:
+            self._idf = np.log((1 + self.n_documents) / (1 + self.document_frequency)) + 1
+        return self._idf
+
+    def weight(self, counts: csr_matrix) -> csr_matrix:
+        counts = counts.astype(np.float64)
+        counts.data *= self.idf[counts.indices]
+        return normalize(counts)
+
+    def transform(self, texts) -> csr_matrix:
+        return self.weight(self.counts(texts))
+
+
+class HashedBatches:
+    """
+    Hashed term counts of a table's text column, computed in one streamed pass and spilled to disk one
+    sparse batch per file, so the IDF, K-means and assignment passes reload them instead of tokenizing
+    the texts again. Only one batch is in memory at a time.
+    """
+
+    def __init__(self, input_csv: str, vectorizer: StreamingTfidf, directory: str, text_column: str = 'Preprocessed_Review_Text',
+                 batch_size: int = BATCH_SIZE):
+        self.paths = []
+        for batch in tqdm(iter_batches(input_csv, [text_column], batch_size), desc='Hashing reviews', unit='batches'):
+            path = os.path.join(directory, f'counts-{len(self.paths):05d}.npz')
+            save_npz(path, vectorizer.counts(batch[text_column].fillna('').to_numpy()), compressed=False)
+            self.paths.append(path)
+            add_rows(batch.shape[0])
+
+    def __iter__(self):
+        for path in self.paths:
+            yield load_npz(path)
+
+
+def fit_idf(batches: HashedBatches, vectorizer: StreamingTfidf) -> StreamingTfidf:
+    for counts in batches:
+        vectorizer.partial_fit(counts)
+    return vectorizer
+
+
+def fit_kmeans(batches: HashedBatches, vectorizer: StreamingTfidf, num_clusters: int, n_passes: int = 2, minibatch_size: int = 4096,
+               random_state: int = 0) -> MiniBatchKMeans:
+    """
+    Mini-batch K-means over n_passes passes, each stored batch split into partial_fit steps of minibatch_size rows.
+    """
+
+    kmeans = MiniBatchKMeans(n_clusters=num_clusters, random_state=random_state, n_init=3, batch_size=minibatch_size)
+    for n_pass in range(n_passes):
+        for counts in tqdm(batches, desc=f'K={num_clusters} pass {n_pass + 1}/{n_passes}', unit='batches'):
+            matrix = vectorizer.weight(counts)
+            for start in range(0, matrix.shape[0], minibatch_size):
+                # The first step seeds the centroids with k-means++, so it needs at least num_clusters rows.
+                if not hasattr(kmeans, 'cluster_centers_') and matrix.shape[0] - start < num_clusters:
+                    continue
+                kmeans.partial_fit(matrix[start:start + minibatch_size])
+    return kmeans
+
+
+def predict(batches: HashedBatches, vectorizer: StreamingTfidf, kmeans: MiniBatchKMeans):
+    """
+    Yield (cluster labels, inertia) batch by batch.
+    """
+
+    centroids = kmeans.cluster_centers_
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for counts in batches:
+        matrix = vectorizer.weight(counts)
+        distances = np.asarray(matrix.multiply(matrix).sum(axis=1)) - 2 * np.asarray(matrix @ centroids.T) + centroid_norms[None, :]
+        labels = np.argmin(distances, axis=1)
+        yield labels, float(np.maximum(distances[np.arange(labels.shape[0]), labels], 0).sum())
+
+
+def cluster_streaming(input_csv: str, num_clusters: int, output_csv: str, text_column: str = 'Preprocessed_Review_Text',
+                      batch_size: int = BATCH_SIZE, n_passes: int = 2, n_features: int = N_FEATURES, random_state: int = 0) -> float:
+    """
+    Cluster the reviews without loading the corpus: hash the texts once (spilled to a temporary directory),
+    accumulate IDF statistics, run n_passes of mini-batch K-means, then write the Cluster column batch by batch:
+    appended to the input when it is the same column-group table as the output, otherwise written with the
+    input's columns. Memory is bounded by the batch size and the centroids, not the row count. Unlike the
+    in-memory path, rows keep the input order instead of being sorted by cluster. Returns the inertia.
+    """
+
+    same_path = os.path.normpath(input_csv) == os.path.normpath(output_csv)
+    append = same_table(input_csv, output_csv)
+    if same_path and not append:
+        raise ValueError(f"Streaming can only write the Cluster column into its input when it is a column-group table, not '{input_csv}'.")
+
+    vectorizer = StreamingTfidf(n_features)
+    with tempfile.TemporaryDirectory() as directory:
+        with measure('hash'):
+            batches = HashedBatches(input_csv, vectorizer, directory, text_column, batch_size)
+        with measure('fit'):
+            kmeans = fit_kmeans(batches, fit_idf(batches, vectorizer), num_clusters, n_passes, random_state=random_state)
+
+        columns = [column for column in table_columns(input_csv) if column != 'Cluster']
+        rows = None if append else iter_batches(input_csv, columns, batch_size)
+        inertia = 0.0
+        with measure('assign'), TableWriter(output_csv, append=append) as writer:
+            for labels, batch_inertia in predict(batches, vectorizer, kmeans):
+                inertia += batch_inertia
+                writer.write(pd.DataFrame({'Cluster': labels}) if append else next(rows).assign(Cluster=labels))
+                add_rows(labels.shape[0])
+
+    return inertia
+
+
+def sweep_streaming(input_csv: str, cluster_counts, text_column: str = 'Preprocessed_Review_Text', batch_size: int = BATCH_SIZE,
+                    n_passes: int = 1, n_features: int = N_FEATURES, random_state: int = 0) -> pd.DataFrame:
+    """
+    Streaming counterpart of k_sweep.sweep_k for the elbow plot: fit each K with mini-batch passes and
+    measure its inertia in one more pass. The texts are hashed and the IDF statistics accumulated once for all K.
+    """
+
+    vectorizer = StreamingTfidf(n_features)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        batches = HashedBatches(input_csv, vectorizer, directory, text_column, batch_size)
+        fit_idf(batches, vectorizer)
+        for k in sorted(set(cluster_counts)):
+            start = time.perf_counter()
+            kmeans = fit_kmeans(batches, vectorizer, k, n_passes, random_state=random_state)
+            inertia = sum(batch_inertia for _, batch_inertia in predict(batches, vectorizer, kmeans))
+            results.append({'k': k, 'inertia': inertia, 'n_passes': n_passes, 'fit_seconds': round(time.perf_counter() - start, 3)})
+
+    return pd.DataFrame(results)
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from common.table_io import write_table
+from word_count_analysis import analyze_clusters
+
+
+def test_missing_sentiment_file_falls_back_to_scoring(tmp_path, monkeypatch):
+    input_path = str(tmp_path / 'clusters.parquet')
+    write_table(pd.DataFrame({'Review_Id': [1, 2], 'Cluster': [0, 1], 'Preprocessed_Review_Text': ['great staff', 'long wait']}),
+                input_path)
+    scored, plotted = [], []
+    monkeypatch.setattr(analyze_clusters, 'score_texts', lambda texts, scorer: scored.append(texts) or pd.DataFrame({'Sentiment': [0.5, -0.5]}))
+    monkeypatch.setattr(analyze_clusters, 'render_plots', plotted.extend)
+
+    analyze_clusters.main(input_path, str(tmp_path / 'heatmap.png'), str(tmp_path / 'boxplot.png'),
+                          sentiment_csv=str(tmp_path / 'missing_sentiment.csv'))
+
+    assert scored == [['great staff', 'long wait']]
+    sentiments = plotted[1][1][0]
+    assert sentiments['Sentiment'].tolist() == [0.5, -0.5]
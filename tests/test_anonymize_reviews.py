@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from common.manifest import Manifest, stage_name
+from common.result_journal import ResultJournal
+from common.table_io import read_table, write_table
+from data_cleaning import anonymize_reviews
+
+
+def reviews(names: list) -> pd.DataFrame:
+    ids = {'gamma': 3, 'alpha': 1, 'beta': 2}
+    return pd.DataFrame({
+        'Review_Id': [ids[name] for name in names],
+        'Content_Fingerprint': [ids[name] * 10 for name in names],
+        'Clinic_Name': 'Clinic',
+        'Review_Text': [f'{name} text' for name in names],
+    })
+
+
+def test_journal_recovery_after_delta_reorders_rows(tmp_path):
+    """
+    A run that crashed after journaling a new review which sorts first in the input must, when rerun,
+    put the journaled text on that review's row, not on the row at the same position in the old output.
+    """
+
+    input_path = str(tmp_path / 'input.parquet')
+    output_path = str(tmp_path / 'output.parquet')
+    manifest_path = str(tmp_path / 'manifest.sqlite')
+    stage = stage_name(anonymize_reviews.STAGE, output_path)
+
+    # State after a completed first run over alpha and beta.
+    old = reviews(['alpha', 'beta'])
+    write_table(old.assign(Anonymized_Review_Text=['ANON:alpha text', 'ANON:beta text']), output_path)
+    manifest = Manifest(manifest_path)
+    manifest.mark(stage, old['Review_Id'].to_numpy(), old['Content_Fingerprint'].to_numpy())
+    manifest.close()
+
+    # gamma is added first in the input; the second run journaled it and crashed before writing the output.
+    write_table(reviews(['gamma', 'alpha', 'beta']), input_path)
+    journal = ResultJournal(output_path + '.journal.jsonl')
+    journal.append(3, 'ANON:gamma text')
+    journal.close()
+
+    asyncio.run(anonymize_reviews.main(input_path, output_path, 'unused-key', manifest_path=manifest_path, rule_pass=False))
+
+    result = read_table(output_path).set_index('Review_Id')['Anonymized_Review_Text']
+    assert result.to_dict() == {3: 'ANON:gamma text', 1: 'ANON:alpha text', 2: 'ANON:beta text'}
+    assert not os.path.exists(output_path + '.journal.jsonl')
+
+    manifest = Manifest(manifest_path)
+    assert sorted(manifest.processed(stage).index.to_numpy(dtype=np.int64).tolist()) == [1, 2, 3]
+    manifest.close()
+
+
+@pytest.mark.parametrize('body', [{}, {'choices': []}, {'choices': [{}]}, {'choices': [{'message': {'content': None}}]},
+                                  {'choices': [{'message': {'content': '  '}}]}, None])
+def test_malformed_completion_raises_anonymization_error(body):
+    with pytest.raises(anonymize_reviews.AnonymizationError):
+        anonymize_reviews.completion_content(body)
+
+
+def test_journal_record_after_torn_line_is_kept(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = ResultJournal(path)
+    journal.append(1, 'first')
+    journal.close()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"row_id": 2, "val')
+
+    journal = ResultJournal(path)
+    journal.append(3, 'third')
+    assert journal.read() == {1: 'first', 3: 'third'}
+    journal.close()
@@ -0,0 +1,52 @@
+import os
+import sys
+import zlib
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from benchmarks.fake_openai_server import FakeOpenAIState, fake_embedding, start_server
+from common.table_io import write_table
+from embedding_analysis import generate_embeddings
+from embedding_analysis.embedding_journal import EmbeddingJournal
+from embedding_analysis.embedding_store import EmbeddingStore
+
+
+def reviews(texts: dict) -> pd.DataFrame:
+    return pd.DataFrame({
+        'Review_Id': list(texts),
+        'Content_Fingerprint': [zlib.crc32(text.encode('utf-8')) for text in texts.values()],
+        'Anonymized_Review_Text': list(texts.values()),
+    })
+
+
+def test_changed_review_is_not_merged_from_stale_journal(tmp_path):
+    """
+    A journal record left by an interrupted run for a review whose text has changed since must not be
+    merged into the store in place of an embedding of the new text.
+    """
+
+    input_path = str(tmp_path / 'input.parquet')
+    store_dir = str(tmp_path / 'store')
+    manifest_path = str(tmp_path / 'manifest.sqlite')
+    dim = generate_embeddings.EMBEDDING_DIM
+
+    server = start_server(FakeOpenAIState(dim=dim, latency=0))
+    url = f'http://{server.server_address[0]}:{server.server_address[1]}/v1/embeddings'
+    try:
+        write_table(reviews({1: 'first text', 2: 'second text'}), input_path)
+        generate_embeddings.main(input_path, store_dir, 'fake-key', url=url, manifest_path=manifest_path)
+
+        # An interrupted run journaled review 1 with its old text, then the text changed.
+        journal = EmbeddingJournal(os.path.join(store_dir, generate_embeddings.JOURNAL_FILE), dim)
+        journal.append([1], [fake_embedding('first text', dim)])
+        journal.close()
+        write_table(reviews({1: 'first text, edited', 2: 'second text'}), input_path)
+        generate_embeddings.main(input_path, store_dir, 'fake-key', url=url, manifest_path=manifest_path)
+    finally:
+        server.shutdown()
+
+    row_ids, matrix = EmbeddingStore(store_dir).load(np.array([1, 2]))
+    np.testing.assert_allclose(matrix[0], fake_embedding('first text, edited', dim), atol=1e-6)
+    np.testing.assert_allclose(matrix[1], fake_embedding('second text', dim), atol=1e-6)
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from benchmarks.synthetic import synthetic_topic_reviews
+from word_count_analysis.k_sweep import sweep_k
+
+
+def test_warm_start_inertia_matches_cold():
+    """
+    Warm-started K values must not settle in worse minima than cold fits, or the elbow curve is distorted.
+    """
+
+    texts, _ = synthetic_topic_reviews(5000)
+    matrix = TfidfVectorizer().fit_transform(texts).tocsr()
+    counts = range(2, 11)
+
+    warm = sweep_k(matrix, counts, warm_start=True, metrics=(), workers=1)
+    cold = sweep_k(matrix, counts, warm_start=False, metrics=(), workers=1)
+
+    np.testing.assert_array_less(warm['inertia'].to_numpy(), cold['inertia'].to_numpy() * 1.02)
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from data_cleaning.rule_anonymizer import RuleAnonymizer
+
+CORPUS = ['the staff were great and the clinic was clean.', 'highly recommend the clinic, the visit was great.',
+          'the doctor was kind and i would recommend the staff.'] * 2
+
+
+def anonymizer(texts: list = ()) -> RuleAnonymizer:
+    texts = list(texts) + CORPUS
+    return RuleAnonymizer.from_reviews(pd.DataFrame({'Clinic_Name': 'Smile_Dental', 'State_Province': 'Ontario', 'Review_Text': texts}))
+
+
+def test_redacts_names_titles_and_pronouns():
+    text = 'She said Dr. Lee at Smile Dental in Ontario fixed her tooth. He was great.'
+    assert anonymizer([text]).anonymize(text) == ('X said X at X in X fixed X tooth. X was great.', False)
+
+
+@pytest.mark.parametrize('text, redacted', [
+    ('DR. SMITH is the best.', 'X is the best.'),
+    ('I saw dr patel today.', 'I saw X today.'),
+])
+def test_redacts_titled_names_in_any_case(text, redacted):
+    assert anonymizer([text]).anonymize(text) == (redacted, False)
+
+
+@pytest.mark.parametrize('text', [
+    'Jessica was wonderful. Highly recommend!',
+    'Great visit. Jessica cleaned my teeth.',
+    'The staff were great, thanks to JESSICA.',
+    'The staff at the clinic in Guelph were kind.',
+    'The doctor patel was kind.',
+])
+def test_unknown_names_are_routed_to_llm(text):
+    assert anonymizer([text]).anonymize(text)[1]
+
+
+def test_ordinary_review_stays_local():
+    text = 'Great visit. The doctor was kind and I would recommend the clinic!'
+    assert anonymizer([text]).anonymize(text) == (text, False)
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from common.table_io import write_table
+from sentiment_analysis.score_sentiment import attach_sentiments
+
+
+def test_attach_sentiments_joins_by_review_id_after_reordering(tmp_path):
+    sentiment_path = str(tmp_path / 'sentiment.parquet')
+    write_table(pd.DataFrame({'Review_Id': [10, 20, 30], 'Sentiment': [0.1, 0.2, 0.3]}), sentiment_path)
+
+    clustered = pd.DataFrame({'Review_Id': [30, 10, 20], 'Cluster': [0, 1, 1]})
+    assert attach_sentiments(clustered, sentiment_path)['Sentiment'].to_list() == [0.3, 0.1, 0.2]
+
+
+def test_attach_sentiments_refuses_tables_without_review_ids(tmp_path):
+    sentiment_path = str(tmp_path / 'sentiment.parquet')
+    write_table(pd.DataFrame({'Review_Id': [0, 1], 'Sentiment': [0.1, 0.2]}), sentiment_path)
+    with pytest.raises(ValueError, match='Review_Id'):
+        attach_sentiments(pd.DataFrame({'Cluster': [1, 0]}), sentiment_path)
+
+    positional_path = str(tmp_path / 'positional.parquet')
+    write_table(pd.DataFrame({'Sentiment': [0.1, 0.2]}), positional_path)
+    with pytest.raises(ValueError, match='Review_Id'):
+        attach_sentiments(pd.DataFrame({'Review_Id': [0, 1]}), positional_path)
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from common.table_io import TableWriter, iter_batches, read_table, write_table
+
+
+def reviews(count: int) -> pd.DataFrame:
+    return pd.DataFrame({'Review_Id': range(count), 'Review_Text': [f'review {i}' for i in range(count)]})
+
+
+def rewrite_in_place(path: str, batch_size: int = 10) -> None:
+    with TableWriter(path) as writer:
+        for batch in iter_batches(path, batch_size=batch_size):
+            writer.write(batch.assign(Length=batch['Review_Text'].str.len()))
+
+
+@pytest.mark.parametrize('name', ['reviews.csv', 'reviews.parquet', 'reviews_table'])
+def test_streaming_rewrite_of_own_input_keeps_rows(tmp_path, name):
+    path = str(tmp_path / name)
+    write_table(reviews(35), path)
+
+    rewrite_in_place(path)
+
+    result = read_table(path)
+    assert result['Review_Id'].tolist() == list(range(35))
+    assert 'Length' in result.columns
+    assert os.listdir(tmp_path) == [name]
+
+
+def test_streaming_rewrite_of_parquet_dataset(tmp_path):
+    path = str(tmp_path / 'dataset')
+    ds.write_dataset(pa.Table.from_pandas(reviews(35)), path, format='parquet', max_rows_per_file=10, max_rows_per_group=10)
+
+    rewrite_in_place(path)
+
+    assert read_table(path)['Review_Id'].tolist() == list(range(35))
+
+
+def test_failed_write_leaves_existing_table(tmp_path):
+    path = str(tmp_path / 'reviews_table')
+    write_table(reviews(5), path)
+
+    with pytest.raises(RuntimeError):
+        with TableWriter(path) as writer:
+            writer.write(reviews(3))
+            raise RuntimeError('interrupted')
+
+    assert read_table(path).shape[0] == 5
+    assert os.listdir(tmp_path) == ['reviews_table']